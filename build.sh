@@ -11,6 +11,7 @@ pip install -r django_backend/requirements.txt
 export PYTHONPATH="${PYTHONPATH:-}:$(pwd)"
 
 echo "⚙️ Applying migrations..."
+python django_backend/manage.py record_baseline_migration
 python django_backend/manage.py migrate --noinput
 
 echo "📦 Collecting static files..."
@@ -0,0 +1,78 @@
+"""
+PostgreSQL backend that takes connections from an in-process psycopg2 pool instead of
+opening a new one (TCP + TLS + auth) per request. Meant for ASGI deployments, where
+Django's persistent connections are tied to short-lived threads; enable with DB_POOL.
+"""
+import os
+import threading
+import psycopg2.extras
+from django.conf import settings
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from psycopg2.pool import ThreadedConnectionPool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    ThreadedConnectionPool that waits up to DB_POOL_TIMEOUT for a free connection instead
+    of failing immediately when all DB_POOL_MAX_SIZE connections are checked out.
+    """
+
+    def __init__(self, conn_params):
+        self.pool = ThreadedConnectionPool(settings.DB_POOL_MIN_SIZE, settings.DB_POOL_MAX_SIZE, **conn_params)
+        self.slots = threading.BoundedSemaphore(settings.DB_POOL_MAX_SIZE)
+
+    def getconn(self):
+        if not self.slots.acquire(timeout=settings.DB_POOL_TIMEOUT):
+            raise OperationalError(
+                f"No database connection available within {settings.DB_POOL_TIMEOUT}s; raise DB_POOL_MAX_SIZE."
+            )
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, connection):
+        try:
+            self.pool.putconn(connection, close=bool(connection.closed))
+        finally:
+            self.slots.release()
+
+
+def get_pool(alias, conn_params):
+    # Keyed by pid as well: forked workers must never share pooled sockets
+    key = (alias, os.getpid())
+    if key not in _pools:
+        with _pools_lock:
+            if key not in _pools:
+                _pools[key] = ConnectionPool(conn_params)
+    return _pools[key]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = base.IsolationLevel(options.get("isolation_level", base.IsolationLevel.READ_COMMITTED))
+        connection = get_pool(self.alias, conn_params).getconn()
+        if "isolation_level" in options:
+            connection.isolation_level = self.isolation_level
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        # Return the connection to the pool; the pool rolls back any open transaction
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                get_pool(self.alias, self.get_connection_params()).putconn(self.connection)
+
+    def unpooled_copy(self):
+        """
+        Plain PostgreSQL wrapper for the same database, which opens and closes its own
+        connections (for benchmarks comparing against the pool).
+        """
+        return base.DatabaseWrapper(self.settings_dict.copy(), self.alias)
@@ -0,0 +1,22 @@
+import os
+
+# Gunicorn settings: gunicorn -c django_backend/gunicorn.conf.py django_backend.wsgi:application
+# Bind address and worker count come from gunicorn's own PORT / WEB_CONCURRENCY handling.
+
+# Load the app once in the master and fork workers from it, so they share the imported
+# modules copy-on-write and boot without importing anything themselves
+preload_app = os.getenv("GUNICORN_PRELOAD", "True").lower() == "true"
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    from django.db import connections
+    from django.urls import get_resolver
+
+    # The URLconf is otherwise imported on each worker's first request, with every view,
+    # serializer and app module behind it
+    get_resolver().url_patterns
+    # Connections opened while loading must not be inherited by the workers
+    connections.close_all()
+    server.log.info("Preloaded the URLconf before forking workers.")
@@ -0,0 +1,16 @@
+import logging
+import os
+
+
+class LazyFileHandler(logging.FileHandler):
+    """
+    FileHandler that creates its directory and opens the file on the first record,
+    instead of while settings are configured at every process start.
+    """
+
+    def __init__(self, filename, mode='a', encoding=None, errors=None):
+        super().__init__(filename, mode, encoding, delay=True, errors=errors)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
@@ -27,10 +27,72 @@ STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY", "")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 
 # === Database ===
+# Persistent connections: reuse each worker's connection (and its TLS session) across requests
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", 600))
+DB_CONN_HEALTH_CHECKS = os.getenv("DB_CONN_HEALTH_CHECKS", "True").lower() == "true"
+# In-process connection pool for Postgres, mainly for ASGI; connections return to the pool per request
+DB_POOL = os.getenv("DB_POOL", "False").lower() == "true"
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+
+DB_CONNECTION_OPTIONS = {
+    "conn_max_age": 0 if DB_POOL else DB_CONN_MAX_AGE,
+    "conn_health_checks": DB_CONN_HEALTH_CHECKS,
+}
+
 DATABASES = {
-    "default": dj_database_url.config(default="sqlite:///" + str(BASE_DIR / "db.sqlite3"))
+    "default": dj_database_url.config(
+        default="sqlite:///" + str(BASE_DIR / "db.sqlite3"), **DB_CONNECTION_OPTIONS
+    )
 }
 
+# Optional read replicas, e.g. DATABASE_REPLICA_URLS=postgres://replica-1/db,sqlite:///replica.sqlite3
+DATABASE_REPLICAS = []
+for index, url in enumerate(u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()):
+    alias = f"replica_{index + 1}"
+    DATABASES[alias] = dj_database_url.parse(url, **DB_CONNECTION_OPTIONS)
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(alias)
+
+# Optional customer shards, e.g. DATABASE_SHARD_URLS=postgres://shard-1/db,sqlite:///shard1.sqlite3.
+# Customer-owned tables (carts, orders, invoices, payments, addresses, ratings) then live on the
+# owning customer's shard; 'default' keeps everything else and is the first shard.
+DATABASE_SHARDS = []
+for index, url in enumerate(u.strip() for u in os.getenv("DATABASE_SHARD_URLS", "").split(",") if u.strip()):
+    alias = f"shard_{index + 1}"
+    DATABASES[alias] = dj_database_url.parse(url, **DB_CONNECTION_OPTIONS)
+    DATABASE_SHARDS.append(alias)
+# Shards new customers are spread over by id (default: all, including 'default')
+SHARD_NEW_CUSTOMERS = [a.strip() for a in os.getenv("SHARD_NEW_CUSTOMERS", "").split(",") if a.strip()]
+# Ids on the Nth shard start at N * SHARD_ID_SPAN, so they stay unique when customers move
+SHARD_ID_SPAN = int(os.getenv("SHARD_ID_SPAN", 10 ** 12))
+SHARD_MAP_TTL = int(os.getenv("SHARD_MAP_TTL", 3600))  # Shard map entries cached in the shared cache
+# move_customer waits this long twice so no request or task still uses the old map entry
+SHARD_MOVE_GRACE_SECONDS = float(os.getenv("SHARD_MOVE_GRACE_SECONDS", 60))
+
+DATABASE_ROUTERS = (["shop.sharding.CustomerShardRouter"] if DATABASE_SHARDS else []) + (
+    ["shop.routers.ReadReplicaRouter"] if DATABASE_REPLICAS else []
+)
+
+if DB_POOL:
+    for config in DATABASES.values():
+        if config["ENGINE"] == "django.db.backends.postgresql":
+            config["ENGINE"] = "django_backend.db.pooled_postgresql"
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 5))  # Read-your-writes window after a write
+REPLICA_RETRY_SECONDS = int(os.getenv("REPLICA_RETRY_SECONDS", 30))  # How long an unreachable replica is skipped
+
+# === Cache ===
+# Shared across workers when REDIS_URL is set (requires the redis package), else per-process memory
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": os.getenv("REDIS_URL")}
+    }
+else:
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "greencart"}
+    }
+
 # === Installed Apps ===
 INSTALLED_APPS = [
     "jazzmin",
@@ -45,6 +107,7 @@ INSTALLED_APPS = [
     "rest_framework_simplejwt",
     "rest_framework_simplejwt.token_blacklist",
     "drf_yasg",
+    "django_filters",
     "storages",
     "shop",
     ]
@@ -53,17 +116,26 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "shop.middleware.CompressionMiddleware",  # Before anything that reads or writes the body
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "shop.middleware.ReplicaRoutingMiddleware",
+    "shop.middleware.CustomerShardMiddleware",
 ]
 
+# === Compression ===
+# Encodings offered in order of preference; br and zstd need the brotli / zstandard packages
+COMPRESSION_ENCODINGS = os.getenv("COMPRESSION_ENCODINGS", "br,zstd,gzip").split(",")
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))  # Bytes; smaller bodies are sent as is
+
 # === URL + WSGI ===
 ROOT_URLCONF = "django_backend.urls"  # Updated to include the correct module path
 WSGI_APPLICATION = "django_backend.wsgi.application"
+ASGI_APPLICATION = "django_backend.asgi.application"
 
 # === Templates ===
 TEMPLATES = [
@@ -103,6 +175,34 @@ if not DEBUG:
     AWS_S3_CUSTOM_DOMAIN = f"{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com"
     MEDIA_URL = f"https://{AWS_S3_CUSTOM_DOMAIN}/"
 
+# === Admin ===
+# Performance mode: auto list_select_related, estimated counts, autocomplete FKs, limited inlines
+ADMIN_PERFORMANCE_MODE = os.getenv("ADMIN_PERFORMANCE_MODE", "True").lower() == "true"
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv("ADMIN_ESTIMATED_COUNT_THRESHOLD", 100000))
+ADMIN_INLINE_MAX_ROWS = int(os.getenv("ADMIN_INLINE_MAX_ROWS", 20))
+# Bulk actions above the sync limit run as chunked background jobs
+BULK_ACTION_SYNC_LIMIT = int(os.getenv("BULK_ACTION_SYNC_LIMIT", 1000))
+BULK_ACTION_CHUNK_SIZE = int(os.getenv("BULK_ACTION_CHUNK_SIZE", 500))
+
+# === Product Image Variants ===
+# Resized WebP/JPEG variants generated by the task workers after upload
+PRODUCT_IMAGE_VARIANTS = {
+    "thumbnail": (200, 200),
+    "medium": (600, 600),
+}
+IMAGE_VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", 2))
+
+# === Archival ===
+# Default age for `manage.py archive_orders`
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", 12))
+
+# === Sales Rollups ===
+# `manage.py refresh_sales_rollups` always recomputes at least this many trailing days
+SALES_ROLLUP_REFRESH_DAYS = int(os.getenv("SALES_ROLLUP_REFRESH_DAYS", 2))
+
+# === Invoices ===
+INVOICE_RENDER_PROCESSES = int(os.getenv("INVOICE_RENDER_PROCESSES", 2))
+
 # === CORS ===
 CORS_ALLOW_ALL_ORIGINS = DEBUG
 if not DEBUG:
@@ -111,7 +211,7 @@ if not DEBUG:
 else:
     CORS_ALLOWED_ORIGINS = ["http://localhost:3000", "http://127.0.0.1:3000"]
 
-CORS_ALLOW_HEADERS = list(default_headers) + ["authorization"]
+CORS_ALLOW_HEADERS = list(default_headers) + ["authorization", "idempotency-key"]
 CORS_ALLOW_CREDENTIALS = True
 
 # === Authentication ===
@@ -121,7 +221,32 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ["rest_framework.permissions.IsAuthenticated"],
     "DEFAULT_AUTHENTICATION_CLASSES": ["rest_framework_simplejwt.authentication.JWTAuthentication"],
     "DEFAULT_SCHEMA_CLASS": "rest_framework.schemas.coreapi.AutoSchema",
+    "DEFAULT_RENDERER_CLASSES": [
+        "shop.renderers.FastJSONRenderer",  # orjson when installed, else the stock encoder
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_FILTER_BACKENDS": [
+        "django_filters.rest_framework.DjangoFilterBackend",
+        "rest_framework.filters.SearchFilter",
+        "rest_framework.filters.OrderingFilter",
+    ],
+    "DEFAULT_THROTTLE_CLASSES": [
+        "shop.throttling.AnonBucketThrottle",
+        "shop.throttling.CustomerBucketThrottle",
+        "shop.throttling.ScopedBucketThrottle",
+    ],
+    # Token bucket rates ("N/s|min|hour|day"); an empty env value disables that limit
+    "DEFAULT_THROTTLE_RATES": {
+        "anon": os.getenv("THROTTLE_ANON_RATE", "120/min") or None,
+        "user": os.getenv("THROTTLE_USER_RATE", "600/min") or None,
+        "catalog": os.getenv("THROTTLE_CATALOG_RATE", "300/min") or None,
+        "auth": os.getenv("THROTTLE_AUTH_RATE", "10/min") or None,
+    },
+    # Proxies in front of the app, so client IPs are read from X-Forwarded-For safely
+    "NUM_PROXIES": int(os.environ["NUM_PROXIES"]) if os.getenv("NUM_PROXIES") else None,
 }
+# Cache alias holding the throttle buckets; per-process buckets are used while it is down
+THROTTLE_CACHE = os.getenv("THROTTLE_CACHE", "default")
 
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=30),
@@ -140,11 +265,14 @@ EMAIL_PORT = int(os.getenv("EMAIL_PORT", 587))
 EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
+DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", EMAIL_HOST_USER or "noreply@greencart.local")
 
-# === Logging ===
-logs_path = BASE_DIR / "logs"
-logs_path.mkdir(parents=True, exist_ok=True)
+# === Task Queue ===
+# Database-backed queue; workers run with `python manage.py run_tasks`
+TASK_QUEUE_EAGER = os.getenv("TASK_QUEUE_EAGER", "False").lower() == "true"  # Run tasks inline at commit
+TASK_QUEUE_LOCK_TIMEOUT = int(os.getenv("TASK_QUEUE_LOCK_TIMEOUT", 600))  # Reclaim tasks of dead workers
 
+# === Logging ===
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -155,7 +283,7 @@ LOGGING = {
     "handlers": {
         "console": {"class": "logging.StreamHandler", "formatter": "verbose"},
         "file": {
-            "class": "logging.FileHandler",
+            "class": "django_backend.log.LazyFileHandler",  # Creates logs/ on the first record
             "filename": BASE_DIR / "logs/debug.log",
             "formatter": "verbose",
         },
@@ -167,6 +295,64 @@ LOGGING = {
     },
 }
 
+# === Catalog ===
+# Upper bounds of the price-range facet buckets; the last bucket is open-ended
+CATALOG_PRICE_BUCKETS = [int(v) for v in os.getenv("CATALOG_PRICE_BUCKETS", "10,25,50,100").split(",") if v]
+CATALOG_FACET_TTL = int(os.getenv("CATALOG_FACET_TTL", 600))
+# /products/<id>/related/: items kept per product, and how long a blob lives without changes
+RELATED_PRODUCTS_LIMIT = int(os.getenv("RELATED_PRODUCTS_LIMIT", 12))
+RELATED_PRODUCTS_TTL = int(os.getenv("RELATED_PRODUCTS_TTL", 24 * 3600))
+# /products/batch/ and /orders/batch/: ids per request, and how long a cached representation lives
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", 200))
+BATCH_CACHE_TTL = int(os.getenv("BATCH_CACHE_TTL", 3600))
+
+# === Stock Alerts ===
+# Reorder point used when neither the product nor its category sets one
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", 5))
+STOCK_ALERT_SINKS = os.getenv(
+    "STOCK_ALERT_SINKS",
+    "shop.stock.DatabaseSink,shop.stock.OutboxSink,shop.stock.WebhookSink,shop.stock.LoggingSink",
+).split(",")
+STOCK_ALERT_WEBHOOK_URL = os.getenv("STOCK_ALERT_WEBHOOK_URL", "")
+
+# === Outbox ===
+# `manage.py relay_outbox` publishes order, transaction and stock events through this transport
+OUTBOX_TRANSPORT = os.getenv("OUTBOX_TRANSPORT", "shop.outbox.FileTransport")
+OUTBOX_FILE = os.getenv("OUTBOX_FILE", str(BASE_DIR / "logs/outbox.ndjson"))
+OUTBOX_HTTP_URL = os.getenv("OUTBOX_HTTP_URL", "")
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", 7))
+# Events younger than this are held back from /events/ so a slower transaction cannot
+# commit a lower id behind a consumer's cursor
+OUTBOX_CURSOR_LAG_SECONDS = float(os.getenv("OUTBOX_CURSOR_LAG_SECONDS", 2))
+
+# === Order Stream ===
+# /orders/<id>/stream/ (server-sent events) closes after this many seconds; clients reconnect
+ORDER_STREAM_TIMEOUT = int(os.getenv("ORDER_STREAM_TIMEOUT", 300))
+# How often an open stream re-reads the order to catch changes made by other processes
+ORDER_STREAM_RECHECK_SECONDS = float(os.getenv("ORDER_STREAM_RECHECK_SECONDS", 5))
+ORDER_STREAM_RETRY_MS = int(os.getenv("ORDER_STREAM_RETRY_MS", 3000))
+# Under WSGI a stream would hold a worker, so it sends the current state and the client
+# reconnects after this many milliseconds (short polling)
+ORDER_STREAM_POLL_MS = int(os.getenv("ORDER_STREAM_POLL_MS", 5000))
+# Lifetime of the single-order tokens from /orders/<id>/stream-token/, checked on connect
+ORDER_STREAM_TOKEN_LIFETIME = int(os.getenv("ORDER_STREAM_TOKEN_LIFETIME", 60))
+
+# === Idempotency ===
+# Seconds a stored response is replayed for retries carrying the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", 24 * 3600))
+# How long a duplicate waits for the original request to finish before getting a 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 10))
+# A key still IN_PROGRESS this long after its claim (the request died) is taken over by a retry
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", 120))
+
+# === Carts ===
+# Seconds a priced cart summary is memoized (it is also keyed by the cart's database version and the price version)
+CART_SUMMARY_TTL = int(os.getenv("CART_SUMMARY_TTL", 3600))
+
+# === Coupons ===
+# Seconds between cross-process freshness checks of the in-memory active coupon index
+COUPON_INDEX_CHECK_INTERVAL = int(os.getenv("COUPON_INDEX_CHECK_INTERVAL", 30))
+
 # === Swagger ===
 SWAGGER_SETTINGS = {
     "SECURITY_DEFINITIONS": {
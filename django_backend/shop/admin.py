@@ -1,13 +1,27 @@
 from django.contrib import admin
 from django import forms
+from django.conf import settings
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.utils import unquote
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.forms.models import BaseInlineFormSet
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html
 import logging
 
+from .bulk import start_bulk_action
 from .models import (
     Customer, Category, CartItem, Order, Invoice, Transaction,
     PaymentMethod, OrderItem, ProductRating, ProductRecommendation, Product,
-    Address, Coupon
+    Address, Coupon, BulkJob, Task, StockAlert
 )
+from .sharding import across_shards, fan_out, is_sharded, locate, route_request, shard_for
 
 logger = logging.getLogger(__name__)
 
@@ -26,53 +40,209 @@ class CustomerAdminForm(forms.ModelForm):
             raise forms.ValidationError("Phone number must start with '+'")
         return phone
 
-class CartItemInline(admin.TabularInline):
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses the Postgres planner estimate (pg_class.reltuples) instead of
+    COUNT(*) for unfiltered changelists on large tables.
+    """
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if settings.ADMIN_PERFORMANCE_MODE and not queryset.query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                        [queryset.model._meta.db_table],
+                    )
+                    row = cursor.fetchone()
+                if row and row[0] >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                    return row[0]
+        return super().count
+
+class ShardFanOutPaginator(EstimatedCountPaginator):
+    """
+    Paginator for changelists of customer-owned tables: while sharding is on, it counts
+    every shard and merges each page from all of them in the changelist ordering.
+    """
+    @cached_property
+    def count(self):
+        if not is_sharded(self.object_list.model):
+            return super().count
+        return sum(EstimatedCountPaginator(queryset, self.per_page).count for queryset in across_shards(self.object_list))
+
+    def page(self, number):
+        if not is_sharded(self.object_list.model):
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        # Each shard's first `top` rows hold every row of the merged page
+        return self._get_page(fan_out(self.object_list[:top])[bottom:top], number, self)
+
+class ShardFanOutChangeList(ChangeList):
+    """
+    Changelist whose unpaginated results (a single page, or "Show all") also come from
+    every shard; paginated ones come from ShardFanOutPaginator.
+    """
+    def get_results(self, request):
+        super().get_results(request)
+        if is_sharded(self.model) and not isinstance(self.result_list, list):
+            self.result_list = fan_out(self.queryset)
+
+class ShardRoutingMixin:
+    """
+    Send change, delete and history pages (and their inlines) to the shard holding the
+    object, or to a customer's shard, instead of the staff user's own.
+    """
+    def route_to_object(self, object_id):
+        if not settings.DATABASE_SHARDS or object_id is None:
+            return
+        if self.model._meta.label == settings.AUTH_USER_MODEL:
+            alias = shard_for(unquote(object_id))
+        elif is_sharded(self.model):
+            alias = locate(self.model, unquote(object_id))
+        else:
+            return
+        if alias:
+            route_request(alias)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        self.route_to_object(object_id)
+        return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        self.route_to_object(object_id)
+        return super().delete_view(request, object_id, extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        self.route_to_object(object_id)
+        return super().history_view(request, object_id, extra_context)
+
+class LimitedInlineFormSet(BaseInlineFormSet):
+    """
+    Inline formset showing only the most recent ADMIN_INLINE_MAX_ROWS related rows.
+    """
+    def get_queryset(self):
+        # Cached like the base class does, so every form reuses the one evaluated slice
+        if not hasattr(self, '_queryset'):
+            queryset = super().get_queryset()
+            if settings.ADMIN_PERFORMANCE_MODE:
+                queryset = queryset.order_by('-pk')[:settings.ADMIN_INLINE_MAX_ROWS]
+            self._queryset = queryset
+        return self._queryset
+
+class LimitedInlineMixin:
+    formset = LimitedInlineFormSet
+    show_change_link = True
+
+class CartItemInline(LimitedInlineMixin, admin.TabularInline):
     model = CartItem
     extra = 0
     readonly_fields = ('product', 'quantity', 'added_at')
     can_delete = False
 
-class OrderItemInline(admin.StackedInline):
+class OrderItemInline(LimitedInlineMixin, admin.StackedInline):
     model = OrderItem
     extra = 0
     readonly_fields = ('product', 'quantity', 'price')
 
-class OrderInline(admin.StackedInline):
+class OrderInline(LimitedInlineMixin, admin.StackedInline):
     model = Order
     extra = 0
     readonly_fields = ('status', 'total_amount', 'created_at')
     show_change_link = True
 
-class PaymentMethodInline(admin.TabularInline):
+class PaymentMethodInline(LimitedInlineMixin, admin.TabularInline):
     model = PaymentMethod
     extra = 0
     readonly_fields = ('id', 'customer', 'method_type', 'number', 'added_at')
     fields = ('id', 'customer', 'method_type', 'number', 'added_at')
 
-class AddressInline(admin.TabularInline):
+class AddressInline(LimitedInlineMixin, admin.TabularInline):
     model = Address
     extra = 0
     readonly_fields = ('street', 'city', 'state', 'postal_code', 'country', 'is_default', 'created_at')
     can_delete = False
 
-class TransactionInline(admin.TabularInline):
+class TransactionInline(LimitedInlineMixin, admin.TabularInline):
     model = Transaction
     extra = 0
     readonly_fields = ('transaction_id', 'amount', 'transaction_date', 'stripe_payment_intent_id')
     can_delete = False
 
-class InvoiceInline(admin.TabularInline):
+class InvoiceInline(LimitedInlineMixin, admin.TabularInline):
     model = Invoice
     extra = 0
     readonly_fields = ('order', 'customer', 'total_amount', 'issued_at')
     can_delete = False
 
-class BaseAdmin(admin.ModelAdmin):
+class PriceChangeActionForm(ActionForm):
+    """
+    Action form with the percentage used by the reprice action (e.g. 10 or -15).
+    """
+    percent = forms.DecimalField(required=False, max_digits=5, decimal_places=2, label='Price change %')
+
+def run_bulk_action(model_admin, request, queryset, operation, params, description):
+    """
+    Run a set-based bulk action and report the result, linking to the job's progress page
+    when the selection was large enough to be processed in the background.
+    """
+    updated, job = start_bulk_action(request, queryset, operation, params, description)
+    if job is None:
+        model_admin.message_user(request, f"{description}: {updated} row(s) updated.")
+    else:
+        url = reverse('admin:shop_bulkjob_change', args=[job.pk])
+        model_admin.message_user(request, format_html(
+            '{}: {} rows queued as a background job. <a href="{}">View progress</a>.',
+            description, job.total, url,
+        ))
+
+class BaseAdmin(ShardRoutingMixin, admin.ModelAdmin):
     list_display = ('id',)
     readonly_fields = ('id',)
     search_fields = ('id',)
     list_filter = ()
     ordering = ('-id',)
+    paginator = ShardFanOutPaginator
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return ShardFanOutChangeList
+
+    def get_list_select_related(self, request):
+        """
+        Join every foreign key shown in list_display unless the admin lists its own.
+        """
+        if self.list_select_related or not settings.ADMIN_PERFORMANCE_MODE:
+            return self.list_select_related
+        related = []
+        for name in self.list_display:
+            try:
+                field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.many_to_one or field.one_to_one:
+                related.append(name)
+        return related
+
+    def get_autocomplete_fields(self, request):
+        """
+        Render foreign keys as autocomplete widgets instead of selects listing every row,
+        for every related model whose admin is searchable.
+        """
+        if self.autocomplete_fields or not settings.ADMIN_PERFORMANCE_MODE:
+            return self.autocomplete_fields
+        fields = []
+        for field in self.model._meta.fields:
+            if (field.many_to_one or field.one_to_one) and field.editable:
+                related_admin = self.admin_site._registry.get(field.related_model)
+                if related_admin and related_admin.search_fields:
+                    fields.append(field.name)
+        return fields
 
 @admin.register(Category)
 class CategoryAdmin(BaseAdmin):
@@ -85,24 +255,48 @@ class ProductAdmin(BaseAdmin):
     search_fields = ('name', 'description')
     list_filter = ('category', 'created_at')
     ordering = ('-created_at',)
+    action_form = PriceChangeActionForm
+    actions = ['reprice_products']
+
+    @admin.action(description="Change price of selected products by the given percent")
+    def reprice_products(self, request, queryset):
+        try:
+            percent = PriceChangeActionForm.base_fields['percent'].clean(request.POST.get('percent'))
+        except forms.ValidationError:
+            percent = None
+        if percent is None or percent <= -100:
+            self.message_user(request, "Enter a price change percent greater than -100.", level='error')
+            return
+        run_bulk_action(self, request, queryset, 'reprice_products', {'percent': str(percent)},
+                        f"Change price by {percent}%")
 
 @admin.register(CartItem)
 class CartItemAdmin(BaseAdmin):
     list_display = ('id', 'customer', 'product', 'quantity', 'added_at')
-    search_fields = ('customer__username', 'product__name')
-    list_filter = ('customer', 'added_at')
+    search_fields = ('customer__username', 'customer__email', 'product__name')
+    list_filter = ('added_at',)
 
 @admin.register(Order)
 class OrderAdmin(BaseAdmin):
     list_display = ('id', 'customer', 'total_amount', 'status', 'created_at')
-    search_fields = ('customer__username', 'id')
+    search_fields = ('customer__username', 'customer__email', 'id')
     list_filter = ('status', 'created_at')
     inlines = [OrderItemInline]
+    actions = ['mark_completed', 'mark_cancelled']
+
+    @admin.action(description="Mark selected orders as completed")
+    def mark_completed(self, request, queryset):
+        run_bulk_action(self, request, queryset, 'order_status', {'status': 'COMPLETED'}, "Mark orders completed")
+
+    @admin.action(description="Mark selected orders as cancelled")
+    def mark_cancelled(self, request, queryset):
+        run_bulk_action(self, request, queryset, 'order_status', {'status': 'CANCELLED'}, "Mark orders cancelled")
 
 @admin.register(Invoice)
 class InvoiceAdmin(BaseAdmin):
     list_display = ('id', 'order', 'customer', 'total_amount', 'issued_at')
     search_fields = ('order__id', 'customer__username')
+    list_select_related = ('order__customer', 'customer')
     list_filter = ('issued_at',)
 
 @admin.register(Transaction)
@@ -110,6 +304,7 @@ class TransactionAdmin(BaseAdmin):
     list_display = ('id', 'order', 'transaction_id', 'amount', 'payment_method', 'transaction_date', 'stripe_payment_intent_id')
     search_fields = ('transaction_id', 'order__id', 'order__customer__username')
     list_filter = ('transaction_date',)
+    list_select_related = ('order__customer', 'payment_method')
 
 @admin.register(PaymentMethod)
 class PaymentMethodAdmin(BaseAdmin):
@@ -149,14 +344,76 @@ class CouponAdmin(BaseAdmin):
     list_display = ('id', 'code', 'discount_amount', 'valid_from', 'valid_to', 'active')
     search_fields = ('code', 'description')
     list_filter = ('active', 'valid_from', 'valid_to')
+    actions = ['deactivate_selected', 'deactivate_expired']
+
+    @admin.action(description="Deactivate selected coupons")
+    def deactivate_selected(self, request, queryset):
+        run_bulk_action(self, request, queryset, 'deactivate_coupons', {}, "Deactivate coupons")
+
+    @admin.action(description="Deactivate expired coupons among the selection")
+    def deactivate_expired(self, request, queryset):
+        expired = queryset.filter(active=True, valid_to__lt=timezone.now())
+        run_bulk_action(self, request, expired, 'deactivate_coupons', {}, "Deactivate expired coupons")
+
+@admin.register(BulkJob)
+class BulkJobAdmin(BaseAdmin):
+    list_display = ('id', 'description', 'status', 'progress_display', 'updated', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'operation')
+    search_fields = ('description',)
+    readonly_fields = ('id', 'operation', 'description', 'params', 'status', 'progress_display', 'total', 'processed',
+                       'updated', 'error', 'created_by', 'created_at', 'finished_at')
+    exclude = ('object_ids',)
+
+    def progress_display(self, obj):
+        return f"{obj.progress}% ({obj.processed}/{obj.total})"
+
+    progress_display.short_description = 'Progress'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Task)
+class TaskAdmin(BaseAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'created_at')
+    list_filter = ('status', 'name')
+    search_fields = ('name',)
+    readonly_fields = ('id', 'name', 'args', 'kwargs', 'status', 'attempts', 'max_attempts', 'run_at',
+                       'locked_by', 'locked_at', 'last_error', 'created_at')
+    ordering = ('run_at', 'id')
+    actions = ['retry_tasks']
+
+    @admin.action(description="Retry selected failed tasks")
+    def retry_tasks(self, request, queryset):
+        updated = queryset.filter(status='FAILED').update(
+            status='QUEUED', attempts=0, run_at=timezone.now(), locked_by=None, locked_at=None
+        )
+        self.message_user(request, f"{updated} task(s) queued for retry.")
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(StockAlert)
+class StockAlertAdmin(BaseAdmin):
+    list_display = ('id', 'product', 'level', 'stock', 'threshold', 'created_at')
+    list_filter = ('level', 'created_at')
+    search_fields = ('product__name',)
+    readonly_fields = ('product', 'level', 'stock', 'threshold', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
 
 @admin.register(Customer)
-class CustomerAdmin(UserAdmin):
+class CustomerAdmin(ShardRoutingMixin, UserAdmin):
     form = CustomerAdminForm
     add_form = CustomerAdminForm  # Optional: specify another form for adding users
     list_display = ('id', 'username', 'email', 'first_name', 'last_name', 'phone_number', 'is_staff', 'is_active')
     search_fields = ('username', 'email', 'phone_number')
     list_filter = ('is_staff', 'is_active')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         ('Personal info', {'fields': ('username', 'first_name', 'last_name', 'phone_number')}),
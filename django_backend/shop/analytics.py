@@ -0,0 +1,158 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .conditional import bump_version
+from .models import (
+    Order, OrderItem, Transaction, ArchivedOrder, ArchivedOrderItem, ArchivedTransaction,
+    DailyProductSales, DailySalesTotal, RollupWatermark, Product
+)
+from .sharding import across_shards
+
+logger = logging.getLogger(__name__)
+
+SALES_WATERMARK = 'sales'
+# Only paid orders are sales: pending ones may never be paid, cancelled ones were not
+SALES_STATUSES = ('COMPLETED',)
+
+# Hot and archived sources share a shape; an order lives in exactly one of them
+ORDER_SOURCES = (Order, ArchivedOrder)
+ITEM_SOURCES = (OrderItem, ArchivedOrderItem)
+TRANSACTION_SOURCES = (Transaction, ArchivedTransaction)
+
+
+def _start_of_day(value):
+    # Works with and without USE_TZ
+    if timezone.is_aware(value):
+        return timezone.make_aware(datetime.combine(timezone.localtime(value).date(), time.min))
+    return datetime.combine(value.date(), time.min)
+
+
+def _product_rows(model, since):
+    queryset = model.objects.filter(order__status__in=SALES_STATUSES)
+    if since is not None:
+        queryset = queryset.filter(order__created_at__gte=since)
+    line_total = ExpressionWrapper(
+        F('quantity') * F('price'), output_field=DecimalField(max_digits=14, decimal_places=2)
+    )
+    return (
+        queryset.annotate(day=TruncDate('order__created_at'))
+        .values('day', 'product_id')
+        .annotate(units=Sum('quantity'), revenue=Sum(line_total), orders=Count('order_id', distinct=True))
+        .order_by()
+    )
+
+
+def _order_counts(model, since):
+    queryset = model.objects.filter(status__in=SALES_STATUSES)
+    if since is not None:
+        queryset = queryset.filter(created_at__gte=since)
+    return queryset.annotate(day=TruncDate('created_at')).values('day').annotate(orders=Count('id')).order_by()
+
+
+def _payment_totals(model, since):
+    queryset = model.objects.all()
+    if since is not None:
+        queryset = queryset.filter(transaction_date__gte=since)
+    return (
+        queryset.annotate(day=TruncDate('transaction_date'))
+        .values('day')
+        .annotate(transactions=Count('id'), payments=Sum('amount'))
+        .order_by()
+    )
+
+
+def rebuild_days(since):
+    """
+    Recompute every rollup row dated on or after `since` (an aware datetime at the
+    start of a day, or None for the whole history) with a handful of grouped queries.
+    Returns the number of days written.
+    """
+    # Hot rows are read per shard; products are looked up once, as they may be elsewhere
+    products = {}
+    for model in ITEM_SOURCES:
+        for queryset in across_shards(_product_rows(model, since)):
+            for row in queryset:
+                key = (row['day'], row['product_id'])
+                entry = products.setdefault(key, DailyProductSales(
+                    date=row['day'], product_id=row['product_id'], units=0, revenue=Decimal('0'), orders=0,
+                ))
+                entry.units += row['units']
+                entry.revenue += row['revenue'] or 0
+                entry.orders += row['orders']
+    categories = dict(
+        Product.objects.filter(id__in={entry.product_id for entry in products.values()})
+        .values_list('id', 'category_id')
+    )
+    for entry in products.values():
+        entry.category_id = categories.get(entry.product_id)
+
+    totals = defaultdict(lambda: {'orders': 0, 'units': 0, 'revenue': Decimal('0'), 'transactions': 0,
+                                  'payments': Decimal('0')})
+    for entry in products.values():
+        totals[entry.date]['units'] += entry.units
+        totals[entry.date]['revenue'] += entry.revenue
+    for model in ORDER_SOURCES:
+        for queryset in across_shards(_order_counts(model, since)):
+            for row in queryset:
+                totals[row['day']]['orders'] += row['orders']
+    for model in TRANSACTION_SOURCES:
+        for queryset in across_shards(_payment_totals(model, since)):
+            for row in queryset:
+                totals[row['day']]['transactions'] += row['transactions']
+                totals[row['day']]['payments'] += row['payments'] or 0
+
+    stale_products = DailyProductSales.objects.all()
+    stale_totals = DailySalesTotal.objects.all()
+    if since is not None:
+        stale_products = stale_products.filter(date__gte=since.date())
+        stale_totals = stale_totals.filter(date__gte=since.date())
+    stale_products.delete()
+    stale_totals.delete()
+    DailyProductSales.objects.bulk_create(products.values(), batch_size=1000)
+    DailySalesTotal.objects.bulk_create(
+        [DailySalesTotal(date=day, **values) for day, values in totals.items()], batch_size=1000
+    )
+    return len(totals)
+
+
+def mark_status_changes(changes):
+    """
+    Lower the high-water mark to the oldest of `changes` ((created_at, previous status,
+    new status) of orders) that moves an order into or out of the sales, so the next
+    refresh recomputes that order's day as well. Runs in the transaction of the change.
+    """
+    dates = [created_at for created_at, previous, status in changes
+             if (previous in SALES_STATUSES) != (status in SALES_STATUSES)]
+    if dates:
+        RollupWatermark.objects.filter(name=SALES_WATERMARK, value__gt=min(dates)).update(value=min(dates))
+
+
+def refresh_sales_rollups(full=False):
+    """
+    Fold new orders and transactions into the daily rollups.
+
+    Only days from the stored high-water mark onwards are recomputed, always including
+    the last SALES_ROLLUP_REFRESH_DAYS days so rows committed after the previous run are
+    picked up. Status changes of older orders lower the mark (mark_status_changes).
+    `full` rebuilds the whole history.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        watermark = RollupWatermark.objects.select_for_update().filter(name=SALES_WATERMARK).first()
+        since = None
+        if watermark is not None and not full:
+            start = min(watermark.value, now - timedelta(days=settings.SALES_ROLLUP_REFRESH_DAYS))
+            since = _start_of_day(start)
+        days = rebuild_days(since)
+        RollupWatermark.objects.update_or_create(name=SALES_WATERMARK, defaults={'value': now})
+        bump_version(DailyProductSales._meta.db_table)
+        bump_version(DailySalesTotal._meta.db_table)
+    logger.info(f"Refreshed sales rollups for {days} days since {since or 'the beginning'}.")
+    return days
@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 class ShopConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
-    name = 'shop'
\ No newline at end of file
+    name = 'shop'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .sharding import check_shard_vendors, drop_cross_shard_constraints
+
+        check_shard_vendors()
+        post_migrate.connect(drop_cross_shard_constraints, sender=self)
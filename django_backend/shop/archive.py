@@ -0,0 +1,103 @@
+import logging
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .batch import forget
+from .conditional import bump_version
+from .sharding import shard_aliases
+from .models import (
+    Order, OrderItem, Transaction, Invoice,
+    ArchivedOrder, ArchivedOrderItem, ArchivedTransaction, ArchivedInvoice
+)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVABLE_STATUSES = ('COMPLETED', 'CANCELLED')
+
+# Hot model -> archive model, children before parents for deletion
+ARCHIVE_TABLES = [
+    (OrderItem, ArchivedOrderItem),
+    (Transaction, ArchivedTransaction),
+    (Invoice, ArchivedInvoice),
+    (Order, ArchivedOrder),
+]
+
+
+def _copy_rows(model, archive_model, queryset):
+    """
+    Upsert the rows of `queryset` into `archive_model` on the default database, keeping
+    their ids, so copying a batch again (after an interrupted run) is harmless. Returns the
+    ids copied.
+    """
+    fields = [f.attname for f in model._meta.concrete_fields]
+    rows = [archive_model(**row) for row in queryset.values(*fields)]
+    archive_model.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+        rows, update_conflicts=True, unique_fields=[archive_model._meta.pk.name],
+        update_fields=[field for field in fields if field != model._meta.pk.attname],
+    )
+    return [row.pk for row in rows]
+
+
+def archive_batch(before, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Move one batch of finished orders created before `before`, with their items,
+    transactions and invoices, from shard `using` into the archive tables (on the default
+    database). Returns the number of orders archived.
+
+    The archive and a shard are separate databases, so the copy commits first and the
+    shard then deletes only the rows the archive holds. A crash in between leaves rows in
+    both places, never in neither; the next run copies them again (an upsert) and deletes
+    them. On the default database it all happens in one transaction.
+    """
+    with transaction.atomic(using=using):
+        order_ids = list(
+            Order.objects.using(using).select_for_update(skip_locked=True)
+            .filter(status__in=ARCHIVABLE_STATUSES, created_at__lt=before)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0
+
+        querysets = {
+            OrderItem: OrderItem.objects.using(using).filter(order_id__in=order_ids),
+            Transaction: Transaction.objects.using(using).filter(order_id__in=order_ids),
+            Invoice: Invoice.objects.using(using).filter(order_id__in=order_ids),
+            Order: Order.objects.using(using).filter(id__in=order_ids),
+        }
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            # Parents must exist in the archive before their children
+            copied = {
+                model: _copy_rows(model, archive_model, querysets[model])
+                for model, archive_model in reversed(ARCHIVE_TABLES)
+            }
+        for model, archive_model in ARCHIVE_TABLES:
+            archived = archive_model.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=copied[model]).count()
+            if archived != len(copied[model]):
+                raise RuntimeError(
+                    f"Only {archived} of {len(copied[model])} {model._meta.label} rows reached the archive; "
+                    f"nothing was deleted from {using}."
+                )
+        # Rows are moved, not deleted: skip the per-row collector and delete signals
+        for model, _ in ARCHIVE_TABLES:
+            queryset = model._base_manager.using(using).filter(pk__in=copied[model])
+            queryset._raw_delete(using)
+
+    bump_version(Order._meta.db_table)
+    bump_version(OrderItem._meta.db_table)
+    forget('order', order_ids)
+    return len(order_ids)
+
+
+def archive_orders(before, batch_size=500):
+    """
+    Archive every finished order created before `before`, batch by batch and shard by shard.
+    """
+    total = 0
+    for alias in shard_aliases():
+        while True:
+            archived = archive_batch(before, batch_size, using=alias)
+            if not archived:
+                break
+            total += archived
+            logger.info(f"Archived {total} orders so far.")
+    return total
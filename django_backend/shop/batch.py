@@ -0,0 +1,76 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+
+
+def object_key(kind, pk):
+    return f"batch:{kind}:{pk}"
+
+
+def forget(kind, ids):
+    """
+    Drop the cached representations of `ids` once the current transaction commits. Every
+    write to the rows behind a representation calls this (signals, and the paths that
+    UPDATE without them). With a process-local cache (no REDIS_URL), entries cached by
+    other processes stay until BATCH_CACHE_TTL.
+    """
+    keys = [object_key(kind, pk) for pk in ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def parse_ids(value):
+    """
+    '3,1,3' -> [3, 1]: distinct ids in request order, at most BATCH_MAX_IDS of them.
+    """
+    ids = []
+    for part in (value or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if not part.isdigit():
+            raise ValidationError({'ids': [f"'{part}' is not a valid id."]})
+        ids.append(int(part))
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise ValidationError({'ids': ["A comma-separated list of ids is required."]})
+    if len(ids) > settings.BATCH_MAX_IDS:
+        raise ValidationError({'ids': [f"At most {settings.BATCH_MAX_IDS} ids per request."]})
+    return ids
+
+
+def batch_get(kind, ids, queryset, serialize, visible=None):
+    """
+    Return (representations in the order of `ids`, ids not found). Cached representations
+    are used first; the misses are read with one IN query on `queryset`, serialized with
+    `serialize(obj)` and cached for BATCH_CACHE_TTL, until `forget` drops them.
+    `visible(data)` hides cached objects the caller may not see, as `queryset` does for
+    the misses.
+    """
+    keys = {pk: object_key(kind, pk) for pk in ids}
+    cached = cache.get_many(list(keys.values()))
+    found = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    if visible is not None:
+        found = {pk: data for pk, data in found.items() if visible(data)}
+    misses = [pk for pk in ids if pk not in found and keys[pk] not in cached]
+    if misses:
+        fetched = {obj.pk: serialize(obj) for obj in queryset.filter(pk__in=misses)}
+        if fetched:
+            cache.set_many({keys[pk]: data for pk, data in fetched.items()}, settings.BATCH_CACHE_TTL)
+        found.update(fetched)
+    return [found[pk] for pk in ids if pk in found], [pk for pk in ids if pk not in found]
+
+
+def absolute_urls(request, data, fields):
+    """
+    Copy of `data` with the URLs in `fields` (strings or nested dicts of them) made
+    absolute for `request`. Cached representations are rendered without a request.
+    """
+    def absolute(value):
+        if isinstance(value, dict):
+            return {key: absolute(item) for key, item in value.items()}
+        return request.build_absolute_uri(value) if isinstance(value, str) and value else value
+
+    return {name: absolute(value) if name in fields else value for name, value in data.items()}
+
@@ -0,0 +1,147 @@
+import logging
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from .analytics import mark_status_changes
+from .batch import forget
+from .carts import bump_prices_version
+from .conditional import bump_version
+from .coupons import coupon_index
+from .models import BulkJob, Coupon, Order, OrderItem, Product
+from .outbox import order_status_events
+from .pubsub import publish_order_status
+from .related import invalidate_referencing
+from .sharding import across_shards, atomic, bind_shard, is_sharded, shard_aliases
+from .stock import adjust_stock
+from .tasks import heartbeat, task
+
+logger = logging.getLogger(__name__)
+
+# Set-based operations: each one is a single UPDATE over the given queryset
+def set_order_status(queryset, params):
+    changed = list(queryset.exclude(status=params['status']).select_for_update())
+    if params['status'] == 'CANCELLED':
+        # As OrderViewSet.cancel: the items of cancelled pending orders go back to stock
+        changes = {}
+        pending = [order.pk for order in changed if order.status == 'PENDING']
+        for product_id, quantity in OrderItem.objects.filter(order_id__in=pending).values_list('product_id', 'quantity'):
+            changes[product_id] = changes.get(product_id, 0) + quantity
+        adjust_stock(changes)
+    updated = queryset.update(status=params['status'])
+    mark_status_changes([(order.created_at, order.status, params['status']) for order in changed])
+    events = []
+    for order in changed:
+        events.append((order, order.status))
+        order.status = params['status']
+        publish_order_status(order)
+    order_status_events(events)
+    forget('order', [order.pk for order in changed])
+    return updated
+
+
+def deactivate_coupons(queryset, params):
+    updated = queryset.filter(active=True).update(active=False)
+    transaction.on_commit(coupon_index.invalidate)
+    return updated
+
+
+def reprice_products(queryset, params):
+    factor = 1 + Decimal(params['percent']) / 100
+    updated = queryset.update(price=Round(F('price') * factor, 2))
+    if updated:
+        bump_prices_version()
+        product_ids = list(queryset.values_list('pk', flat=True))
+        invalidate_referencing(product_ids)
+        forget('product', product_ids)
+    return updated
+
+
+OPERATIONS = {
+    'order_status': (Order, set_order_status),
+    'deactivate_coupons': (Coupon, deactivate_coupons),
+    'reprice_products': (Product, reprice_products),
+}
+
+
+def apply_operation(operation, object_ids, params):
+    """
+    Run `operation` over `object_ids` as one UPDATE (per shard, for customer-owned
+    tables) and bump the table's change counter.
+    """
+    model, func = OPERATIONS[operation]
+    queryset = model.objects.filter(pk__in=object_ids)
+    if is_sharded(model):
+        updated = 0
+        for alias in shard_aliases():
+            with bind_shard(alias), atomic(alias):
+                updated += func(queryset.using(alias), params)
+    else:
+        updated = func(queryset, params)
+    if updated:
+        bump_version(model._meta.db_table)
+    return updated
+
+
+def start_bulk_action(request, queryset, operation, params, description):
+    """
+    Apply `operation` to the selected rows. Small selections run inline as a single UPDATE;
+    selections above BULK_ACTION_SYNC_LIMIT become a BulkJob processed in chunks in the
+    background. Returns (updated_count, job); exactly one of them is None.
+    """
+    object_ids = [pk for shard_queryset in across_shards(queryset) for pk in shard_queryset.values_list('pk', flat=True)]
+    if len(object_ids) <= settings.BULK_ACTION_SYNC_LIMIT:
+        with transaction.atomic():
+            return apply_operation(operation, object_ids, params), None
+
+    job = BulkJob.objects.create(
+        operation=operation,
+        description=description,
+        params=params,
+        object_ids=object_ids,
+        total=len(object_ids),
+        created_by=request.user,
+    )
+    run_bulk_job.delay(job.pk)
+    return None, job
+
+
+@task(max_attempts=3)
+def run_bulk_job(job_id):
+    """
+    Process a BulkJob in BULK_ACTION_CHUNK_SIZE chunks, each in its own short transaction
+    so row locks are released between chunks and progress is visible while it runs.
+
+    A chunk's rows and the job's progress are written in the same transaction, under a
+    lock on the job row, so a chunk is applied exactly once: a retried job resumes after
+    the last committed chunk, and a run whose task was reclaimed stops at the next one.
+    Customer-owned rows on another shard commit just before the progress (see
+    shop.sharding.atomic); the operations are idempotent, so a chunk redone after a
+    failure in between changes nothing twice.
+    """
+    job = BulkJob.objects.get(pk=job_id)
+    BulkJob.objects.filter(pk=job_id).update(status='RUNNING')
+    chunk_size = settings.BULK_ACTION_CHUNK_SIZE
+    try:
+        for start in range(job.processed, job.total, chunk_size):
+            chunk = job.object_ids[start:start + chunk_size]
+            with transaction.atomic():
+                if not BulkJob.objects.select_for_update().filter(pk=job_id, processed=start).exists():
+                    logger.warning(f"Bulk job {job_id} is being processed elsewhere; stopped at {start}.")
+                    return
+                updated = apply_operation(job.operation, chunk, job.params)
+                BulkJob.objects.filter(pk=job_id).update(
+                    processed=F('processed') + len(chunk), updated=F('updated') + updated
+                )
+            if not heartbeat():
+                logger.warning(f"Bulk job {job_id} was reclaimed by another worker; stopped at {start + len(chunk)}.")
+                return
+    except Exception as e:
+        logger.exception(f"Bulk job {job_id} failed.")
+        BulkJob.objects.filter(pk=job_id).update(status='FAILED', error=str(e), finished_at=timezone.now())
+        return
+    BulkJob.objects.filter(pk=job_id).update(status='COMPLETED', finished_at=timezone.now())
+    logger.info(f"Bulk job {job_id} completed ({job.total} rows).")
@@ -0,0 +1,199 @@
+import logging
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F
+from rest_framework.exceptions import ValidationError
+
+from .coupons import coupon_index
+from .models import CartItem, Product
+from .sharding import atomic, is_sharded, shard_for
+from .stock import adjust_stock
+
+logger = logging.getLogger(__name__)
+
+# Cache entry bumped only when a product price changes, not on every stock movement
+PRICES_VERSION_KEY = 'cart-prices-version'
+
+MODE_ADD = 'add'  # Increase existing quantities, e.g. merging a guest cart after login
+MODE_SET = 'set'  # Replace quantities; 0 removes the line
+
+
+def collapse_lines(lines, mode):
+    """
+    Reduce [(product_id, quantity), ...] to {product_id: quantity}. Repeated products are
+    summed when adding and the last one wins when setting.
+    """
+    collapsed = {}
+    for product_id, quantity in lines:
+        if mode == MODE_ADD:
+            collapsed[product_id] = collapsed.get(product_id, 0) + quantity
+        else:
+            collapsed[product_id] = quantity
+    return collapsed
+
+
+def apply_cart_lines(customer, lines, mode=MODE_ADD):
+    """
+    Upsert many cart lines for `customer` in one transaction.
+
+    Stock is reserved set-wise through `shop.stock.adjust_stock`: every line is checked
+    and stock moves in a single UPDATE. Either all lines apply or none do. With shards,
+    the cart and the stock commit one after the other (see shop.sharding.atomic).
+    Returns the number of products whose cart quantity changed.
+    """
+    wanted = collapse_lines(lines, mode)
+    if not wanted:
+        return 0
+
+    with atomic(shard_for(customer.pk)):
+        current = dict(
+            CartItem.objects.select_for_update().filter(customer=customer, product_id__in=wanted)
+            .values_list('product_id', 'quantity')
+        )
+        targets = {
+            product_id: current.get(product_id, 0) + quantity if mode == MODE_ADD else quantity
+            for product_id, quantity in wanted.items()
+        }
+        deltas = {
+            product_id: target - current.get(product_id, 0)
+            for product_id, target in targets.items()
+            if target != current.get(product_id, 0)
+        }
+        if not deltas:
+            return 0
+
+        # Reserving cart stock is a decrement; raises if any line cannot be covered
+        adjust_stock({product_id: -delta for product_id, delta in deltas.items()})
+        removed = [product_id for product_id in deltas if targets[product_id] == 0]
+        if removed:
+            CartItem.objects.filter(customer=customer, product_id__in=removed).delete()
+        CartItem.objects.bulk_create(
+            [
+                CartItem(customer=customer, product_id=product_id, quantity=targets[product_id])
+                for product_id in deltas if targets[product_id] > 0
+            ],
+            update_conflicts=True,
+            unique_fields=['customer', 'product'],
+            update_fields=['quantity', 'updated_at'],
+        )
+        bump_cart_version(customer.pk)  # bulk_create sends no signals
+    return len(deltas)
+
+
+def cart_version_key(customer_id):
+    return f"cart-version:{customer_id}"
+
+
+def _bump(key):
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), settings.CART_SUMMARY_TTL)
+
+    transaction.on_commit(bump)
+
+
+def bump_cart_version(customer_id):
+    """
+    Retire the memoized summary of `customer_id`'s cart once the transaction commits.
+    Every write to cart lines calls this (the CartItem signals, and apply_cart_lines).
+    """
+    _bump(cart_version_key(customer_id))
+
+
+def bump_prices_version():
+    """
+    Retire every memoized summary once the transaction commits: a product price changed.
+    """
+    _bump(PRICES_VERSION_KEY)
+
+
+def _versions(keys):
+    """
+    Current values of the version entries `keys`. Missing (evicted) ones start again from
+    the clock rather than from a value an older memo may still be stored under.
+    """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), settings.CART_SUMMARY_TTL)
+            versions[key] = cache.get(key)
+    return versions
+
+
+def _cart_rows(customer_id):
+    items = CartItem.objects.filter(customer_id=customer_id).order_by('added_at', 'id')
+    if not is_sharded(CartItem):
+        subtotal = ExpressionWrapper(
+            F('quantity') * F('product__price'), output_field=DecimalField(max_digits=14, decimal_places=2)
+        )
+        return items.annotate(subtotal=subtotal).values(
+            'id', 'product_id', 'product__name', 'product__price', 'quantity', 'subtotal'
+        )
+    # The products are not on the customer's shard: read them separately from the default database
+    rows = list(items.using(shard_for(customer_id)).values('id', 'product_id', 'quantity'))
+    products = Product.objects.in_bulk({row['product_id'] for row in rows})
+    # As the join does, skip lines whose product was deleted but not yet from the shard
+    rows = [row for row in rows if row['product_id'] in products]
+    for row in rows:
+        product = products[row['product_id']]
+        row.update({'product__name': product.name, 'product__price': product.price,
+                    'subtotal': product.price * row['quantity']})
+    return rows
+
+
+def price_cart(customer_id):
+    """
+    Price every line of the cart with a single query joined to the products (two queries
+    when carts are sharded).
+    """
+    lines = [
+        {
+            'id': row['id'],
+            'product': row['product_id'],
+            'product_name': row['product__name'],
+            'quantity': row['quantity'],
+            'unit_price': row['product__price'],
+            'subtotal': row['subtotal'],
+        }
+        for row in _cart_rows(customer_id)
+    ]
+    return {
+        'lines': lines,
+        'item_count': sum(line['quantity'] for line in lines),
+        'subtotal': sum((line['subtotal'] for line in lines), Decimal('0.00')),
+    }
+
+
+def cart_summary(customer_id, coupon_code=None):
+    """
+    Priced cart with an optional coupon applied. The priced lines are memoized per cart
+    version and product price version, both kept in the cache and bumped after the writes
+    commit, so a hit reads no database. A summary priced while a write commits is stored
+    under the version that write retires. The coupon is applied on every call so its
+    validity window is always current.
+    """
+    versions = _versions([cart_version_key(customer_id), PRICES_VERSION_KEY])
+    key = f"cart-summary:{customer_id}:{versions[cart_version_key(customer_id)]}:{versions[PRICES_VERSION_KEY]}"
+    summary = cache.get(key)
+    if summary is None:
+        summary = price_cart(customer_id)
+        cache.set(key, summary, settings.CART_SUMMARY_TTL)
+
+    discount = Decimal('0.00')
+    coupon = None
+    if coupon_code:
+        coupon = coupon_index.get(coupon_code)
+        if coupon is None:
+            raise ValidationError({'coupon': "Invalid or expired coupon."})
+        discount = min(coupon.discount_amount, summary['subtotal'])
+    return {
+        **summary,
+        'coupon': coupon.code if coupon else None,
+        'discount': discount,
+        'total': summary['subtotal'] - discount,
+    }
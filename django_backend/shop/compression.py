@@ -0,0 +1,130 @@
+import gzip
+import zlib
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:  # Optional: pip install brotli
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # Optional: pip install zstandard
+    zstandard = None
+
+# Content types worth compressing; images, PDFs and archives are compressed already
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml', 'application/x-ndjson',
+    'image/svg+xml',
+)
+
+
+class GzipCodec:
+    encoding = 'gzip'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def compressor(self):
+        """
+        Return (write, close) for streaming: `write` returns everything compressed so
+        far, flushed so each chunk reaches the client at once (needed for event streams).
+        """
+        stream = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return (lambda chunk: stream.compress(chunk) + stream.flush(zlib.Z_SYNC_FLUSH)), stream.flush
+
+
+class BrotliCodec:
+    encoding = 'br'
+
+    def __init__(self, quality=4):
+        self.quality = quality
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.quality)
+
+    def compressor(self):
+        stream = brotli.Compressor(quality=self.quality)
+        return (lambda chunk: stream.process(chunk) + stream.flush()), stream.finish
+
+
+class ZstdCodec:
+    encoding = 'zstd'
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def compressor(self):
+        stream = zstandard.ZstdCompressor(level=self.level).compressobj()
+        return (lambda chunk: stream.compress(chunk) + stream.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)), stream.flush
+
+
+def available_codecs():
+    """
+    Codecs usable in this process, in COMPRESSION_ENCODINGS order of preference.
+    """
+    codecs = {'gzip': GzipCodec()}
+    if brotli is not None:
+        codecs['br'] = BrotliCodec()
+    if zstandard is not None:
+        codecs['zstd'] = ZstdCodec()
+    return [codecs[name] for name in settings.COMPRESSION_ENCODINGS if name in codecs]
+
+
+def parse_accept_encoding(header):
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def negotiate(header, codecs=None):
+    """
+    Pick the codec the client weights highest in Accept-Encoding, preferring ours on ties.
+    """
+    accepted = parse_accept_encoding(header)
+    best, best_quality = None, 0.0
+    for codec in available_codecs() if codecs is None else codecs:
+        quality = accepted.get(codec.encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = codec, quality
+    return best
+
+
+def is_compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress_stream(codec, chunks):
+    write, close = codec.compressor()
+    for chunk in chunks:
+        data = write(chunk)
+        if data:
+            yield data
+    yield close()
+
+
+async def acompress_stream(codec, chunks):
+    write, close = codec.compressor()
+    async for chunk in chunks:
+        data = write(chunk)
+        if data:
+            yield data
+    yield close()
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ChangeCounter, Coupon
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveCouponIndex:
+    """
+    In-process index of active coupons keyed by code.
+
+    Holds every active coupon that has not expired yet, so validation is a dict lookup
+    plus a validity check against the current time. The index reloads when a coupon
+    crosses a `valid_from`/`valid_to` boundary, when a local `Coupon` signal invalidates
+    it, or when the `shop_coupon` change counter moved in another process (checked at
+    most every COUPON_INDEX_CHECK_INTERVAL seconds).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._coupons = {}
+        self._boundaries = []
+        self._next_expiry = None
+        self._last_expired = None
+        self._version = None
+        self._stale = True
+        self._generation = 0
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        self._generation += 1
+        self._stale = True
+
+    def get(self, code, now=None):
+        """
+        Return the coupon for `code` if it is valid at `now`, else None.
+        """
+        now = now or timezone.now()
+        self._refresh()
+        coupon = self._coupons.get(code)
+        if coupon and coupon.valid_from <= now <= coupon.valid_to:
+            return coupon
+        return None
+
+    def active(self, now=None):
+        """
+        Return the coupons valid at `now`.
+        """
+        now = now or timezone.now()
+        self._refresh()
+        return [c for c in self._coupons.values() if c.valid_from <= now <= c.valid_to]
+
+    def window(self, now=None):
+        """
+        Return (last_boundary, next_boundary) around `now`: the instants at which the set
+        of valid coupons last changed and will next change.
+        """
+        now = now or timezone.now()
+        self._refresh()
+        last, next_ = self._last_expired, None
+        for boundary in self._boundaries:
+            if boundary <= now:
+                last = boundary
+            else:
+                next_ = boundary
+                break
+        return last, next_
+
+    def _refresh(self):
+        now = timezone.now()
+        if self._stale or self._boundary_passed(now) or self._version_changed():
+            with self._lock:
+                if self._stale or self._boundary_passed(now) or self._version_changed():
+                    self._load(now)
+
+    def _boundary_passed(self, now):
+        # Reload once the earliest remaining expiry is behind us, pruning expired coupons
+        return self._next_expiry is not None and self._next_expiry < now
+
+    def _version_changed(self):
+        interval = getattr(settings, 'COUPON_INDEX_CHECK_INTERVAL', 30)
+        if time.monotonic() - self._checked_at < interval:
+            return False
+        self._checked_at = time.monotonic()
+        return self._current_version() != self._version
+
+    def _current_version(self):
+        return ChangeCounter.objects.filter(name=Coupon._meta.db_table).values_list('version', flat=True).first()
+
+    def _load(self, now):
+        # Read the version first so a write racing the load leaves the index stale, not wrong;
+        # likewise an invalidate() during the load keeps it stale
+        generation = self._generation
+        self._version = self._current_version()
+        self._checked_at = time.monotonic()
+        coupons = {c.code: c for c in Coupon.objects.filter(active=True, valid_to__gte=now)}
+        last_expired = Coupon.objects.filter(active=True, valid_to__lt=now).aggregate(last=Max('valid_to'))['last']
+        boundaries = set()
+        for coupon in coupons.values():
+            boundaries.add(coupon.valid_from)
+            boundaries.add(coupon.valid_to)
+        self._coupons = coupons
+        self._boundaries = sorted(boundaries)
+        self._next_expiry = min((c.valid_to for c in coupons.values()), default=None)
+        self._last_expired = last_expired
+        self._stale = self._generation != generation
+        logger.debug(f"Loaded {len(coupons)} coupons into the active coupon index.")
+
+
+coupon_index = ActiveCouponIndex()
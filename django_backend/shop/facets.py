@@ -0,0 +1,83 @@
+import hashlib
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .conditional import get_versions
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that do not change which products match
+NON_FILTER_PARAMS = {'facets', 'ordering', 'page', 'page_size', 'format'}
+FACET_TABLES = ('shop_product', 'shop_category')
+
+
+def price_ranges():
+    """
+    [(label, min, max), ...] from CATALOG_PRICE_BUCKETS; max is exclusive, None is open.
+    """
+    bounds = [None] + list(settings.CATALOG_PRICE_BUCKETS) + [None]
+    ranges = []
+    for low, high in zip(bounds, bounds[1:]):
+        label = f"{low or 0}-{high}" if high is not None else f"{low}+"
+        ranges.append((label, low, high))
+    return ranges
+
+
+def compute_facets(queryset):
+    """
+    Category, price range and availability counts for `queryset` from one grouped query.
+    """
+    ranges = price_ranges()
+    bucket = Case(
+        *[When(price__lt=high, then=Value(index)) for index, (_, _, high) in enumerate(ranges) if high is not None],
+        default=Value(len(ranges) - 1),
+        output_field=IntegerField(),
+    )
+    in_stock = Case(When(stock__gt=0, then=Value(1)), default=Value(0), output_field=IntegerField())
+    rows = (
+        queryset.order_by()
+        .annotate(bucket=bucket, in_stock=in_stock)
+        .values('category_id', 'category__name', 'bucket', 'in_stock')
+        .annotate(count=Count('id'))
+    )
+
+    categories = {}
+    buckets = [0] * len(ranges)
+    availability = {'in_stock': 0, 'out_of_stock': 0}
+    for row in rows:
+        category = categories.setdefault(
+            row['category_id'], {'id': row['category_id'], 'name': row['category__name'], 'count': 0}
+        )
+        category['count'] += row['count']
+        buckets[row['bucket']] += row['count']
+        availability['in_stock' if row['in_stock'] else 'out_of_stock'] += row['count']
+
+    return {
+        'categories': sorted(categories.values(), key=lambda c: (-c['count'], c['name'])),
+        'price_ranges': [
+            {'label': label, 'min': low, 'max': high, 'count': count}
+            for (label, low, high), count in zip(ranges, buckets)
+        ],
+        'availability': availability,
+    }
+
+
+def cached_facets(request, queryset):
+    """
+    Facets for the filtered catalog, cached per filter combination and invalidated by
+    the product and category change counters.
+    """
+    params = sorted(
+        (key, value) for key, values in request.query_params.lists() if key not in NON_FILTER_PARAMS
+        for value in values
+    )
+    versions = get_versions(request, FACET_TABLES)
+    fingerprint = repr((params, [versions[name][0] for name in FACET_TABLES], settings.CATALOG_PRICE_BUCKETS))
+    key = f"catalog-facets:{hashlib.md5(fingerprint.encode()).hexdigest()}"
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, settings.CATALOG_FACET_TTL)
+    return facets
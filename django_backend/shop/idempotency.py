@@ -0,0 +1,125 @@
+import functools
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+
+
+def request_fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def claim_key(customer_id, key, fingerprint):
+    """
+    Insert the key as IN_PROGRESS. Returns (record, created); the unique constraint makes
+    exactly one of several concurrent duplicates the owner of the work. A key left
+    IN_PROGRESS for IDEMPOTENCY_LOCK_TIMEOUT seconds, by a request that died, is taken
+    over with a conditional UPDATE on its `locked_at`, so only one retry wins it.
+    """
+    now = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    customer_id=customer_id, key=key, fingerprint=fingerprint, locked_at=now,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                ), True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(customer_id=customer_id, key=key).first()
+            if record is None or record.expires_at <= now:
+                IdempotencyKey.objects.filter(customer_id=customer_id, key=key, expires_at__lte=now).delete()
+                continue
+            expired = now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+            if (record.status == 'IN_PROGRESS' and record.fingerprint == fingerprint
+                    and record.locked_at < expired
+                    and IdempotencyKey.objects.filter(
+                        pk=record.pk, status='IN_PROGRESS', locked_at=record.locked_at
+                    ).update(locked_at=now)):
+                record.locked_at = now
+                return record, True
+            return record, False
+    raise IntegrityError(f"Could not claim idempotency key {key}.")
+
+
+def wait_for_completion(record):
+    """
+    Poll while another request holding the same key is still running.
+    """
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while record is not None and record.status == 'IN_PROGRESS' and time.monotonic() < deadline:
+        time.sleep(0.1)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+
+def idempotent(handler):
+    """
+    Make a DRF handler (`post`, `create`) safe to retry: with an `Idempotency-Key` header
+    the first request does the work and its response is stored; retries with the same key
+    and body get the stored response back, and concurrent duplicates wait for it.
+    Requests without the header are handled as before.
+    """
+    @functools.wraps(handler)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return handler(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': f"{HEADER} must be at most 255 characters."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        customer_id = request.user.pk if request.user.is_authenticated else None
+        fingerprint = request_fingerprint(request)
+        record, created = claim_key(customer_id, key, fingerprint)
+        if not created:
+            if record.fingerprint != fingerprint:
+                return Response({'error': f"{HEADER} was already used for a different request."},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            record = wait_for_completion(record)
+            if record is None:
+                return Response({'error': "The original request failed; retry it."},
+                                status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+            if record.status == 'IN_PROGRESS':
+                return Response({'error': "A request with this key is still in progress."},
+                                status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+            return Response(record.response_body, status=record.response_status,
+                            headers={'Idempotent-Replayed': 'true'})
+
+        # Only touch the key while still holding it: a retry may have taken it over
+        held = IdempotencyKey.objects.filter(pk=record.pk, status='IN_PROGRESS', locked_at=record.locked_at)
+        try:
+            response = handler(self, request, *args, **kwargs)
+        except Exception:
+            held.delete()
+            raise
+        if response.status_code >= 500:
+            # Server errors are not final: let the client retry for real
+            held.delete()
+            return response
+        body = json.loads(json.dumps(response.data, cls=JSONEncoder))
+        if not held.update(status='COMPLETED', response_status=response.status_code, response_body=body):
+            logger.warning("Idempotency key %s was taken over before its request finished.", key)
+        return response
+
+    return wrapper
+
+
+def purge_expired_keys():
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .batch import forget
+from .conditional import bump_version
+from .models import Product
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+def variant_path(source_name, variant, ext):
+    # The digest of the full name keeps a.jpg, a.png and another folder's a.jpg apart
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    digest = hashlib.sha1(source_name.encode()).hexdigest()[:12]
+    return f"products/variants/{stem}-{digest}-{variant}.{ext}"
+
+
+def render_variants(source_name):
+    """
+    Generate every configured size/format variant of `source_name` in the default storage.
+    Returns the mapping stored on `Product.image_variants`.
+    """
+    with default_storage.open(source_name, 'rb') as fh:
+        image = Image.open(fh)
+        image.load()
+
+    variants = {'source': source_name}
+    for variant, size in settings.PRODUCT_IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        variants[variant] = {}
+        for ext, fmt in VARIANT_FORMATS.items():
+            frame = resized
+            if fmt == 'JPEG' and frame.mode not in ('RGB', 'L'):
+                frame = frame.convert('RGB')
+            elif frame.mode not in ('RGB', 'RGBA', 'L'):
+                frame = frame.convert('RGBA')
+            buffer = BytesIO()
+            frame.save(buffer, fmt, quality=82, optimize=True)
+            path = variant_path(source_name, variant, ext)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            variants[variant][ext] = default_storage.save(path, ContentFile(buffer.getvalue()))
+    return variants
+
+
+@task(max_attempts=3)
+def discard_variants(variants):
+    """
+    Delete the variant files in `variants` (as stored on `Product.image_variants`), unless
+    a product still shows their source image.
+    """
+    source = variants.get('source')
+    if not source or Product.objects.filter(image=source).exists():
+        return 0
+    paths = [path for variant, formats in variants.items() if variant != 'source' for path in formats.values()]
+    for path in paths:
+        default_storage.delete(path)
+    return len(paths)
+
+
+@task(max_attempts=3)
+def process_product_image(product_id, force=False):
+    """
+    Build the variants for one product unless they are already current for its image,
+    and discard those of the image it replaced.
+    """
+    row = Product.objects.filter(pk=product_id).values('image', 'image_variants').first()
+    if row is None:
+        return None
+    source = row['image']
+    previous = row['image_variants']
+    if not source:
+        if previous and Product.objects.filter(pk=product_id, image='').update(image_variants={}):
+            bump_version(Product._meta.db_table)
+            forget('product', [product_id])
+            discard_variants(previous)
+        return {}
+    if not force and row['image_variants'].get('source') == source:
+        return row['image_variants']
+
+    variants = render_variants(source)
+    # Only store the result if the image was not replaced while we were rendering
+    if Product.objects.filter(pk=product_id, image=source).update(image_variants=variants):
+        bump_version(Product._meta.db_table)
+        forget('product', [product_id])
+        if previous.get('source') not in (None, source):
+            discard_variants(previous)
+    else:
+        discard_variants(variants)
+    logger.info(f"Generated image variants for product {product_id}.")
+    return variants
+
+
+def schedule_product_image(product_id):
+    """
+    Generate variants on the task workers once the current transaction commits.
+    """
+    process_product_image.delay(product_id)
+
+
+def variant_urls(variants, request=None):
+    """
+    Map stored variant paths to public URLs: {variant: {format: url}}, absolute when
+    `request` is given (as DRF renders ImageFields).
+    """
+    absolute = request.build_absolute_uri if request is not None else (lambda url: url)
+    return {
+        variant: {ext: absolute(default_storage.url(path)) for ext, path in formats.items()}
+        for variant, formats in variants.items()
+        if variant != 'source'
+    }
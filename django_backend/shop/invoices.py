@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import re
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+
+from .models import Invoice
+from .pdf import render_invoice_pdf
+from .sharding import locate
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+RENDERER_VERSION = 1  # Bump when the PDF layout changes so cached documents are re-rendered
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+_pool = None
+
+
+def get_process_pool():
+    """
+    Process pool for bulk PDF rendering (manage.py render_invoices). Task workers render
+    inline: they are daemonic processes, which may not start children.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.INVOICE_RENDER_PROCESSES)
+    return _pool
+
+
+def invoice_data(invoice):
+    """
+    Collect everything printed on the invoice as plain, picklable values.
+    """
+    order = invoice.order
+    customer = invoice.customer
+    items = [
+        {
+            'name': item.product.name,
+            'quantity': item.quantity,
+            'price': str(item.price),
+            'amount': str(item.price * item.quantity),
+        }
+        for item in order.order_items.select_related('product').order_by('id')
+    ]
+    return {
+        'invoice_id': invoice.id,
+        'order_id': order.id,
+        'issued_at': invoice.issued_at.strftime('%Y-%m-%d'),
+        'customer_name': customer.get_full_name() or customer.email,
+        'customer_email': customer.email,
+        'total_amount': str(invoice.total_amount),
+        'items': items,
+    }
+
+
+def document_path(data):
+    """
+    Content-addressed storage path: identical invoice data always maps to the same file.
+    """
+    payload = json.dumps({'v': RENDERER_VERSION, 'data': data}, sort_keys=True).encode()
+    return f"invoices/{hashlib.sha256(payload).hexdigest()}.pdf"
+
+
+@task(max_attempts=3)
+def render_invoice(invoice_id):
+    """
+    Render the invoice document unless its content is already cached in storage, then
+    point the invoice at it. Runs in a task worker, so rendering inline keeps it off the
+    request path.
+    """
+    alias = locate(Invoice, invoice_id)
+    if alias is None:
+        return None
+    try:
+        invoice = Invoice.objects.using(alias).select_related('order', 'customer').get(pk=invoice_id)
+    except Invoice.DoesNotExist:
+        return None
+    data = invoice_data(invoice)
+    path = document_path(data)
+    if not default_storage.exists(path):
+        content = render_invoice_pdf(data)
+        path = default_storage.save(path, ContentFile(content))
+        logger.info(f"Rendered invoice {invoice_id} to {path}.")
+    if invoice.document != path:
+        Invoice.objects.using(alias).filter(pk=invoice_id).update(document=path)
+    return path
+
+
+def document_etag(path):
+    return '"%s"' % path.rsplit('/', 1)[-1].split('.')[0]
+
+
+def document_response(request, path, filename):
+    """
+    Serve a stored document with ETag and single byte-range support.
+    """
+    etag = document_etag(path)
+    if etag in request.headers.get('If-None-Match', ''):
+        return HttpResponseNotModified(headers={'ETag': etag})
+
+    size = default_storage.size(path)
+    disposition = f'attachment; filename="{filename}"'
+    match = RANGE_RE.match(request.headers.get('Range', ''))
+    if_range = request.headers.get('If-Range')
+    if not match or (if_range and if_range != etag):
+        response = FileResponse(default_storage.open(path, 'rb'), content_type='application/pdf')
+        response['Content-Disposition'] = disposition
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        return response
+
+    start, end = match.groups()
+    if start:
+        start, end = int(start), min(int(end) if end else size - 1, size - 1)
+    elif end:
+        start, end = max(size - int(end), 0), size - 1  # Suffix range: last N bytes
+    else:
+        start, end = 0, size - 1
+    if start > end or start >= size:
+        return HttpResponse(status=416, headers={'Content-Range': f'bytes */{size}'})
+
+    def stream(length=end - start + 1, block_size=64 * 1024):
+        with default_storage.open(path, 'rb') as fh:
+            fh.seek(start)
+            while length > 0:
+                chunk = fh.read(min(block_size, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                yield chunk
+
+    response = StreamingHttpResponse(stream(), status=206, content_type='application/pdf')
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    response['Content-Disposition'] = disposition
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    return response
@@ -0,0 +1,28 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.archive import ARCHIVABLE_STATUSES, archive_orders
+from shop.models import Order
+from shop.sharding import across_shards
+
+
+class Command(BaseCommand):
+    help = "Move completed or cancelled orders older than N months into the archive tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=settings.ARCHIVE_AFTER_MONTHS,
+                            help="Archive orders created more than this many months ago.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Orders moved per transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many orders would move.")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=30 * options['months'])
+        if options['dry_run']:
+            queryset = Order.objects.filter(status__in=ARCHIVABLE_STATUSES, created_at__lt=before)
+            count = sum(shard_queryset.count() for shard_queryset in across_shards(queryset))
+            self.stdout.write(f"{count} orders created before {before:%Y-%m-%d} would be archived.")
+            return
+        total = archive_orders(before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} orders created before {before:%Y-%m-%d}."))
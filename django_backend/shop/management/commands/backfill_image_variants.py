@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from shop.images import process_product_image
+from shop.models import Product
+
+
+def _process(product_id, force):
+    try:
+        return process_product_image(product_id, force=force)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnail variants for existing product images in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_VARIANT_WORKERS,
+                            help="Number of parallel workers.")
+        parser.add_argument('--force', action='store_true',
+                            help="Regenerate variants even if they are already current.")
+
+    def handle(self, *args, **options):
+        force = options['force']
+        product_ids = list(
+            Product.objects.exclude(image='').exclude(image__isnull=True).values_list('id', flat=True)
+        )
+        self.stdout.write(f"Processing {len(product_ids)} product images with {options['workers']} workers...")
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(_process, pk, force): pk for pk in product_ids}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Product {futures[future]}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {len(product_ids) - failed} product images ({failed} failed)."
+        ))
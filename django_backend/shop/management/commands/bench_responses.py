@@ -0,0 +1,67 @@
+import statistics
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import resolve
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from shop.compression import BrotliCodec, GzipCodec, ZstdCodec, brotli, zstandard
+from shop.renderers import FastJSONRenderer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure JSON encode time and response size per encoding for API endpoints, "
+        "against the configured database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['/products/', '/categories/', '/orders/'],
+                            help="GET endpoints to measure.")
+        parser.add_argument('--user', help="Username to authenticate as (default: the first superuser).")
+        parser.add_argument('--repeat', type=int, default=50, help="Timed iterations per measurement.")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects
+        user = users.filter(username=options['user']).first() if options['user'] else \
+            users.filter(is_superuser=True).first()
+        if options['user'] and user is None:
+            raise CommandError(f"No user named {options['user']}.")
+        codecs = [GzipCodec()]
+        if brotli is not None:
+            codecs.append(BrotliCodec())
+        if zstandard is not None:
+            codecs.append(ZstdCodec())
+
+        factory = APIRequestFactory()
+        for path in options['paths']:
+            request = factory.get(path)
+            if user is not None:
+                force_authenticate(request, user)
+            match = resolve(path)
+            response = match.func(request, *match.args, **match.kwargs)
+            if response.status_code != 200:
+                self.stdout.write(self.style.WARNING(f"{path}: HTTP {response.status_code}, skipped."))
+                continue
+
+            self.stdout.write(f"{path}")
+            body = None
+            for renderer in (JSONRenderer(), FastJSONRenderer()):
+                timings = self._time(lambda: renderer.render(response.data), options['repeat'])
+                body = renderer.render(response.data)
+                self.stdout.write(f"  {type(renderer).__name__:>18}: {len(body):>9} bytes, "
+                                  f"encode mean {statistics.mean(timings):.2f} ms")
+            for codec in codecs:
+                timings = self._time(lambda: codec.compress(body), options['repeat'])
+                size = len(codec.compress(body))
+                self.stdout.write(f"  {codec.encoding:>18}: {size:>9} bytes ({size / len(body):.0%}), "
+                                  f"compress mean {statistics.mean(timings):.2f} ms")
+
+    def _time(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
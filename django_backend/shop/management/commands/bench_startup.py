@@ -0,0 +1,51 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker does before it can answer its first request
+BOOT = (
+    "import django; django.setup(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure process boot time (settings, apps and URLconf) in fresh interpreters and "
+        "break the import time down by package with python -X importtime."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreter starts to time.")
+        parser.add_argument('--top', type=int, default=15, help="Packages to list by import time.")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(sys.path)}
+        timings = []
+        for _ in range(options['repeat']):
+            start = time.perf_counter()
+            self._boot([], env)
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(f"Boot over {options['repeat']} runs: mean {statistics.mean(timings):.0f} ms, "
+                          f"min {min(timings):.0f} ms")
+
+        packages = defaultdict(int)
+        for line in self._boot(['-X', 'importtime'], env).splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, _, name = line[len('import time:'):].split('|')
+            packages[name.strip().split('.')[0]] += int(self_us)
+        total = sum(packages.values())
+        self.stdout.write(f"Import time {total / 1000:.0f} ms, slowest packages:")
+        for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f"  {name:<30} {self_us / 1000:>8.1f} ms  {self_us / total:>4.0%}")
+
+    def _boot(self, flags, env):
+        result = subprocess.run([sys.executable, *flags, '-c', BOOT], env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f"Boot failed:\n{result.stderr[-2000:]}")
+        return result.stderr
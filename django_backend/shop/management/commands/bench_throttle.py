@@ -0,0 +1,57 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework.throttling import AnonRateThrottle
+
+from shop.throttling import AnonBucketThrottle
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request cost of the token bucket throttle against DRF's stock "
+        "history-list throttle, using the configured throttle cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000, help="Simulated requests per throttle.")
+        parser.add_argument('--clients', type=int, default=50, help="Distinct client IPs to spread them over.")
+        parser.add_argument('--rate', default='100000/min', help="Rate for both throttles; high enough to allow all.")
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        requests = [
+            Request(factory.get('/api/products/', REMOTE_ADDR=f"10.0.{i // 250}.{i % 250}"))
+            for i in range(options['clients'])
+        ]
+
+        class History(AnonRateThrottle):
+            scope, rate = 'bench-history', options['rate']
+
+        class Bucket(AnonBucketThrottle):
+            scope, rate = 'bench-bucket', options['rate']
+
+        self.stdout.write(f"Benchmarking {options['requests']} requests from {options['clients']} clients...")
+        baseline = statistics.mean(self._run(None, requests, options['requests']))
+        results = (('drf history list', self._run(History, requests, options['requests'])),
+                   ('token bucket', self._run(Bucket, requests, options['requests'])))
+        for label, timings in results:
+            self.stdout.write(
+                f"{label:>16}: mean {statistics.mean(timings) - baseline:.1f} us, "
+                f"p95 {self._p95(timings) - baseline:.1f} us per request"
+            )
+
+    def _run(self, throttle_class, requests, count):
+        timings = []
+        for i in range(count):
+            request = requests[i % len(requests)]
+            start = time.perf_counter()
+            # Throttles are instantiated per request, as APIView.get_throttles does
+            if throttle_class is not None and not throttle_class().allow_request(request, None):
+                raise RuntimeError("Throttled during the benchmark; raise --rate.")
+            timings.append((time.perf_counter() - start) * 1_000_000)
+        return timings
+
+    def _p95(self, timings):
+        return sorted(timings)[int(len(timings) * 0.95) - 1]
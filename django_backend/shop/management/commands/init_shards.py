@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.sharding import reserve_id_range
+
+
+class Command(BaseCommand):
+    help = "Migrate every customer shard and give each its own range of ids for customer-owned rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-migrate', action='store_true', help="Only reserve the id ranges.")
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_SHARDS:
+            raise CommandError("No shards configured; set DATABASE_SHARD_URLS.")
+        for alias in settings.DATABASE_SHARDS:
+            if not options['skip_migrate']:
+                call_command('record_baseline_migration', database=alias, verbosity=options['verbosity'])
+                call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'])
+            reserve_id_range(alias)
+            self.stdout.write(self.style.SUCCESS(f"{alias}: ready."))
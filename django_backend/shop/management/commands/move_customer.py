@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.sharding import move_customer, shard_aliases, shard_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Move customers' carts, orders, invoices, payments, addresses and ratings to another shard. "
+        "Their writes are refused (503) during the move, which waits SHARD_MOVE_GRACE_SECONDS twice; "
+        "run it again to resume an interrupted move."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('customer_ids', nargs='+', type=int, help="Customers to move.")
+        parser.add_argument('--to', required=True, help="Target shard alias, e.g. shard_2 or default.")
+
+    def handle(self, *args, **options):
+        target = options['to']
+        if not settings.DATABASE_SHARDS:
+            raise CommandError("No shards configured; set DATABASE_SHARD_URLS.")
+        if target not in shard_aliases():
+            raise CommandError(f"Unknown shard {target}; choose from {', '.join(shard_aliases())}.")
+        customers = set(get_user_model().objects.filter(pk__in=options['customer_ids']).values_list('pk', flat=True))
+        for customer_id in options['customer_ids']:
+            if customer_id not in customers:
+                self.stdout.write(self.style.WARNING(f"No customer {customer_id}, skipped."))
+                continue
+            source = shard_for(customer_id)
+            try:
+                moved = move_customer(customer_id, target)
+            except RuntimeError as exc:
+                raise CommandError(str(exc))
+            if not moved:
+                self.stdout.write(f"Customer {customer_id} is already on {target}.")
+                continue
+            summary = ', '.join(f"{count} {label.split('.')[1]}" for label, count in moved.items() if count)
+            self.stdout.write(self.style.SUCCESS(
+                f"Moved customer {customer_id} from {source} to {target}: {summary or 'no rows'}."
+            ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.recorder import MigrationRecorder
+
+BASELINE = ('shop', '0001_initial')
+
+
+class Command(BaseCommand):
+    help = (
+        "Record shop's 0001_initial as applied on a database whose original tables were created "
+        "before the shop migrations were committed, so `migrate` only adds what came after. "
+        "Fresh databases and those with shop migrations recorded are left alone."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database to check.")
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        recorder = MigrationRecorder(connection)
+        if recorder.has_table() and recorder.migration_qs.filter(app=BASELINE[0]).exists():
+            return
+        executor = MigrationExecutor(connection)
+        migration = executor.loader.get_migration(*BASELINE)
+        applied, _ = executor.detect_soft_applied(None, migration)
+        if not applied:
+            if 'shop_customer' in connection.introspection.table_names():
+                raise CommandError(
+                    f"{options['database']} has shop tables that do not match {BASELINE[1]}; record it by hand."
+                )
+            return  # A fresh database: migrate creates everything
+        recorder.record_applied(*BASELINE)
+        self.stdout.write(self.style.SUCCESS(f"{options['database']}: recorded shop.{BASELINE[1]} as applied."))
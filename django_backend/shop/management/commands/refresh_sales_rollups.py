@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.analytics import refresh_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Fold new orders and transactions into the daily sales rollup tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rebuild the rollups from the whole history.")
+
+    def handle(self, *args, **options):
+        days = refresh_sales_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed sales rollups for {days} days."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from shop.outbox import run_relay
+
+
+class Command(BaseCommand):
+    help = "Publish outbox events in batches through OUTBOX_TRANSPORT."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait when the outbox is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once the outbox is drained.")
+
+    def handle(self, *args, **options):
+        published = run_relay(batch_size=options['batch_size'], poll_interval=options['interval'], once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f"Published {published} events."))
@@ -0,0 +1,56 @@
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from shop.invoices import document_path, get_process_pool, invoice_data
+from shop.models import Invoice
+from shop.sharding import across_shards
+from shop.pdf import render_invoice_pdf
+
+
+class Command(BaseCommand):
+    help = "Pre-render invoice documents in a process pool (e.g. ahead of month-end downloads)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-check every invoice, not only those without a document.")
+        parser.add_argument('--batch-size', type=int, default=200, help="Invoices rendered per batch.")
+
+    def handle(self, *args, **options):
+        invoices = Invoice.objects.select_related('order', 'customer').order_by('id')
+        if not options['all']:
+            invoices = invoices.filter(document__isnull=True)
+
+        rendered = reused = 0
+        pool = get_process_pool()
+        batch = []
+        for shard_invoices in across_shards(invoices):
+            for invoice in shard_invoices.iterator(chunk_size=options['batch_size']):
+                batch.append(invoice)
+                if len(batch) >= options['batch_size']:
+                    counts = self._render_batch(pool, batch)
+                    rendered, reused = rendered + counts[0], reused + counts[1]
+                    batch = []
+        if batch:
+            counts = self._render_batch(pool, batch)
+            rendered, reused = rendered + counts[0], reused + counts[1]
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} invoices, reused {reused} cached documents."))
+
+    def _render_batch(self, pool, invoices):
+        rendered = reused = 0
+        jobs = []
+        for invoice in invoices:
+            data = invoice_data(invoice)
+            path = document_path(data)
+            if default_storage.exists(path):
+                reused += 1
+                jobs.append((invoice, path, None))
+            else:
+                jobs.append((invoice, path, pool.submit(render_invoice_pdf, data)))
+        for invoice, path, future in jobs:
+            if future is not None:
+                path = default_storage.save(path, ContentFile(future.result()))
+                rendered += 1
+            if invoice.document != path:
+                Invoice.objects.using(invoice._state.db).filter(pk=invoice.pk).update(document=path)
+        return rendered, reused
@@ -0,0 +1,41 @@
+import multiprocessing
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop.tasks import run_worker
+
+
+class Command(BaseCommand):
+    help = "Run background task workers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Number of worker processes.")
+        parser.add_argument('--batch-size', type=int, default=10, help="Tasks claimed per poll.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when idle.")
+        parser.add_argument('--burst', action='store_true', help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        worker_options = {
+            'burst': options['burst'],
+            'batch_size': options['batch_size'],
+            'poll_interval': options['poll_interval'],
+        }
+        if options['processes'] <= 1:
+            run_worker(**worker_options)
+            return
+
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=run_worker, kwargs=worker_options, daemon=True)
+            for _ in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"Started {len(workers)} task workers.")
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -0,0 +1,32 @@
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Local stand-in for the stock alert webhook: prints every event it receives."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8099)
+
+    def handle(self, *args, **options):
+        stdout = self.stdout
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                for event in json.loads(body or b'{}').get('events', []):
+                    stdout.write(f"{event['created_at']} {event['level']} {event['product_name']} "
+                                 f"stock={event['stock']} threshold={event['threshold']}")
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', options['port']), Handler)
+        self.stdout.write(f"Set STOCK_ALERT_WEBHOOK_URL=http://127.0.0.1:{options['port']}/ to send alerts here.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
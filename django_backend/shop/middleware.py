@@ -0,0 +1,95 @@
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from .compression import acompress_stream, compress_stream, is_compressible, negotiate
+from .routers import begin_request, end_request, pin_to_primary
+from . import sharding
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Scope read-replica routing state to the request, and pin users who wrote during the
+    request to the primary for a short window so they read their own writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            state = end_request(token)
+        user = getattr(request, 'user', None)
+        if settings.DATABASE_REPLICAS and state['wrote'] and user is not None and user.is_authenticated:
+            pin_to_primary(user.pk)
+        return response
+
+
+class CustomerShardMiddleware:
+    """
+    Make the request visible to the shard router, which sends customer-owned queries to
+    the shard of the customer it is served for once they are authenticated.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_SHARDS:
+            return self.get_response(request)
+        tokens = sharding.begin_request(request)
+        try:
+            return self.get_response(request)
+        finally:
+            sharding.end_request(tokens)
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with the best encoding both sides support (br, zstd or gzip, see
+    COMPRESSION_ENCODINGS). Bodies under COMPRESSION_MIN_SIZE, already encoded ones and
+    binary types are left alone; streaming responses are compressed chunk by chunk.
+
+    Responses that set or use the CSRF token are sent uncompressed, which rules out BREACH:
+    only cookie-session pages (admin, forms) carry it, and the API uses bearer tokens.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.has_header('Content-Encoding') or not is_compressible(response.get('Content-Type', '')):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        # get_token() flags the request, and CsrfViewMiddleware then sets the cookie
+        if request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or settings.CSRF_COOKIE_NAME in response.cookies:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        codec = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if codec is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(codec, response.streaming_content)
+            else:
+                response.streaming_content = compress_stream(codec, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            compressed = codec.compress(response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # A strong ETag would claim byte-for-byte equality with the uncompressed body
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = codec.encoding
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.17 on 2026-10-19 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_tasks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='document',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.17 on 2026-10-19 09:30
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    """
+    Fold the rows a cart holds for one product into its oldest row, with the summed
+    quantity, so the constraint below can be added. The stock they reserved is unchanged.
+    """
+    using = schema_editor.connection.alias
+    rows = apps.get_model('shop', 'CartItem')._base_manager.using(using)
+    duplicates = (
+        rows.values('customer_id', 'product_id')
+        .annotate(lines=Count('id'), total=Sum('quantity'), keep=Min('id'))
+        .filter(lines__gt=1)
+        .order_by()
+    )
+    for line in duplicates:
+        rows.filter(pk=line['keep']).update(quantity=line['total'])
+        rows.filter(customer_id=line['customer_id'], product_id=line['product_id']).exclude(pk=line['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('customer', 'product'), name='unique_customer_cart_product'),
+        ),
+    ]
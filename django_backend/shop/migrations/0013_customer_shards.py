@@ -0,0 +1,31 @@
+# Generated by Django 4.2.17 on 2026-10-19 09:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import shop.sharding
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerShard',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shard', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('alias', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Customer Shard',
+                'verbose_name_plural': 'Customer Shards',
+                'db_table': 'shop_customer_shard',
+            },
+        ),
+        # Only on the shards, and on the default database while sharding is on
+        shop.sharding.DropCrossShardConstraints(),
+    ]
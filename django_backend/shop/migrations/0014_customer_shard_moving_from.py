@@ -0,0 +1,18 @@
+# Generated by Django 4.2.17 on 2026-10-19 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_customer_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customershard',
+            name='moving_from',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
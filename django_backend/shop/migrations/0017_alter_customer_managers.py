@@ -0,0 +1,20 @@
+# Generated by Django 4.2.17 on 2026-10-19 09:30
+
+from django.db import migrations
+import shop.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_cart_item_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='customer',
+            managers=[
+                ('objects', shop.models.CustomerUserManager()),
+            ],
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.contrib.auth.models import AbstractUser, BaseUserManager, UserManager
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
 from django.utils.timezone import now
@@ -7,6 +7,8 @@ import uuid
 import hashlib
 from django.utils.text import slugify
 
+from .sharding import CustomerOwnedQuerySet, CustomerQuerySet
+
 
 class CustomerManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -30,12 +32,18 @@ class CustomerManager(BaseUserManager):
         return self.create_user(email, password, **extra_fields)
 
 
+class CustomerUserManager(UserManager.from_queryset(CustomerQuerySet)):
+    pass
+
+
 # Custom User Model for Customer
 class Customer(AbstractUser):
     username = models.CharField(max_length=150, unique=False, blank=True, null=True)
     email = models.EmailField(unique=True)
     phone_number = models.CharField(max_length=15, unique=True)
     
+    objects = CustomerUserManager()
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
@@ -53,6 +61,7 @@ class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    reorder_point = models.PositiveIntegerField(blank=True, null=True)  # Default for its products
 
     def __str__(self):
         return self.name
@@ -72,10 +81,18 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="products")
     created_at = models.DateTimeField(auto_now_add=True)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)  # Filled by shop.images
+    reorder_point = models.PositiveIntegerField(blank=True, null=True)  # Falls back to the category's
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_price = instance.__dict__.get('price')  # Lets signals detect price changes
+        return instance
+
     class Meta:
         constraints = [
             models.CheckConstraint(check=models.Q(stock__gte=0), name='stock_non_negative'),
@@ -91,6 +108,9 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
     added_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = CustomerOwnedQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.quantity} of {self.product.name}"
@@ -100,6 +120,9 @@ class CartItem(models.Model):
         verbose_name = "Cart Item"
         verbose_name_plural = "Cart Items"
         ordering = ['added_at']
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'product'], name='unique_customer_cart_product')
+        ]
 
 
 # Order Model
@@ -111,9 +134,17 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     tracking_number = models.CharField(max_length=50, blank=True, null=True)  # Ensure this field is included
 
+    objects = CustomerOwnedQuerySet.as_manager()
+
     def __str__(self):
         return f"Order {self.id} by {self.customer.email}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_status = instance.__dict__.get('status')  # Lets signals detect status changes
+        return instance
+
     class Meta:
         db_table = 'shop_order'
         verbose_name = "Order"
@@ -128,6 +159,8 @@ class OrderItem(models.Model):
     quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
     price = models.DecimalField(max_digits=12, decimal_places=2)
 
+    objects = CustomerOwnedQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.quantity} of {self.product.name} in Order {self.order.id}"
 
@@ -143,6 +176,9 @@ class Invoice(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="invoices")
     issued_at = models.DateTimeField(auto_now_add=True)
     total_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    document = models.CharField(max_length=255, blank=True, null=True, editable=False)  # Rendered PDF in storage
+
+    objects = CustomerOwnedQuerySet.as_manager()
 
     def __str__(self):
         return f"Invoice {self.id} for Order {self.order.id}"
@@ -168,6 +204,8 @@ class PaymentMethod(models.Model):
     number = models.CharField(max_length=20)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CustomerOwnedQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if self.number and len(self.number) > 4:
             self.number = self.mask_card_number_display()
@@ -202,6 +240,8 @@ class Transaction(models.Model):
     transaction_date = models.DateTimeField(auto_now_add=True)
     stripe_payment_intent_id = models.CharField(max_length=255, blank=True, null=True)
 
+    objects = CustomerOwnedQuerySet.as_manager()
+
     def __str__(self):
         return f"Transaction {self.transaction_id} for Order {self.order.id}"
 
@@ -219,6 +259,8 @@ class ProductRating(models.Model):
     rating = models.PositiveIntegerField(validators=[MinValueValidator(1), MaxValueValidator(5)])
     rated_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CustomerOwnedQuerySet.as_manager()
+
     def __str__(self):
         return f"Rating {self.rating} by {self.customer.email} for {self.product.name}"
 
@@ -259,6 +301,8 @@ class Address(models.Model):
     is_default = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CustomerOwnedQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.street}, {self.city}, {self.country}"
 
@@ -285,4 +329,355 @@ class Coupon(models.Model):
         db_table = 'shop_coupon'
         verbose_name = "Coupon"
         verbose_name_plural = "Coupons"
-        ordering = ['-valid_from']
\ No newline at end of file
+        ordering = ['-valid_from']
+
+
+# Change Counter Model
+class ChangeCounter(models.Model):
+    """
+    Per-table version counter, bumped whenever a row of the tracked table changes.
+    Used to derive cheap ETag / Last-Modified validators for read endpoints.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=now)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+    class Meta:
+        db_table = 'shop_change_counter'
+        verbose_name = "Change Counter"
+        verbose_name_plural = "Change Counters"
+
+
+# Bulk Job Model
+class BulkJob(models.Model):
+    """
+    Admin bulk action executed in chunks in the background, with progress tracking.
+    """
+    STATUS_CHOICES = [("PENDING", "Pending"), ("RUNNING", "Running"), ("COMPLETED", "Completed"), ("FAILED", "Failed")]
+    operation = models.CharField(max_length=50)
+    description = models.CharField(max_length=255)
+    params = models.JSONField(default=dict, blank=True)
+    object_ids = models.JSONField(default=list, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING")
+    error = models.TextField(blank=True, null=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    @property
+    def progress(self):
+        return round(100 * self.processed / self.total) if self.total else 100
+
+    def __str__(self):
+        return f"{self.description} ({self.processed}/{self.total})"
+
+    class Meta:
+        db_table = 'shop_bulk_job'
+        verbose_name = "Bulk Job"
+        verbose_name_plural = "Bulk Jobs"
+        ordering = ['-created_at']
+
+
+# Task Model
+class Task(models.Model):
+    """
+    Queued background task, executed by `manage.py run_tasks` workers.
+    """
+    STATUS_CHOICES = [("QUEUED", "Queued"), ("RUNNING", "Running"), ("FAILED", "Failed")]
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="QUEUED")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=now)
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Task {self.id} {self.name} ({self.status})"
+
+    class Meta:
+        db_table = 'shop_task'
+        verbose_name = "Task"
+        verbose_name_plural = "Tasks"
+        ordering = ['run_at', 'id']
+        indexes = [models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx')]
+
+
+# Archived Order Model
+class ArchivedOrder(models.Model):
+    """
+    Completed or cancelled order moved out of shop_order by `manage.py archive_orders`.
+    Keeps the original primary key.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="archived_orders")
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    tracking_number = models.CharField(max_length=50, blank=True, null=True)
+    archived_at = models.DateTimeField(default=now)
+
+    def __str__(self):
+        return f"Archived Order {self.id}"
+
+    class Meta:
+        db_table = 'shop_archived_order'
+        verbose_name = "Archived Order"
+        verbose_name_plural = "Archived Orders"
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['customer', 'created_at'], name='archived_order_customer_idx')]
+
+
+# Archived Order Item Model
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="order_items")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+
+    def __str__(self):
+        return f"Archived Order Item {self.id}"
+
+    class Meta:
+        db_table = 'shop_archived_order_item'
+        verbose_name = "Archived Order Item"
+        verbose_name_plural = "Archived Order Items"
+
+
+# Archived Transaction Model
+class ArchivedTransaction(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="transactions")
+    payment_method = models.ForeignKey(PaymentMethod, on_delete=models.SET_NULL, null=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="archived_transactions")
+    transaction_id = models.UUIDField(unique=True)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    transaction_date = models.DateTimeField()
+    stripe_payment_intent_id = models.CharField(max_length=255, blank=True, null=True)
+
+    def __str__(self):
+        return f"Archived Transaction {self.transaction_id}"
+
+    class Meta:
+        db_table = 'shop_archived_transaction'
+        verbose_name = "Archived Transaction"
+        verbose_name_plural = "Archived Transactions"
+        ordering = ['-transaction_date']
+
+
+# Archived Invoice Model
+class ArchivedInvoice(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.OneToOneField(ArchivedOrder, on_delete=models.CASCADE, related_name="invoice")
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name="archived_invoices")
+    issued_at = models.DateTimeField()
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    document = models.CharField(max_length=255, blank=True, null=True)
+
+    def __str__(self):
+        return f"Archived Invoice {self.id}"
+
+    class Meta:
+        db_table = 'shop_archived_invoice'
+        verbose_name = "Archived Invoice"
+        verbose_name_plural = "Archived Invoices"
+        ordering = ['-issued_at']
+
+
+# Daily Product Sales Rollup
+class DailyProductSales(models.Model):
+    """
+    Units, revenue and order count per product and day, maintained by
+    `shop.analytics.refresh_sales_rollups` for the reporting endpoints.
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="daily_sales")
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="daily_sales")
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.product_id} on {self.date}: {self.units} units"
+
+    class Meta:
+        db_table = 'shop_daily_product_sales'
+        verbose_name = "Daily Product Sales"
+        verbose_name_plural = "Daily Product Sales"
+        ordering = ['-date', 'product']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_daily_product_sales')
+        ]
+        indexes = [models.Index(fields=['category', 'date'], name='daily_sales_category_idx')]
+
+
+# Daily Sales Total Rollup
+class DailySalesTotal(models.Model):
+    """
+    Store-wide totals per day: orders and item revenue by order date, payments by
+    transaction date.
+    """
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    transactions = models.PositiveIntegerField(default=0)
+    payments = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Sales on {self.date}"
+
+    class Meta:
+        db_table = 'shop_daily_sales_total'
+        verbose_name = "Daily Sales Total"
+        verbose_name_plural = "Daily Sales Totals"
+        ordering = ['-date']
+
+
+# Rollup Watermark Model
+class RollupWatermark(models.Model):
+    """
+    High-water mark of the source rows already folded into a rollup.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    value = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
+
+    class Meta:
+        db_table = 'shop_rollup_watermark'
+        verbose_name = "Rollup Watermark"
+        verbose_name_plural = "Rollup Watermarks"
+
+
+# Low Stock Index Model
+class LowStockProduct(models.Model):
+    """
+    Products currently at or below their reorder point, maintained by `shop.stock`
+    whenever stock changes. Also the deduplication state for stock alerts.
+    """
+    LEVEL_CHOICES = [("LOW", "Low stock"), ("OUT", "Out of stock")]
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="low_stock")
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES)
+    stock = models.PositiveIntegerField()
+    threshold = models.PositiveIntegerField()
+    since = models.DateTimeField(default=now)
+
+    def __str__(self):
+        return f"{self.product_id} {self.level} ({self.stock}/{self.threshold})"
+
+    class Meta:
+        db_table = 'shop_low_stock_product'
+        verbose_name = "Low Stock Product"
+        verbose_name_plural = "Low Stock Products"
+        ordering = ['stock', 'product']
+
+
+# Stock Alert Model
+class StockAlert(models.Model):
+    """
+    Low-stock and out-of-stock events written by `shop.stock.DatabaseSink`.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="stock_alerts")
+    level = models.CharField(max_length=10, choices=LowStockProduct.LEVEL_CHOICES)
+    stock = models.PositiveIntegerField()
+    threshold = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.level} alert for product {self.product_id}"
+
+    class Meta:
+        db_table = 'shop_stock_alert'
+        verbose_name = "Stock Alert"
+        verbose_name_plural = "Stock Alerts"
+        ordering = ['-created_at']
+
+
+# Outbox Event Model
+class OutboxEvent(models.Model):
+    """
+    Domain event written in the same transaction as the change it describes and
+    published afterwards by `manage.py relay_outbox`. The id doubles as the consumer cursor.
+    """
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(max_length=100)
+    aggregate_type = models.CharField(max_length=50)
+    aggregate_id = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"Event {self.id} {self.topic} ({self.aggregate_type} {self.aggregate_id})"
+
+    class Meta:
+        db_table = 'shop_outbox_event'
+        verbose_name = "Outbox Event"
+        verbose_name_plural = "Outbox Events"
+        ordering = ['id']
+        indexes = [models.Index(fields=['published_at', 'id'], name='outbox_published_idx')]
+
+
+# Idempotency Key Model
+class IdempotencyKey(models.Model):
+    """
+    Stored outcome of a mutating request sent with an `Idempotency-Key` header, replayed
+    for retries of the same request until `expires_at`.
+    """
+    STATUS_CHOICES = [("IN_PROGRESS", "In progress"), ("COMPLETED", "Completed")]
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name="idempotency_keys")
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # sha256 of method, path and body
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="IN_PROGRESS")
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(default=now)  # When the current holder claimed the key
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Idempotency key {self.key} ({self.status})"
+
+    class Meta:
+        db_table = 'shop_idempotency_key'
+        verbose_name = "Idempotency Key"
+        verbose_name_plural = "Idempotency Keys"
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'key'], name='unique_customer_idempotency_key')
+        ]
+        indexes = [models.Index(fields=['expires_at'], name='idempotency_expires_idx')]
+
+
+# Customer Shard Model
+class CustomerShard(models.Model):
+    """
+    Shard map entry: the database alias holding a customer's own rows (see shop.sharding).
+    Customers without one are on the default database.
+    """
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name="shard")
+    alias = models.CharField(max_length=64)
+    # Shard the customer is being moved from; their writes are refused meanwhile
+    moving_from = models.CharField(max_length=64, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Customer {self.customer_id} on {self.alias}"
+
+    class Meta:
+        db_table = 'shop_customer_shard'
+        verbose_name = "Customer Shard"
+        verbose_name_plural = "Customer Shards"
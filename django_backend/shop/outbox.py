@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def record_event(topic, aggregate_type, aggregate_id, payload):
+    """
+    Write an event in the caller's transaction: it becomes visible, and is published,
+    only if the change it describes commits.
+    """
+    return OutboxEvent.objects.create(
+        topic=topic, aggregate_type=aggregate_type, aggregate_id=str(aggregate_id), payload=payload
+    )
+
+
+def order_payload(order, previous_status=None):
+    return {
+        'order_id': order.pk,
+        'customer_id': order.customer_id,
+        'status': order.status,
+        'previous_status': previous_status,
+        'tracking_number': order.tracking_number,
+        'total_amount': str(order.total_amount),
+    }
+
+
+def order_status_events(orders_with_previous):
+    """
+    Write one `order.status_changed` event per (order, previous_status) in a single INSERT,
+    for set-based status updates that bypass the model signals.
+    """
+    OutboxEvent.objects.bulk_create([
+        OutboxEvent(topic='order.status_changed', aggregate_type='order', aggregate_id=str(order.pk),
+                    payload=order_payload(order, previous))
+        for order, previous in orders_with_previous
+    ])
+
+
+def event_data(event):
+    return {
+        'id': event.id,
+        'topic': event.topic,
+        'aggregate_type': event.aggregate_type,
+        'aggregate_id': event.aggregate_id,
+        'payload': event.payload,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+class FileTransport:
+    """
+    Append events as NDJSON to OUTBOX_FILE, for a log shipper or a local consumer to tail.
+    """
+
+    def publish(self, events):
+        with open(settings.OUTBOX_FILE, 'a', encoding='utf-8') as fh:
+            for event in events:
+                fh.write(json.dumps(event, sort_keys=True) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+class HttpTransport:
+    """
+    POST each batch as {"events": [...]} to OUTBOX_HTTP_URL; any non-2xx answer is retried.
+    """
+
+    def publish(self, events):
+        response = requests.post(settings.OUTBOX_HTTP_URL, json={'events': events}, timeout=10)
+        response.raise_for_status()
+
+
+def get_transport():
+    return import_string(settings.OUTBOX_TRANSPORT)()
+
+
+def relay_batch(transport, batch_size=100):
+    """
+    Publish the oldest unpublished events in id order, then mark them published.
+
+    The batch stays locked while it is published, so concurrent relays wait rather than
+    reorder events. Delivery is at least once: a crash after publishing re-sends the batch.
+    """
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update().filter(published_at__isnull=True).order_by('id')[:batch_size]
+        )
+        if not events:
+            return 0
+        transport.publish([event_data(event) for event in events])
+        OutboxEvent.objects.filter(id__in=[event.id for event in events]).update(published_at=timezone.now())
+    return len(events)
+
+
+def purge_published(days):
+    before = timezone.now() - timedelta(days=days)
+    deleted, _ = OutboxEvent.objects.filter(published_at__lt=before).delete()
+    return deleted
+
+
+def run_relay(transport=None, batch_size=100, poll_interval=1.0, once=False):
+    """
+    Relay loop: drain the outbox in batches, sleeping when it is empty. With `once`,
+    return after the outbox is drained. Returns the number of events published.
+    """
+    transport = transport or get_transport()
+    published = 0
+    last_purge = 0.0
+    while True:
+        try:
+            count = relay_batch(transport, batch_size)
+        except Exception:
+            logger.exception("Publishing outbox events failed; retrying.")
+            if once:
+                raise
+            time.sleep(poll_interval)
+            continue
+        published += count
+        if time.monotonic() - last_purge > 3600:
+            purge_published(settings.OUTBOX_RETENTION_DAYS)
+            last_purge = time.monotonic()
+        if count < batch_size:
+            if once:
+                return published
+            time.sleep(poll_interval)
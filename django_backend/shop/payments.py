@@ -0,0 +1,13 @@
+import functools
+from django.conf import settings
+
+
+@functools.lru_cache(maxsize=None)
+def get_stripe():
+    """
+    Import and configure the Stripe SDK on first use. Importing it loads every API
+    resource class and takes about a second, which only the payment endpoints need.
+    """
+    import stripe
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    return stripe
@@ -0,0 +1,97 @@
+"""
+Minimal pure-Python PDF writer for invoice documents.
+
+Kept free of Django imports so it can run in worker processes of a process pool.
+"""
+
+PAGE_WIDTH = 595  # A4 in points
+PAGE_HEIGHT = 842
+MARGIN = 50
+ROWS_PER_PAGE = 40
+COLUMNS = (MARGIN, 360, 420, 495)  # Item, Qty, Unit price, Amount
+
+
+def _escape(text):
+    return str(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _text(x, y, text, size=10, font='F1'):
+    return f"BT /{font} {size} Tf {x} {y} Td ({_escape(text)}) Tj ET"
+
+
+def _page_content(data, rows, page_number, page_count, last_page):
+    ops = []
+    y = PAGE_HEIGHT - MARGIN
+    ops.append(_text(MARGIN, y, f"GreenCart Invoice #{data['invoice_id']}", size=18, font='F2'))
+    y -= 28
+    ops.append(_text(MARGIN, y, f"Issued: {data['issued_at']}"))
+    ops.append(_text(360, y, f"Order #{data['order_id']}"))
+    y -= 14
+    ops.append(_text(MARGIN, y, f"Bill to: {data['customer_name']} <{data['customer_email']}>"))
+    y -= 30
+
+    headers = ('Item', 'Qty', 'Unit price', 'Amount')
+    for x, header in zip(COLUMNS, headers):
+        ops.append(_text(x, y, header, font='F2'))
+    y -= 6
+    ops.append(f"{MARGIN} {y} m {PAGE_WIDTH - MARGIN} {y} l S")
+    y -= 14
+
+    for item in rows:
+        name = item['name'] if len(item['name']) <= 50 else item['name'][:47] + '...'
+        for x, value in zip(COLUMNS, (name, item['quantity'], item['price'], item['amount'])):
+            ops.append(_text(x, y, value))
+        y -= 16
+
+    if last_page:
+        y -= 6
+        ops.append(f"{MARGIN} {y} m {PAGE_WIDTH - MARGIN} {y} l S")
+        y -= 18
+        ops.append(_text(COLUMNS[2], y, "Total", font='F2'))
+        ops.append(_text(COLUMNS[3], y, data['total_amount'], font='F2'))
+
+    ops.append(_text(MARGIN, MARGIN - 20, f"Page {page_number} of {page_count}", size=8))
+    return "\n".join(ops).encode('latin-1', errors='replace')
+
+
+def render_invoice_pdf(data):
+    """
+    Render an invoice to PDF bytes.
+
+    data: {'invoice_id', 'order_id', 'issued_at', 'customer_name', 'customer_email',
+           'total_amount', 'items': [{'name', 'quantity', 'price', 'amount'}]}
+    All values are plain strings/numbers so the dict can be pickled to a worker process.
+    """
+    items = data['items'] or [{'name': '(no items)', 'quantity': '', 'price': '', 'amount': ''}]
+    chunks = [items[i:i + ROWS_PER_PAGE] for i in range(0, len(items), ROWS_PER_PAGE)]
+
+    # Object numbers: 1 catalog, 2 page tree, 3-4 fonts, then a page + content pair per page
+    objects = {
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        4: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    }
+    page_refs = []
+    for index, rows in enumerate(chunks):
+        page_obj, content_obj = 5 + 2 * index, 6 + 2 * index
+        content = _page_content(data, rows, index + 1, len(chunks), index == len(chunks) - 1)
+        objects[content_obj] = b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream"
+        objects[page_obj] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_obj} 0 R >>"
+        ).encode()
+        page_refs.append(f"{page_obj} 0 R")
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(objects):
+        offsets[number] = len(output)
+        output += b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n"
+    xref_offset = len(output)
+    count = max(objects) + 1
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % count
+    for number in range(1, count):
+        output += b"%010d 00000 n \n" % offsets[number]
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (count, xref_offset)
+    return bytes(output)
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from rest_framework_simplejwt.tokens import Token
+
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('CANCELLED',)
+
+
+class LocalBroker:
+    """
+    In-process pub/sub for a single node. Publishers may run in any thread; every
+    subscriber is an asyncio queue on the event loop that created it.
+    """
+
+    def __init__(self, queue_size=100):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._queue_size = queue_size
+
+    def subscribe(self, channel):
+        queue = asyncio.Queue(maxsize=self._queue_size)
+        with self._lock:
+            self._subscribers[channel].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._put, queue, message)
+            except RuntimeError:
+                pass  # Loop already closed; the subscriber is going away
+
+    @staticmethod
+    def _put(queue, message):
+        if queue.full():
+            queue.get_nowait()  # Slow consumer: only the latest state matters
+        queue.put_nowait(message)
+
+
+broker = LocalBroker()
+
+
+def order_channel(order_id):
+    return f"order:{order_id}"
+
+
+def order_snapshot(order):
+    return {'order_id': order.pk, 'status': order.status, 'tracking_number': order.tracking_number}
+
+
+def publish_order_status(order):
+    """
+    Push the order's state to its stream subscribers once the current transaction commits.
+    """
+    snapshot = order_snapshot(order)
+    transaction.on_commit(lambda: broker.publish(order_channel(snapshot['order_id']), snapshot))
+
+
+class OrderStreamToken(Token):
+    """
+    Short-lived JWT that only opens the status stream of one order. EventSource cannot send
+    headers, so the token travels in the URL, where access logs keep it; an access token
+    must not.
+    """
+    token_type = 'order_stream'
+
+    @property
+    def lifetime(self):
+        return timedelta(seconds=settings.ORDER_STREAM_TOKEN_LIFETIME)
+
+    @classmethod
+    def for_order(cls, order_id, user):
+        token = cls.for_user(user)
+        token['order_id'] = order_id
+        return token
+
+
+def is_final(snapshot):
+    return snapshot['status'] in TERMINAL_STATUSES or (
+        snapshot['status'] == 'COMPLETED' and bool(snapshot['tracking_number'])
+    )
+
+
+def load_snapshot(order_id, customer):
+    order = Order.objects.filter(pk=order_id, customer=customer).only('id', 'status', 'tracking_number').first()
+    return order_snapshot(order) if order else None
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def order_status_events(order_id, customer, snapshot):
+    """
+    Server-sent events for one order: the current state, then every change until the
+    order is final or ORDER_STREAM_TIMEOUT passes. Changes published by this process
+    arrive immediately; the order row is re-read every ORDER_STREAM_RECHECK_SECONDS to
+    catch changes made by other processes such as the task workers.
+    """
+    channel = order_channel(order_id)
+    queue = broker.subscribe(channel)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.ORDER_STREAM_TIMEOUT
+    try:
+        yield f"retry: {settings.ORDER_STREAM_RETRY_MS}\n" + sse('status', snapshot)
+        while not is_final(snapshot):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                current = await asyncio.wait_for(queue.get(), min(settings.ORDER_STREAM_RECHECK_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                current = await sync_to_async(load_snapshot)(order_id, customer)
+                if current is None:
+                    break
+            if current == snapshot:
+                yield ": keep-alive\n\n"
+                continue
+            snapshot = current
+            yield sse('status', snapshot)
+    finally:
+        broker.unsubscribe(channel, queue)
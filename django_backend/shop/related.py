@@ -0,0 +1,84 @@
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q
+
+from .images import variant_urls
+from .models import Product, ProductRecommendation
+
+logger = logging.getLogger(__name__)
+
+
+def related_key(product_id):
+    return f"related-products:{product_id}"
+
+
+def _thumbnail(row):
+    variants = row['recommended_product__image_variants'] or {}
+    image = row['recommended_product__image']
+    if image and variants.get('source') == image:
+        formats = variant_urls(variants).get('thumbnail', {})
+        if formats:
+            return formats.get('webp') or next(iter(formats.values()))
+    return None
+
+
+def build_related(product_id):
+    """
+    Compact related items for one product, in-stock ones first, capped at
+    RELATED_PRODUCTS_LIMIT. One query joined to the recommended products.
+    """
+    in_stock = ExpressionWrapper(Q(recommended_product__stock__gt=0), output_field=BooleanField())
+    rows = (
+        ProductRecommendation.objects.filter(product_id=product_id)
+        .annotate(in_stock=in_stock)
+        .order_by('-in_stock', 'id')
+        .values('recommended_product_id', 'recommended_product__name', 'recommended_product__price',
+                'recommended_product__image', 'recommended_product__image_variants', 'in_stock')
+        [:settings.RELATED_PRODUCTS_LIMIT]
+    )
+    return [
+        {
+            'product_id': row['recommended_product_id'],
+            'name': row['recommended_product__name'],
+            'price': str(row['recommended_product__price']),
+            'thumbnail': _thumbnail(row),
+            'in_stock': row['in_stock'],
+        }
+        for row in rows
+    ]
+
+
+def related_products(product_id):
+    """
+    The cached blob for `product_id`, built on a miss. Returns None for unknown products.
+    """
+    key = related_key(product_id)
+    blob = cache.get(key)
+    if blob is None:
+        if not Product.objects.filter(pk=product_id).exists():
+            return None
+        blob = build_related(product_id)
+        cache.set(key, blob, settings.RELATED_PRODUCTS_TTL)
+    return blob
+
+
+def invalidate_related(product_ids):
+    """
+    Delete the blobs of `product_ids` once the transaction commits.
+    """
+    keys = [related_key(product_id) for product_id in set(product_ids)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_referencing(product_ids):
+    """
+    Delete the blobs that embed any of `product_ids` (their name, price, image or stock flag changed).
+    """
+    product_ids = list(product_ids)
+    if product_ids:
+        invalidate_related(ProductRecommendation.objects.filter(
+            recommended_product_id__in=product_ids
+        ).values_list('product_id', flat=True))
@@ -0,0 +1,112 @@
+import contextvars
+import logging
+import random
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+# Per-request routing state, set by ReplicaRoutingMiddleware
+_request_state = contextvars.ContextVar('replica_routing', default=None)
+
+# Replicas that failed to connect, skipped until the stored monotonic time
+_unavailable = {}
+
+
+def begin_request():
+    return _request_state.set({'use_replica': False, 'wrote': False})
+
+
+def end_request(token):
+    state = _request_state.get()
+    _request_state.reset(token)
+    return state
+
+
+def use_replica():
+    """
+    Allow reads for the rest of the current request to go to a replica.
+    """
+    state = _request_state.get()
+    if state is not None:
+        state['use_replica'] = True
+
+
+def pin_key(user_id):
+    return f"replica-pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    """
+    Send this user's reads to the primary for REPLICA_STICKY_SECONDS (read-your-writes).
+    """
+    cache.set(pin_key(user_id), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(user_id):
+    return cache.get(pin_key(user_id)) is not None
+
+
+def healthy_replica():
+    """
+    Return a reachable replica alias, or None to fall back to the primary.
+    """
+    now = time.monotonic()
+    candidates = [alias for alias in settings.DATABASE_REPLICAS if _unavailable.get(alias, 0) <= now]
+    random.shuffle(candidates)
+    for alias in candidates:
+        try:
+            connections[alias].ensure_connection()
+            return alias
+        except DatabaseError:
+            logger.warning(f"Read replica {alias} unavailable, falling back to primary.")
+            _unavailable[alias] = now + settings.REPLICA_RETRY_SECONDS
+    return None
+
+
+class ReadReplicaRouter:
+    """
+    Routes reads to a replica only inside requests handled by a ReplicaReadMixin view,
+    never inside a transaction on the primary, and never for users who wrote recently.
+    All writes go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if not state or not state['use_replica'] or state['wrote']:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return healthy_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state['wrote'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication
+        return db not in settings.DATABASE_REPLICAS
+
+
+class ReplicaReadMixin:
+    """
+    View mixin: safe requests may read from a replica unless the user is pinned to the
+    primary after a recent write. Placed after authentication so JWT users are known.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not settings.DATABASE_REPLICAS or request.method not in SAFE_METHODS:
+            return
+        if request.user.is_authenticated and is_pinned(request.user.pk):
+            return
+        use_replica()
@@ -0,0 +1,34 @@
+"""
+drf_yasg is only needed to generate the API docs (see schema_endpoint in the root
+URLconf). Views record their schema overrides here at import, and they are applied with
+drf_yasg's own decorator on the first docs request.
+"""
+_deferred = []
+
+
+def swagger_auto_schema(**overrides):
+    """
+    Lazy drf_yasg.utils.swagger_auto_schema: same arguments, applied by apply_schema_overrides.
+    """
+    def decorator(view_method):
+        # Filled in place later, so wrappers made in the meantime (method_decorator) share it
+        view_method._swagger_auto_schema = {}
+        _deferred.append((view_method, overrides))
+        return view_method
+
+    return decorator
+
+
+def apply_schema_overrides():
+    from drf_yasg.utils import swagger_auto_schema as decorate
+
+    # Each entry is popped once, so concurrent first docs requests never apply one twice
+    while True:
+        try:
+            view_method, overrides = _deferred.pop()
+        except IndexError:
+            return
+        schema = view_method._swagger_auto_schema
+        decorate(**overrides)(view_method)
+        schema.update(view_method._swagger_auto_schema)
+        view_method._swagger_auto_schema = schema
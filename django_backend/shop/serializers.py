@@ -3,24 +3,38 @@ from rest_framework import serializers
 from .models import (
     Customer, CartItem, Order, OrderItem, Invoice,
     PaymentMethod, Transaction, ProductRating, Product, ProductRecommendation, Category,
-    Address, Coupon
+    Address, Coupon, ArchivedOrder, ArchivedOrderItem, ArchivedTransaction, LowStockProduct,
+    OutboxEvent
 )
 from rest_framework.exceptions import ValidationError
+from datetime import timedelta
 from django.utils import timezone
 from django.contrib.auth import authenticate
+from .coupons import coupon_index
+from .images import variant_urls
+from .sparse import SparseFieldsMixin
 
 logger = logging.getLogger(__name__)
 
 # Serializer for Product
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_id = serializers.IntegerField(source='id', read_only=True)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['product_id', 'name', 'description', 'price', 'stock', 'category', 'created_at', 'image']
+        fields = ['product_id', 'name', 'description', 'price', 'stock', 'category', 'created_at', 'image', 'image_variants']
+        expandable_fields = {'category': ('shop.serializers.CategorySerializer', {})}
+        field_sources = {'image_variants': ('image', 'image_variants')}
+
+    def get_image_variants(self, obj):
+        # Variants of a previous image are ignored until the worker catches up
+        if not obj.image or obj.image_variants.get('source') != obj.image.name:
+            return {}
+        return variant_urls(obj.image_variants, self.context.get('request'))
 
 # Serializer for Category
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category_id = serializers.IntegerField(source='id', read_only=True)
 
     class Meta:
@@ -28,7 +42,7 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['category_id', 'name', 'description', 'created_at']
 
 # Serializer for Address
-class AddressSerializer(serializers.ModelSerializer):
+class AddressSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     address_id = serializers.IntegerField(source='id', read_only=True)
 
     class Meta:
@@ -36,7 +50,7 @@ class AddressSerializer(serializers.ModelSerializer):
         fields = ['address_id', 'street', 'city', 'state', 'postal_code', 'country', 'is_default', 'created_at']
 
 # Serializer for PaymentMethod
-class PaymentMethodSerializer(serializers.ModelSerializer):
+class PaymentMethodSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     payment_method_id = serializers.IntegerField(source='id', read_only=True)
 
     class Meta:
@@ -44,13 +58,61 @@ class PaymentMethodSerializer(serializers.ModelSerializer):
         fields = ['payment_method_id', 'customer', 'method_type', 'number', 'added_at']
 
 # Serializer for CartItem
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True)
+    unit_price = serializers.DecimalField(source='product.price', max_digits=10, decimal_places=2, read_only=True)
+    subtotal = serializers.SerializerMethodField()
+
     class Meta:
         model = CartItem
         fields = '__all__'
+        expandable_fields = {'product': ('shop.serializers.ProductSerializer', {})}
+        field_sources = {'subtotal': ('quantity', 'product__price')}
+        validators = []  # Re-adding a product increments the existing line instead
+
+    def get_subtotal(self, obj):
+        return str(obj.product.price * obj.quantity)
+
+# Serializer for one priced cart line
+class CartSummaryLineSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    product = serializers.IntegerField()
+    product_name = serializers.CharField()
+    quantity = serializers.IntegerField()
+    unit_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    subtotal = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+# Serializer for the priced cart
+class CartSummarySerializer(serializers.Serializer):
+    lines = CartSummaryLineSerializer(many=True)
+    item_count = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=14, decimal_places=2)
+    coupon = serializers.CharField(allow_null=True)
+    discount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    total = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+# Serializer for one line of a batch cart update
+class CartBatchLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0)
+
+# Serializer for batch cart updates
+class CartBatchSerializer(serializers.Serializer):
+    mode = serializers.ChoiceField(choices=['add', 'set'], default='add')
+    items = CartBatchLineSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, value):
+        if len(value) > 200:
+            raise ValidationError("At most 200 lines per request.")
+        return value
+
+    def validate(self, data):
+        if data['mode'] == 'add' and any(line['quantity'] < 1 for line in data['items']):
+            raise ValidationError("Quantities must be at least 1 when adding.")
+        return data
 
 # Serializer for OrderItem
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     order_item_id = serializers.IntegerField(source='id', read_only=True)
     product_id = serializers.IntegerField(source='product.id', read_only=True)
     order_id = serializers.IntegerField(source='order.id', read_only=True)
@@ -58,9 +120,10 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['order_item_id', 'order_id', 'product_id', 'quantity', 'price']
+        expandable_fields = {'product': ('shop.serializers.ProductSerializer', {})}
 
 # Serializer for Order
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     order_id = serializers.IntegerField(source='id', read_only=True)
     customer_id = serializers.IntegerField(source='customer.id', read_only=True)
     order_items = OrderItemSerializer(many=True, read_only=True)
@@ -77,7 +140,7 @@ class OrderSerializer(serializers.ModelSerializer):
         return order
 
 # Serializer for Transaction
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     transaction_id = serializers.IntegerField(source='id', read_only=True)
     order_id = serializers.IntegerField(source='order.id', read_only=True)
     customer_id = serializers.IntegerField(source='customer.id', read_only=True)
@@ -86,14 +149,52 @@ class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = ['transaction_id', 'order_id', 'customer_id', 'payment_method_id', 'amount', 'transaction_date', 'stripe_payment_intent_id']
+        expandable_fields = {'order': ('shop.serializers.OrderSerializer', {})}
+        field_sources = {'payment_method': ('payment_method__method_type',)}
 
     def to_representation(self, instance):
         rep = super().to_representation(instance)
-        rep['payment_method'] = PaymentMethodSerializer(instance.payment_method).data
+        if self.wants('payment_method'):
+            rep['payment_method'] = PaymentMethodSerializer(instance.payment_method).data
+        return rep
+
+# Serializer for ArchivedOrderItem
+class ArchivedOrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    order_item_id = serializers.IntegerField(source='id', read_only=True)
+
+    class Meta:
+        model = ArchivedOrderItem
+        fields = ['order_item_id', 'order_id', 'product_id', 'quantity', 'price']
+
+# Serializer for ArchivedOrder, shaped like OrderSerializer
+class ArchivedOrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    order_id = serializers.IntegerField(source='id', read_only=True)
+    order_items = ArchivedOrderItemSerializer(many=True, read_only=True)
+    archived = serializers.BooleanField(default=True, read_only=True)
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['order_id', 'customer_id', 'total_amount', 'status', 'created_at', 'order_items', 'archived']
+
+# Serializer for ArchivedTransaction, shaped like TransactionSerializer
+class ArchivedTransactionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    transaction_id = serializers.IntegerField(source='id', read_only=True)
+    archived = serializers.BooleanField(default=True, read_only=True)
+
+    class Meta:
+        model = ArchivedTransaction
+        fields = ['transaction_id', 'order_id', 'customer_id', 'payment_method_id', 'amount', 'transaction_date',
+                  'stripe_payment_intent_id', 'archived']
+        field_sources = {'payment_method': ('payment_method__method_type',)}
+
+    def to_representation(self, instance):
+        rep = super().to_representation(instance)
+        if self.wants('payment_method'):
+            rep['payment_method'] = PaymentMethodSerializer(instance.payment_method).data
         return rep
 
 # Serializer for Invoice
-class InvoiceSerializer(serializers.ModelSerializer):
+class InvoiceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     invoice_id = serializers.IntegerField(source='id', read_only=True)
     order_id = serializers.IntegerField(source='order.id', read_only=True)
     customer_id = serializers.IntegerField(source='customer.id', read_only=True)
@@ -101,9 +202,10 @@ class InvoiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
         fields = ['invoice_id', 'order_id', 'customer_id', 'total_amount', 'issued_at']
+        expandable_fields = {'order': ('shop.serializers.OrderSerializer', {})}
 
 # Serializer for ProductRating
-class ProductRatingSerializer(serializers.ModelSerializer):
+class ProductRatingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_rating_id = serializers.IntegerField(source='id', read_only=True)
     product_id = serializers.IntegerField(source='product.id', read_only=True)
     customer_id = serializers.IntegerField(source='customer.id', read_only=True)
@@ -112,6 +214,8 @@ class ProductRatingSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductRating
         fields = ['product_rating_id', 'product_id', 'customer_id', 'rating', 'rated_at', 'product_name']
+        expandable_fields = {'product': ('shop.serializers.ProductSerializer', {})}
+        field_sources = {'product_name': ('product__name',)}
 
     def get_product_name(self, obj):
         return obj.product.name
@@ -122,7 +226,7 @@ class ProductRatingSerializer(serializers.ModelSerializer):
         return value
 
 # Serializer for ProductRecommendation
-class ProductRecommendationSerializer(serializers.ModelSerializer):
+class ProductRecommendationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_recommendation_id = serializers.IntegerField(source='id', read_only=True)
     product_id = serializers.IntegerField(source='product.id', read_only=True)
     recommended_product_id = serializers.IntegerField(source='recommended_product.id', read_only=True)
@@ -131,6 +235,7 @@ class ProductRecommendationSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductRecommendation
         fields = ['product_recommendation_id', 'product_id', 'recommended_product_id', 'recommended_product_details']
+        field_sources = {'recommended_product_details': ('recommended_product__name',)}
 
     def get_recommended_product_details(self, obj):
         return ProductSerializer(obj.recommended_product).data
@@ -154,8 +259,45 @@ class StockUpdateSerializer(serializers.Serializer):
             raise ValidationError("Stock value cannot be negative.")
         return value
 
+# Serializer for Sales Report query parameters
+class SalesReportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    limit = serializers.IntegerField(required=False, default=10, min_value=1, max_value=100)
+    order_by = serializers.ChoiceField(choices=['revenue', 'units', 'orders'], required=False, default='revenue')
+
+    def validate(self, data):
+        data.setdefault('end', timezone.now().date())
+        data.setdefault('start', data['end'] - timedelta(days=29))
+        if data['start'] > data['end']:
+            raise ValidationError("start must not be after end.")
+        return data
+
+# Serializer for the low-stock index
+class LowStockProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    product_id = serializers.IntegerField(source='product.id', read_only=True)
+    product_name = serializers.CharField(source='product.name', read_only=True)
+
+    class Meta:
+        model = LowStockProduct
+        fields = ['product_id', 'product_name', 'level', 'stock', 'threshold', 'since']
+
+# Serializer for the compact related-product items (documentation only; served from shop.related)
+class RelatedProductSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    name = serializers.CharField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    thumbnail = serializers.CharField(allow_null=True)
+    in_stock = serializers.BooleanField()
+
+# Serializer for Outbox Event
+class OutboxEventSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = OutboxEvent
+        fields = ['id', 'topic', 'aggregate_type', 'aggregate_id', 'payload', 'created_at']
+
 # Serializer for Coupon
-class CouponSerializer(serializers.ModelSerializer):
+class CouponSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     coupon_id = serializers.IntegerField(source='id', read_only=True)
 
     class Meta:
@@ -169,18 +311,15 @@ class CheckoutSerializer(serializers.Serializer):
     coupon_code = serializers.CharField(required=False, allow_blank=True)
 
     def validate_coupon_code(self, value):
-        if value:
-            try:
-                coupon = Coupon.objects.get(code=value, active=True, valid_from__lte=timezone.now(), valid_to__gte=timezone.now())
-            except Coupon.DoesNotExist:
-                raise ValidationError("Invalid or expired coupon code.")
+        if value and coupon_index.get(value) is None:
+            raise ValidationError("Invalid or expired coupon code.")
         return value
 
     def create(self, validated_data):
         # Implement checkout logic here
         pass
 
-class RegisterSerializer(serializers.ModelSerializer):
+class RegisterSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     customer_id = serializers.IntegerField(source='id', read_only=True)
     password = serializers.CharField(write_only=True)
 
@@ -230,7 +369,7 @@ class LoginSerializer(serializers.Serializer):
         }
 
 # Serializer for Customer
-class CustomerSerializer(serializers.ModelSerializer):
+class CustomerSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     customer_id = serializers.IntegerField(source='id', read_only=True)
     addresses = AddressSerializer(many=True, read_only=True)
     payment_methods = PaymentMethodSerializer(many=True, read_only=True)
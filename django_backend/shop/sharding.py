@@ -0,0 +1,682 @@
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.migrations.operations.base import Operation
+from django.db.models import Max
+from django.db.models.query import ModelIterable, prefetch_related_objects
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from .routers import ReadReplicaRouter
+
+logger = logging.getLogger(__name__)
+
+# Customer-owned tables, parents before children (the order rows are copied in)
+SHARDED_MODELS = (
+    'shop.Address', 'shop.PaymentMethod', 'shop.CartItem', 'shop.ProductRating',
+    'shop.Order', 'shop.OrderItem', 'shop.Invoice', 'shop.Transaction',
+)
+
+# How each table reaches its owner, where it is not its own customer_id
+OWNER_LOOKUPS = {'shop.OrderItem': 'order__customer_id'}
+
+# Databases reserve_id_range can start the id sequences on
+ID_RANGE_VENDORS = ('sqlite', 'postgresql', 'mysql')
+
+# Request being served and explicit shard overrides, set by CustomerShardMiddleware
+_request_state = contextvars.ContextVar('shard_request', default=None)
+_bound = contextvars.ContextVar('shard_bound', default=None)
+
+
+def shard_aliases():
+    return [DEFAULT_DB_ALIAS] + list(settings.DATABASE_SHARDS)
+
+
+def is_sharded(model):
+    return bool(settings.DATABASE_SHARDS) and model._meta.label in SHARDED_MODELS
+
+
+def sharded_models():
+    return [apps.get_model(label) for label in SHARDED_MODELS]
+
+
+def owned_by(model, customer_id):
+    """
+    All of `customer_id`'s rows of a sharded model, on whichever database it is used with.
+    """
+    return model._base_manager.filter(**{OWNER_LOOKUPS.get(model._meta.label, 'customer_id'): customer_id})
+
+
+def shard_key(customer_id):
+    return f"customer-shard:{customer_id}"
+
+
+class CustomerMoving(APIException):
+    status_code = 503
+    default_detail = "This account is being moved to another database; retry in a minute."
+    default_code = 'customer_moving'
+
+
+def _shared_cache():
+    # A process-local cache would keep routing a moved customer to the old shard
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _map_entry(customer_id):
+    """
+    (alias, moving_from) of `customer_id`, memoized for the current request. Customers
+    without a shard map entry, i.e. those from before sharding, are on the default database.
+    """
+    state = _request_state.get()
+    memo = state['shards'] if state is not None else {}
+    entry = memo.get(customer_id)
+    if entry is None and _shared_cache():
+        entry = cache.get(shard_key(customer_id))
+    if entry is None:
+        # Always the primary: a lagging replica would place the customer on the wrong shard
+        row = apps.get_model('shop', 'CustomerShard').objects.using(DEFAULT_DB_ALIAS).filter(
+            customer_id=customer_id
+        ).values_list('alias', 'moving_from').first()
+        entry = tuple(row) if row else (DEFAULT_DB_ALIAS, '')
+        if _shared_cache():
+            cache.set(shard_key(customer_id), entry, settings.SHARD_MAP_TTL)
+    memo[customer_id] = entry
+    return entry
+
+
+def _forget(customer_id):
+    cache.delete(shard_key(customer_id))
+    state = _request_state.get()
+    if state is not None:
+        state['shards'].pop(customer_id, None)
+
+
+def shard_for(customer_id):
+    """
+    Alias of the shard holding `customer_id`'s rows. The map is cached in the shared cache
+    only (REDIS_URL); without one it is read once per request.
+    """
+    if not settings.DATABASE_SHARDS or customer_id is None:
+        return DEFAULT_DB_ALIAS
+    return _map_entry(customer_id)[0]
+
+
+def shards_for(customer_ids):
+    """
+    {customer_id: shard_for(customer_id)}, reading the map entries not known yet at once.
+    """
+    if not settings.DATABASE_SHARDS:
+        return {customer_id: DEFAULT_DB_ALIAS for customer_id in customer_ids}
+    state = _request_state.get()
+    memo = state['shards'] if state is not None else {}
+    missing = [customer_id for customer_id in customer_ids if customer_id not in memo]
+    if missing and _shared_cache():
+        cached = cache.get_many([shard_key(customer_id) for customer_id in missing])
+        memo.update((customer_id, cached[shard_key(customer_id)]) for customer_id in missing
+                    if shard_key(customer_id) in cached)
+        missing = [customer_id for customer_id in missing if customer_id not in memo]
+    if missing:
+        rows = apps.get_model('shop', 'CustomerShard').objects.using(DEFAULT_DB_ALIAS).filter(
+            customer_id__in=missing
+        ).values_list('customer_id', 'alias', 'moving_from')
+        found = {customer_id: (alias, moving_from) for customer_id, alias, moving_from in rows}
+        entries = {customer_id: found.get(customer_id, (DEFAULT_DB_ALIAS, '')) for customer_id in missing}
+        memo.update(entries)
+        if _shared_cache():
+            cache.set_many({shard_key(customer_id): entry for customer_id, entry in entries.items()},
+                           settings.SHARD_MAP_TTL)
+    return {customer_id: memo[customer_id][0] for customer_id in customer_ids}
+
+
+def check_writable(customer_id):
+    """
+    Raise CustomerMoving while `customer_id`'s rows are being moved (see move_customer).
+    """
+    if settings.DATABASE_SHARDS and customer_id is not None and _map_entry(customer_id)[1]:
+        raise CustomerMoving()
+
+
+def assign_shard(customer_id):
+    """
+    Place a new customer on one of SHARD_NEW_CUSTOMERS (every shard by default), by id.
+    """
+    targets = settings.SHARD_NEW_CUSTOMERS or shard_aliases()
+    alias = targets[customer_id % len(targets)]
+    apps.get_model('shop', 'CustomerShard').objects.using(DEFAULT_DB_ALIAS).create(
+        customer_id=customer_id, alias=alias
+    )
+    transaction.on_commit(lambda: _forget(customer_id))
+    return alias
+
+
+def instance_owner(instance):
+    """
+    Id of the customer owning a customer-owned row (read from its parent row if need be),
+    or of a customer. None for anything else.
+    """
+    if instance._meta.label == settings.AUTH_USER_MODEL:
+        return instance.pk
+    if not is_sharded(type(instance)):
+        return None
+    customer_id = getattr(instance, 'customer_id', None)
+    if customer_id is not None:
+        return customer_id
+    for field in instance._meta.concrete_fields:
+        if field.is_relation and is_sharded(field.related_model):
+            if field.is_cached(instance):
+                return instance_owner(field.get_cached_value(instance))
+            parent_id = getattr(instance, field.attname)
+            if parent_id is not None:
+                return field.related_model._base_manager.using(instance._state.db or current_shard()).filter(
+                    pk=parent_id
+                ).values_list('customer_id', flat=True).first()
+    return None
+
+
+def current_customer():
+    """
+    The authenticated customer the current request is served for, unless a shard is bound.
+    """
+    state = _request_state.get()
+    if _bound.get() or state is None:
+        return None
+    user = getattr(state['request'], 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def instance_shard(instance):
+    """
+    Shard of a customer-owned row (where it was loaded from, else its owner's), or of a
+    customer. None for anything else.
+    """
+    if instance._meta.label == settings.AUTH_USER_MODEL:
+        return shard_for(instance.pk)
+    if not is_sharded(type(instance)):
+        return None
+    if instance._state.db:
+        return instance._state.db
+    customer_id = getattr(instance, 'customer_id', None)
+    if customer_id is not None:
+        return shard_for(customer_id)
+    for field in instance._meta.concrete_fields:
+        if field.is_relation and is_sharded(field.related_model) and field.is_cached(instance):
+            return instance_shard(field.get_cached_value(instance))
+    return None
+
+
+def current_shard():
+    """
+    Shard for unqualified queries: the bound one, else that of the authenticated customer
+    the request is served for, else the default database.
+    """
+    alias = _bound.get()
+    if alias:
+        return alias
+    state = _request_state.get()
+    user = getattr(state['request'], 'user', None) if state is not None else None
+    if user is not None and user.is_authenticated:
+        return shard_for(user.pk)
+    return DEFAULT_DB_ALIAS
+
+
+def begin_request(request):
+    return _request_state.set({'request': request, 'shards': {}}), _bound.set(None)
+
+
+def end_request(tokens):
+    _request_state.reset(tokens[0])
+    _bound.reset(tokens[1])
+
+
+def route_request(alias):
+    """
+    Send the rest of the current request's customer-owned queries to `alias`.
+    """
+    _bound.set(alias)
+
+
+@contextmanager
+def bind_shard(alias):
+    token = _bound.set(alias)
+    try:
+        yield
+    finally:
+        _bound.reset(token)
+
+
+def bind_customer(customer_id):
+    return bind_shard(shard_for(customer_id))
+
+
+@contextmanager
+def atomic(alias=None):
+    """
+    transaction.atomic() on the default database and on the shard (`alias`, else the
+    current one) when that is another database. This is best effort, not atomic across
+    the two: the shard commits first, then the default database, so a failure in between
+    keeps the shard's changes only. Steps that must survive that (bulk jobs, archiving,
+    move_customer) are idempotent and finished by running them again. on_commit
+    callbacks wait for the default database.
+    """
+    alias = alias or current_shard()
+    with transaction.atomic():
+        if alias == DEFAULT_DB_ALIAS:
+            yield
+        else:
+            with transaction.atomic(using=alias):
+                yield
+
+
+def across_shards(queryset):
+    """
+    `queryset` once per shard for a customer-owned model, else just `queryset`.
+    """
+    if not is_sharded(queryset.model):
+        return [queryset]
+    return [queryset.using(alias) for alias in shard_aliases()]
+
+
+def _sort_value(row, name):
+    value = row[name] if isinstance(row, dict) else row
+    if not isinstance(row, dict):
+        for part in name.split('__'):
+            value = getattr(value, part, None)
+    return (value is None, value)
+
+
+def fan_out(queryset):
+    """
+    Evaluate `queryset` on every shard and merge the rows in its ordering (field names
+    only), for staff views and reports. Without shards this is list(queryset).
+    """
+    rows = [row for shard_queryset in across_shards(queryset) for row in shard_queryset]
+    query = queryset.query
+    ordering = query.order_by or (query.default_ordering and queryset.model._meta.ordering) or ()
+    for name in reversed([name for name in ordering if isinstance(name, str)]):
+        field = name.lstrip('-')
+        if field == 'pk':
+            field = queryset.model._meta.pk.attname
+        rows.sort(key=lambda row: _sort_value(row, field), reverse=name.startswith('-'))
+    return rows
+
+
+class FannedOutRows:
+    """
+    Lazy fan_out(queryset) for paginators: the count adds up the shard counts, and a
+    slice reads each shard's rows up to its end only (they hold every row of the slice).
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def count(self):
+        return sum(queryset.count() for queryset in across_shards(self.queryset))
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if index.stop is None or index.stop < 0 or (index.start or 0) < 0:
+            return fan_out(self.queryset)[index]
+        return fan_out(self.queryset[:index.stop])[index]
+
+    def __iter__(self):
+        return iter(fan_out(self.queryset))
+
+
+def locate(model, pk):
+    """
+    Alias of the shard holding row `pk` of `model`, or None. Ids are allocated in ranges per
+    shard (see reserve_id_range), so the shard the row was created on is asked first.
+    """
+    if not is_sharded(model):
+        return DEFAULT_DB_ALIAS
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    aliases = shard_aliases()
+    home = aliases[min(pk // settings.SHARD_ID_SPAN, len(aliases) - 1)]
+    for alias in [home] + [alias for alias in aliases if alias != home]:
+        if model._base_manager.using(alias).filter(pk=pk).exists():
+            return alias
+    return None
+
+
+def check_shard_vendors():
+    """
+    Refuse to start with a shard on a database whose id sequences reserve_id_range
+    cannot move: rows created there would collide with those of the other shards.
+    """
+    for alias in settings.DATABASE_SHARDS:
+        vendor = connections[alias].vendor
+        if vendor not in ID_RANGE_VENDORS:
+            raise ImproperlyConfigured(
+                f"Shard {alias} is on {vendor}; DATABASE_SHARD_URLS supports {', '.join(ID_RANGE_VENDORS)} only."
+            )
+
+
+def reserve_id_range(alias):
+    """
+    Start the id sequences of the customer-owned tables on `alias` at its position *
+    SHARD_ID_SPAN, so ids stay unique across shards and rows keep them when moved.
+    """
+    index = shard_aliases().index(alias)
+    if not index:
+        return
+    start = index * settings.SHARD_ID_SPAN
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in sharded_models():
+            table = model._meta.db_table
+            if (model._base_manager.using(alias).aggregate(top=Max('pk'))['top'] or 0) >= start:
+                continue
+            if connection.vendor == 'sqlite':
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [start - 1, table])
+                if not cursor.rowcount:
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, start - 1])
+            elif connection.vendor == 'postgresql':
+                cursor.execute("SELECT setval(pg_get_serial_sequence(%s, %s), %s, false)",
+                               [table, model._meta.pk.column, start])
+            else:  # mysql; other vendors are refused at startup (check_shard_vendors)
+                cursor.execute(f"ALTER TABLE {connection.ops.quote_name(table)} AUTO_INCREMENT = {start}")
+
+
+def _crosses_databases(alias, model, field):
+    """
+    Whether the foreign key `field` of `model` may point to another database once
+    sharding is on: customer-owned rows on a shard refer to customers and products on the
+    default database, and rows on the default database may refer to customer-owned rows
+    on a shard (the archive's payment methods).
+    """
+    sharded_model = model._meta.label in SHARDED_MODELS
+    sharded_target = field.related_model._meta.label in SHARDED_MODELS
+    if alias == DEFAULT_DB_ALIAS:
+        return sharded_target and not sharded_model
+    return sharded_model and not sharded_target
+
+
+class DropCrossShardConstraints(Operation):
+    """
+    Migration step that drops the database constraints of the foreign keys that cross
+    databases (see _crosses_databases), on the shards and the default database only while
+    sharding is on. Unsharded databases keep every constraint, and the migration state
+    is left alone. Later migrations may bring constraints back (SQLite rebuilds tables
+    from the state), so it also runs after every migrate (drop_cross_shard_constraints).
+    """
+    reversible = True
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self._alter(app_label, schema_editor, from_state, forwards=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self._alter(app_label, schema_editor, to_state, forwards=False)
+
+    def describe(self):
+        return "Drop the constraints of foreign keys that cross shards"
+
+    def _alter(self, app_label, schema_editor, state, forwards):
+        alias = schema_editor.connection.alias
+        if not settings.DATABASE_SHARDS or alias not in shard_aliases():
+            return
+        connection = schema_editor.connection
+        fields = []
+        with connection.cursor() as cursor:
+            for model in state.apps.get_app_config(app_label).get_models():
+                crossing = [field for field in model._meta.local_fields
+                            if field.remote_field and _crosses_databases(alias, model, field)]
+                if not crossing:
+                    continue
+                constrained = {
+                    column
+                    for constraint in connection.introspection.get_constraints(cursor, model._meta.db_table).values()
+                    if constraint['foreign_key'] for column in constraint['columns']
+                }
+                # Only what is left to do, so running it again is cheap
+                fields += [(model._meta.model_name, field.name) for field in crossing
+                           if (field.column in constrained) == forwards]
+        unconstrained = state.clone()
+        for model_name, name in fields:
+            field = unconstrained.models[app_label, model_name].fields[name].clone()
+            field.db_constraint = False
+            unconstrained.models[app_label, model_name].fields[name] = field
+            unconstrained.reload_model(app_label, model_name, delay=True)
+        # Each alteration is made from a model without any of the constraints, so SQLite's
+        # table rebuilds do not bring back those dropped before
+        for model_name, name in fields:
+            constrained_field = state.apps.get_model(app_label, model_name)._meta.get_field(name)
+            model = unconstrained.apps.get_model(app_label, model_name)
+            free_field = model._meta.get_field(name)
+            if forwards:
+                schema_editor.alter_field(model, constrained_field, free_field)
+            else:
+                schema_editor.alter_field(state.apps.get_model(app_label, model_name), free_field, constrained_field)
+
+
+def drop_cross_shard_constraints(using, **kwargs):
+    """
+    post_migrate receiver: run DropCrossShardConstraints on the migrated database, which
+    also covers a default database migrated before sharding was turned on.
+    """
+    if not settings.DATABASE_SHARDS or using not in shard_aliases():
+        return
+    from django.db.migrations.loader import MigrationLoader
+
+    state = MigrationLoader(connections[using]).project_state()
+    with connections[using].schema_editor() as schema_editor:
+        DropCrossShardConstraints().database_forwards('shop', schema_editor, state, state)
+
+
+def _set_map_entry(customer_id, alias, moving_from=''):
+    apps.get_model('shop', 'CustomerShard').objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        customer_id=customer_id, defaults={'alias': alias, 'moving_from': moving_from}
+    )
+    _forget(customer_id)
+
+
+def _copy_rows(customer_id, source, target):
+    """
+    Copy `customer_id`'s rows on `source` that `target` does not have yet, keeping their
+    ids. Returns {model label: rows copied}.
+    """
+    copied = {}
+    with transaction.atomic(using=target):
+        for model in sharded_models():
+            rows = list(owned_by(model, customer_id).using(source).order_by('pk'))
+            present = set(owned_by(model, customer_id).using(target).values_list('pk', flat=True))
+            rows = [row for row in rows if row.pk not in present]
+            model._base_manager.using(target).bulk_create(rows, batch_size=500)
+            copied[model._meta.label] = len(rows)
+    return copied
+
+
+def move_customer(customer_id, target, grace=None):
+    """
+    Move all of `customer_id`'s rows to shard `target`, keeping their ids. Returns
+    {model label: rows moved}.
+
+    The customer is marked as moving first, which makes their writes fail with
+    CustomerMoving (503). After `grace` seconds (SHARD_MOVE_GRACE_SECONDS, longer than any
+    request or task), nothing still works from the old map entry. The rows are copied
+    and the map is switched. After another grace period, every reader uses the new
+    shard. Only then are the old rows removed, along with any late rows copied first.
+    An interrupted move is resumed by running it again.
+    """
+    grace = settings.SHARD_MOVE_GRACE_SECONDS if grace is None else grace
+    alias, moving_from = _map_entry(customer_id)
+    source = moving_from or alias
+    if moving_from and alias not in (source, target):
+        raise RuntimeError(f"Customer {customer_id} is being moved to {alias}; finish that move first.")
+    if source == target:
+        return {}
+
+    if alias != target:
+        _set_map_entry(customer_id, source, moving_from=source)
+        time.sleep(grace)
+        # Leftovers of an interrupted move; the source is authoritative until the switch
+        with transaction.atomic(using=target):
+            for model in reversed(sharded_models()):
+                owned_by(model, customer_id).using(target)._raw_delete(target)
+        moved = _copy_rows(customer_id, source, target)
+        _set_map_entry(customer_id, target, moving_from=source)
+        time.sleep(grace)
+    else:
+        moved = dict.fromkeys(SHARDED_MODELS, 0)
+
+    # Rows written through an explicit database despite the block
+    for label, count in _copy_rows(customer_id, source, target).items():
+        moved[label] += count
+    with transaction.atomic(using=source):
+        for model in reversed(sharded_models()):
+            owned_by(model, customer_id).using(source)._raw_delete(source)
+    _set_map_entry(customer_id, target)
+    logger.info(f"Moved customer {customer_id} from {source} to {target}: {moved}")
+    return moved
+
+
+def _paths(tree):
+    for name, subtree in tree.items():
+        yield name
+        for path in _paths(subtree):
+            yield f"{name}__{path}"
+
+
+def _split_joins(model, tree, prefix=''):
+    keep, prefetch = {}, []
+    for name, subtree in tree.items():
+        related = model._meta.get_field(name).related_model
+        if is_sharded(related):
+            keep[name], more = _split_joins(related, subtree, f"{prefix}{name}__")
+            prefetch += more
+        else:
+            prefetch.append(f"{prefix}{name}")
+            prefetch += [f"{prefix}{name}__{path}" for path in _paths(subtree)]
+    return keep, prefetch
+
+
+class CustomerOwnedQuerySet(models.QuerySet):
+    """
+    QuerySet of a customer-owned table. Customers and products are not on the other
+    shards, so when the query runs on one, select_related() across to them becomes a
+    prefetch from the default database.
+    """
+
+    def _prefetch_across_shards(self):
+        if (self.query.select_related and self.query.select_related is not True
+                and self._iterable_class is ModelIterable and self.db != DEFAULT_DB_ALIAS):
+            keep, prefetch = _split_joins(self.model, self.query.select_related)
+            self.query.select_related = keep or False
+            self._prefetch_related_lookups += tuple(prefetch)
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._prefetch_across_shards()
+        super()._fetch_all()
+
+    def iterator(self, chunk_size=None):
+        self._prefetch_across_shards()
+        return super().iterator(chunk_size)
+
+    def create(self, **kwargs):
+        # QuerySet.create() routes without the new row as a hint; place it with its owner
+        if self._db is None and is_sharded(self.model):
+            alias = instance_shard(self.model(**kwargs))
+            if alias:
+                return self.using(alias).create(**kwargs)
+        return super().create(**kwargs)
+
+
+class CustomerQuerySet(models.QuerySet):
+    """
+    QuerySet of customers. Their rows are on their own shards, and a prefetch reads the
+    shard of the first instance, so prefetches run once per shard for its customers.
+    """
+
+    def _prefetch_related_objects(self):
+        if not settings.DATABASE_SHARDS:
+            return super()._prefetch_related_objects()
+        groups = {}
+        shards = shards_for([customer.pk for customer in self._result_cache])
+        for customer in self._result_cache:
+            groups.setdefault(shards[customer.pk], []).append(customer)
+        for customers in groups.values():
+            prefetch_related_objects(customers, *self._prefetch_related_lookups)
+        self._prefetch_done = True
+
+
+class CustomerShardRouter:
+    """
+    Sends customer-owned tables to their owner's shard: the shard of the row or customer
+    involved, else the current one (see current_shard). Other tables stay on the default
+    database, or a replica, also when reached from a row on another shard.
+    """
+
+    def __init__(self):
+        self.replicas = ReadReplicaRouter() if settings.DATABASE_REPLICAS else None
+
+    def db_for_read(self, model, **hints):
+        if is_sharded(model):
+            return self._shard(hints.get('instance'))
+        if self._from_shard(hints.get('instance')):
+            return (self.replicas and self.replicas.db_for_read(model)) or DEFAULT_DB_ALIAS
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_sharded(model):
+            instance = hints.get('instance')
+            check_writable(instance_owner(instance) if instance is not None else current_customer())
+            return self._shard(instance)
+        if self._from_shard(hints.get('instance')):
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None  # Every shard has the full schema
+
+    def _shard(self, instance):
+        return (instance_shard(instance) if instance is not None else None) or current_shard()
+
+    def _from_shard(self, instance):
+        # Left alone, Django would use the database the instance came from
+        return instance is not None and instance._state.db in settings.DATABASE_SHARDS
+
+
+class ShardFanOutMixin:
+    """
+    View mixin for viewsets where staff see every customer's rows: staff list requests
+    read all shards and merge the results, and staff detail requests (and their actions)
+    go to the shard holding the object.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if settings.DATABASE_SHARDS and request.user.is_staff and lookup is not None:
+            alias = locate(self.queryset.model, lookup)
+            if alias:
+                route_request(alias)
+
+    def list(self, request, *args, **kwargs):
+        if not (settings.DATABASE_SHARDS and request.user.is_staff):
+            return super().list(request, *args, **kwargs)
+        rows = FannedOutRows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(list(rows), many=True).data)
@@ -0,0 +1,179 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.dispatch import receiver
+
+from .conditional import bump_version
+from .analytics import mark_status_changes
+from .batch import forget
+from .carts import bump_cart_version, bump_prices_version
+from .coupons import coupon_index
+from .images import discard_variants, schedule_product_image
+from .invoices import render_invoice
+from .outbox import order_payload, record_event
+from .pubsub import publish_order_status
+from .related import invalidate_referencing, invalidate_related
+from .sharding import assign_shard, owned_by, shard_for, sharded_models
+from .stock import evaluate_products
+from .models import (
+    Product, Category, Coupon, Order, OrderItem, Invoice, Transaction, ProductRecommendation, Customer, CartItem
+)
+
+
+# Place new customers on a shard; their rows elsewhere go with them when they are deleted
+@receiver(post_save, sender=Customer)
+def assign_customer_shard(sender, instance, created, **kwargs):
+    if created and settings.DATABASE_SHARDS:
+        assign_shard(instance.pk)
+
+
+@receiver(pre_delete, sender=Customer)
+def delete_sharded_rows(sender, instance, **kwargs):
+    alias = shard_for(instance.pk)
+    if alias != DEFAULT_DB_ALIAS:
+        for model in reversed(sharded_models()):
+            owned_by(model, instance.pk).using(alias).delete()
+
+
+# A product's cascade only runs on the default database; cart lines, order items and
+# ratings on the shards go explicitly
+@receiver(pre_delete, sender=Product)
+def delete_product_rows_on_shards(sender, instance, **kwargs):
+    for alias in settings.DATABASE_SHARDS:
+        for model in sharded_models():
+            for field in model._meta.concrete_fields:
+                if field.is_relation and field.related_model is Product:
+                    model._base_manager.using(alias).filter(**{field.name: instance.pk}).delete()
+
+
+# Bump the per-table change counters used for ETag / Last-Modified validators
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Coupon)
+@receiver([post_save, post_delete], sender=Order)
+@receiver([post_save, post_delete], sender=OrderItem)
+def bump_table_version(sender, **kwargs):
+    bump_version(sender._meta.db_table)
+
+
+# Drop the cached batch representations of changed products and orders
+@receiver([post_save, post_delete], sender=Product)
+def forget_batch_product(sender, instance, **kwargs):
+    forget('product', [instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Order)
+def forget_batch_order(sender, instance, **kwargs):
+    forget('order', [instance.pk])
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def forget_batch_order_of_item(sender, instance, **kwargs):
+    forget('order', [instance.order_id])
+
+
+# Invalidate memoized cart summaries when a cart line or a product price changes
+@receiver([post_save, post_delete], sender=CartItem)
+def bump_cart_summary_version(sender, instance, **kwargs):
+    bump_cart_version(instance.customer_id)
+
+
+@receiver(post_save, sender=Product)
+def bump_price_version(sender, instance, created, **kwargs):
+    if created or instance.price != getattr(instance, 'loaded_price', None):
+        bump_prices_version()
+        instance.loaded_price = instance.price
+
+
+# Stock or reorder point changed outside shop.stock (admin edits)
+@receiver(post_save, sender=Product)
+def evaluate_product_stock(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'stock', 'reorder_point'} & set(update_fields):
+        evaluate_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def evaluate_category_stock(sender, instance, created, **kwargs):
+    if not created:
+        evaluate_products(instance.products.filter(reorder_point__isnull=True).values_list('id', flat=True))
+
+
+# Keep the cached related-product blobs in step with recommendations and the products they show
+@receiver([post_save, post_delete], sender=ProductRecommendation)
+def invalidate_recommendation_blob(sender, instance, **kwargs):
+    invalidate_related([instance.product_id])
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_referencing_blobs(sender, instance, **kwargs):
+    invalidate_referencing([instance.pk])
+
+
+# Sales rollups recompute the day of an order whose status changed (before the outbox
+# receiver below resets loaded_status)
+@receiver(post_save, sender=Order)
+def mark_sales_day(sender, instance, created, **kwargs):
+    if not created:
+        mark_status_changes([(instance.created_at, getattr(instance, 'loaded_status', None), instance.status)])
+
+
+# Outbox events, written in the transaction of the change itself
+@receiver(post_save, sender=Order)
+def record_order_event(sender, instance, created, **kwargs):
+    previous = getattr(instance, 'loaded_status', None)
+    if created:
+        record_event('order.created', 'order', instance.pk, order_payload(instance))
+    elif instance.status != previous:
+        record_event('order.status_changed', 'order', instance.pk, order_payload(instance, previous))
+    instance.loaded_status = instance.status
+
+
+# Push status and tracking changes to open order streams
+@receiver(post_save, sender=Order)
+def publish_order_update(sender, instance, created, **kwargs):
+    if not created:
+        publish_order_status(instance)
+
+
+@receiver(post_save, sender=Transaction)
+def record_transaction_event(sender, instance, created, **kwargs):
+    if created:
+        record_event('transaction.created', 'order', instance.order_id, {
+            'transaction_id': str(instance.transaction_id),
+            'order_id': instance.order_id,
+            'customer_id': instance.customer_id,
+            'amount': str(instance.amount),
+            'stripe_payment_intent_id': instance.stripe_payment_intent_id,
+        })
+
+
+# Drop the in-process coupon index so the next lookup reloads it
+@receiver([post_save, post_delete], sender=Coupon)
+def invalidate_coupon_index(sender, **kwargs):
+    transaction.on_commit(coupon_index.invalidate)
+
+
+# Generate thumbnail variants in the background when a product image is added, replaced
+# or removed; the old variants are discarded on the way
+@receiver(post_save, sender=Product)
+def schedule_image_variants(sender, instance, **kwargs):
+    if (instance.image.name or None) != instance.image_variants.get('source'):
+        schedule_product_image(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def discard_image_variants(sender, instance, **kwargs):
+    if instance.image_variants:
+        discard_variants.delay(instance.image_variants)
+
+
+# Re-render invoice documents in the background when their content changes
+@receiver(post_save, sender=Invoice)
+def schedule_invoice_render(sender, instance, **kwargs):
+    render_invoice.delay(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=OrderItem)
+def schedule_order_invoice_render(sender, instance, **kwargs):
+    for invoice_id in Invoice.objects.filter(order_id=instance.order_id).values_list('id', flat=True):
+        render_invoice.delay(invoice_id)
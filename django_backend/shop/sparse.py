@@ -0,0 +1,164 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_paths(value):
+    """
+    'order_id,order_items.product_id' -> {'order_id': {}, 'order_items': {'product_id': {}}}.
+    An empty subtree means the whole field.
+    """
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for part in (part.strip() for part in path.split('.')):
+            if part:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def project(data, tree):
+    """
+    Apply a parse_paths() tree to already rendered data, e.g. a cached representation.
+    """
+    if not tree:
+        return data
+    if isinstance(data, list):
+        return [project(item, tree) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {name: project(value, tree[name]) for name, value in data.items() if name in tree}
+
+
+class SparseFieldsMixin:
+    """
+    ModelSerializer mixin for `?fields=` and `?expand=` on safe requests.
+
+    `fields` keeps only the listed fields; dotted paths reach into nested serializers.
+    `expand` replaces a related id with the object, for the fields listed in
+    Meta.expandable_fields as {name: (serializer path, kwargs)}. Method fields (and
+    extra keys added in to_representation) name the model fields they read in
+    Meta.field_sources, so views can defer the rest.
+    """
+
+    def sparse_params(self):
+        if hasattr(self, '_sparse'):
+            return self._sparse
+        # Only the outermost serializer reads the query string; nested ones get a subtree
+        root = self.root
+        is_root = root is self or (isinstance(root, serializers.ListSerializer) and self.parent is root)
+        request = self.context.get('request')
+        if not is_root or request is None or request.method not in SAFE_METHODS:
+            return {}, {}
+        params = getattr(request, 'query_params', request.GET)
+        return parse_paths(params.get('fields')), parse_paths(params.get('expand'))
+
+    def wants(self, name):
+        selected = self.sparse_params()[0]
+        return not selected or name in selected
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected, expand = self.sparse_params()
+        for name, (path, kwargs) in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name in expand:
+                fields[name] = import_string(path)(read_only=True, **kwargs)
+        if selected:
+            fields = {name: field for name, field in fields.items() if name in selected}
+        for name, field in fields.items():
+            target = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(target, SparseFieldsMixin):
+                target._sparse = (selected.get(name, {}), expand.get(name, {}))
+        return fields
+
+
+def plan(serializer, model):
+    """
+    Work out what rendering `serializer` over `model` reads: (columns, joins, prefetches).
+    `columns` is None when a field's needs are unknown (undeclared method fields,
+    properties), in which case nothing may be deferred.
+    """
+    columns, select, prefetch = set(), set(), set()
+    unknown = False
+    sources = getattr(getattr(serializer, 'Meta', None), 'field_sources', {})
+    extras = [name for name in sources if name not in serializer.fields and serializer.wants(name)]
+
+    for name in extras + list(serializer.fields):
+        if name in sources:
+            for path in sources[name]:
+                head, _, rest = path.partition('__')
+                columns.add(head)
+                if rest:
+                    select.add(head)
+            continue
+        field = serializer.fields[name]
+        many = isinstance(field, serializers.ListSerializer)
+        target = field.child if many else field
+        if field.source == '*' or isinstance(field, serializers.SerializerMethodField):
+            unknown = True
+            continue
+        head, _, rest = field.source.partition('.')
+        try:
+            model_field = model._meta.get_field(head)
+        except FieldDoesNotExist:
+            unknown = True
+            continue
+
+        if model_field.one_to_many or model_field.many_to_many:
+            prefetch.add(head)
+            if isinstance(target, serializers.ModelSerializer):
+                _, child_select, child_prefetch = plan(target, model_field.related_model)
+                # Prefetched children already point back at their parent
+                back = model_field.field.name if model_field.one_to_many else None
+                prefetch |= {f"{head}__{path}" for path in child_select | child_prefetch if path != back}
+        elif isinstance(target, serializers.ModelSerializer) and model_field.is_relation:
+            columns.add(model_field.name)
+            select.add(model_field.name)
+            _, child_select, child_prefetch = plan(target, model_field.related_model)
+            select |= {f"{model_field.name}__{path}" for path in child_select}
+            prefetch |= {f"{model_field.name}__{path}" for path in child_prefetch}
+        else:
+            columns.add(model_field.name)  # 'order' for both 'order' and 'order_id'
+            if rest and model_field.is_relation:
+                select.add(model_field.name)
+    return (None if unknown else columns), select, prefetch
+
+
+def sparse_queryset(queryset, serializer):
+    """
+    Adapt `queryset` to what `serializer` renders: join the forward relations it follows,
+    prefetch only the nested lists it includes and, when the client asked for specific
+    fields, defer the columns none of them read.
+    """
+    columns, select, prefetch = plan(serializer, queryset.model)
+    if select:
+        queryset = queryset.select_related(*sorted(select))
+    if prefetch:
+        queryset = queryset.prefetch_related(*sorted(prefetch))
+    joined = queryset.query.select_related
+    if serializer.sparse_params()[0] and columns is not None and joined is not True:
+        keep = columns | set(joined or {})
+        deferred = [
+            field.name for field in queryset.model._meta.concrete_fields
+            if not field.primary_key and field.name not in keep
+        ]
+        if deferred:
+            queryset = queryset.defer(*deferred)
+    return queryset
+
+
+class SparseQuerysetMixin:
+    """
+    View mixin: on safe requests, read only what the (sparse, expanded) serializer renders.
+    Hooks filter_queryset (used by list and get_object) so views keep their own get_queryset.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if getattr(self, 'swagger_fake_view', False) or self.request.method not in SAFE_METHODS:
+            return queryset
+        serializer = self.get_serializer()
+        if not isinstance(serializer, SparseFieldsMixin):
+            return queryset
+        return sparse_queryset(queryset, serializer)
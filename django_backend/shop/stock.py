@@ -0,0 +1,209 @@
+import logging
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+
+from .batch import forget
+from .conditional import bump_version
+from .models import LowStockProduct, OutboxEvent, Product, StockAlert
+from .related import invalidate_referencing
+from .tasks import task
+
+logger = logging.getLogger(__name__)
+
+LEVEL_LOW = 'LOW'
+LEVEL_OUT = 'OUT'
+
+LEVEL_FIELDS = ('id', 'name', 'stock', 'reorder_point', 'category__reorder_point')
+
+
+def stock_level(stock, threshold):
+    if stock == 0:
+        return LEVEL_OUT
+    if stock <= threshold:
+        return LEVEL_LOW
+    return None
+
+
+def _threshold(row):
+    for value in (row['reorder_point'], row['category__reorder_point']):
+        if value is not None:
+            return value
+    return settings.LOW_STOCK_THRESHOLD
+
+
+def adjust_stock(changes):
+    """
+    Apply signed stock changes {product_id: delta} in one UPDATE.
+
+    The products are locked in id order and every decrement is checked first, so either
+    all changes apply or a ValidationError is raised. Thresholds are then evaluated for
+    the touched products only.
+    """
+    changes = {product_id: delta for product_id, delta in changes.items() if delta}
+    if not changes:
+        return {}
+    with transaction.atomic():
+        rows = {
+            row['id']: row
+            for row in Product.objects.select_for_update(of=('self',)).filter(id__in=changes)
+            .order_by('id').values(*LEVEL_FIELDS)
+        }
+        missing = sorted(set(changes) - set(rows))
+        if missing:
+            raise ValidationError([f"Product {product_id} does not exist." for product_id in missing])
+        short = [product_id for product_id, delta in changes.items() if rows[product_id]['stock'] + delta < 0]
+        if short:
+            raise ValidationError([f"Not enough stock available for {rows[product_id]['name']}." for product_id in short])
+
+        Product.objects.filter(id__in=changes).update(stock=F('stock') + Case(
+            *[When(id=product_id, then=Value(delta)) for product_id, delta in changes.items()],
+            output_field=IntegerField(),
+        ))
+        bump_version(Product._meta.db_table)
+        forget('product', changes)
+        # Related-product blobs only carry an in-stock flag
+        invalidate_referencing(
+            product_id for product_id, delta in changes.items()
+            if (rows[product_id]['stock'] > 0) != (rows[product_id]['stock'] + delta > 0)
+        )
+        for product_id, delta in changes.items():
+            rows[product_id]['stock'] += delta
+        update_stock_levels(rows.values())
+    return {product_id: row['stock'] for product_id, row in rows.items()}
+
+
+def set_stock(product_id, stock):
+    """
+    Set an absolute stock level, e.g. after a stock count.
+    """
+    with transaction.atomic():
+        current = Product.objects.select_for_update().filter(pk=product_id).values_list('stock', flat=True).first()
+        if current is None:
+            raise ValidationError([f"Product {product_id} does not exist."])
+        return adjust_stock({product_id: stock - current}).get(product_id, current)
+
+
+def evaluate_products(product_ids):
+    """
+    Re-evaluate thresholds from the stored stock, for changes made outside adjust_stock
+    (admin edits, changed reorder points).
+    """
+    with transaction.atomic():
+        update_stock_levels(Product.objects.filter(id__in=list(product_ids)).values(*LEVEL_FIELDS))
+
+
+def update_stock_levels(rows):
+    """
+    Bring the low-stock index in line with `rows` (dicts of LEVEL_FIELDS holding the new
+    stock) and emit an event for every product that became low or ran out. Products
+    that stay at the same level, or recover, emit nothing.
+    """
+    rows = {row['id']: row for row in rows}
+    if not rows:
+        return []
+    index = {
+        entry.product_id: entry
+        for entry in LowStockProduct.objects.select_for_update().filter(product_id__in=rows)
+    }
+    now = timezone.now()
+    recovered, changed, created, events = [], [], [], []
+    for product_id, row in rows.items():
+        threshold = _threshold(row)
+        level = stock_level(row['stock'], threshold)
+        entry = index.get(product_id)
+        if level is None:
+            if entry is not None:
+                recovered.append(product_id)
+            continue
+        if entry is None:
+            entry = LowStockProduct(product_id=product_id, level=level, stock=row['stock'],
+                                    threshold=threshold, since=now)
+            created.append(entry)
+        else:
+            previous = entry.level
+            entry.level, entry.stock, entry.threshold = level, row['stock'], threshold
+            changed.append(entry)
+            if previous == level:
+                continue
+            entry.since = now
+        events.append({
+            'product_id': product_id,
+            'product_name': row['name'],
+            'level': level,
+            'stock': row['stock'],
+            'threshold': threshold,
+            'created_at': now.isoformat(),
+        })
+
+    if recovered:
+        LowStockProduct.objects.filter(product_id__in=recovered).delete()
+    if changed:
+        LowStockProduct.objects.bulk_update(changed, ['level', 'stock', 'threshold', 'since'])
+    if created:
+        LowStockProduct.objects.bulk_create(created)
+    if events:
+        emit_stock_events(events)
+    return events
+
+
+class DatabaseSink:
+    """
+    Record events as StockAlert rows in the same transaction as the stock change.
+    """
+
+    def emit(self, events):
+        StockAlert.objects.bulk_create([
+            StockAlert(product_id=event['product_id'], level=event['level'], stock=event['stock'],
+                       threshold=event['threshold'])
+            for event in events
+        ])
+
+
+class WebhookSink:
+    """
+    POST events as JSON to STOCK_ALERT_WEBHOOK_URL from the task workers once the stock
+    change commits. Does nothing when no URL is configured.
+    """
+
+    def emit(self, events):
+        if settings.STOCK_ALERT_WEBHOOK_URL:
+            deliver_stock_alerts.delay(events)
+
+
+class OutboxSink:
+    """
+    Write `stock.low` / `stock.out` outbox events in the same transaction as the change.
+    """
+
+    def emit(self, events):
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(topic=f"stock.{event['level'].lower()}", aggregate_type='product',
+                        aggregate_id=str(event['product_id']), payload=event)
+            for event in events
+        ])
+
+
+class LoggingSink:
+    def emit(self, events):
+        for event in events:
+            logger.warning(f"Stock {event['level']} for product {event['product_id']}: "
+                           f"{event['stock']} left (reorder point {event['threshold']}).")
+
+
+def emit_stock_events(events):
+    """
+    Hand events to every sink listed in STOCK_ALERT_SINKS.
+    """
+    for path in settings.STOCK_ALERT_SINKS:
+        import_string(path)().emit(events)
+
+
+@task(max_attempts=5)
+def deliver_stock_alerts(events):
+    response = requests.post(settings.STOCK_ALERT_WEBHOOK_URL, json={'events': events}, timeout=10)
+    response.raise_for_status()
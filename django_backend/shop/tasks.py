@@ -0,0 +1,198 @@
+import contextvars
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Order, Task
+from .sharding import locate
+
+logger = logging.getLogger(__name__)
+
+# Task being executed by this worker, for heartbeat()
+_running = contextvars.ContextVar('running_task', default=None)
+
+
+def task(max_attempts=3, retry_delay=30):
+    """
+    Register a function as a background task. The task is addressed by its dotted path,
+    so workers only need to be able to import it.
+
+        @task(max_attempts=5)
+        def send_receipt(order_id): ...
+
+        send_receipt.delay(order.id)  # enqueued when the current transaction commits
+    """
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @wraps(func)
+        def delay(*args, run_at=None, **kwargs):
+            return enqueue(name, *args, run_at=run_at, **kwargs)
+
+        func.task_name = name
+        func.max_attempts = max_attempts
+        func.retry_delay = retry_delay
+        func.delay = delay
+        return func
+
+    return decorator
+
+
+def enqueue(name, *args, run_at=None, **kwargs):
+    """
+    Queue task `name` once the current transaction commits, so workers never pick up
+    work referring to rows that were rolled back. Arguments must be JSON serializable.
+    With TASK_QUEUE_EAGER the task runs in-process at commit instead.
+    """
+    def _push():
+        if settings.TASK_QUEUE_EAGER:
+            import_string(name)(*args, **kwargs)
+            return
+        func = import_string(name)
+        Task.objects.create(
+            name=name,
+            args=list(args),
+            kwargs=kwargs,
+            max_attempts=getattr(func, 'max_attempts', 3),
+            run_at=run_at or timezone.now(),
+        )
+
+    transaction.on_commit(_push)
+
+
+def claim_tasks(worker_id, limit):
+    """
+    Claim up to `limit` due tasks. Each claim is a conditional UPDATE on the task's
+    current status, so concurrent workers never run the same task twice and no row lock
+    is held while the task runs. Tasks whose worker died are reclaimed after
+    TASK_QUEUE_LOCK_TIMEOUT seconds; the lost run counts as a failed attempt, so a task
+    that keeps crashing its worker is marked FAILED once it reaches max_attempts.
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.TASK_QUEUE_LOCK_TIMEOUT)
+    due = Q(status='QUEUED', run_at__lte=now) | Q(status='RUNNING', locked_at__lt=expired)
+    candidates = Task.objects.filter(due).order_by('run_at', 'id').values_list(
+        'id', 'name', 'status', 'locked_by', 'locked_at', 'attempts', 'max_attempts'
+    )[:limit]
+
+    claimed = []
+    for task_id, name, task_status, locked_by, locked_at, attempts, max_attempts in candidates:
+        current = Task.objects.filter(id=task_id, status=task_status, locked_at=locked_at)
+        if task_status == 'QUEUED':
+            if current.update(status='RUNNING', locked_by=worker_id, locked_at=now):
+                claimed.append(task_id)
+            continue
+        attempts += 1
+        error = f"Worker {locked_by} stopped responding while running the task."
+        if attempts >= max_attempts:
+            if current.update(status='FAILED', attempts=attempts, last_error=error, locked_by=None, locked_at=None):
+                logger.error(f"Task {task_id} {name} failed permanently: {error}")
+        elif current.update(status='RUNNING', attempts=attempts, last_error=error, locked_by=worker_id, locked_at=now):
+            logger.warning(f"Task {task_id} {name} reclaimed from {locked_by} (attempt {attempts}).")
+            claimed.append(task_id)
+    return list(Task.objects.filter(id__in=claimed).order_by('run_at', 'id'))
+
+
+def renew_claim(task_obj):
+    """
+    Restart the lock timeout of a task this worker claimed, just before running it, so
+    tasks late in a batch are not reclaimed while they wait. False if the claim was lost.
+    """
+    now = timezone.now()
+    if not Task.objects.filter(id=task_obj.id, status='RUNNING', locked_by=task_obj.locked_by).update(locked_at=now):
+        return False
+    task_obj.locked_at = now
+    return True
+
+
+def heartbeat():
+    """
+    Called by long tasks between steps: restart the lock timeout of the task being run,
+    so it is not reclaimed while still running. False once another worker has reclaimed
+    it, in which case the task should stop. Always True outside a worker (eager mode).
+    """
+    task_obj = _running.get()
+    return task_obj is None or renew_claim(task_obj)
+
+
+def execute_task(task_obj):
+    """
+    Run a claimed task. Successful tasks are deleted to keep the queue table small;
+    failures are retried with exponential backoff until max_attempts is reached. Once the
+    task has been reclaimed by another worker, its outcome is left to that worker.
+    """
+    if not renew_claim(task_obj):
+        logger.warning(f"Task {task_obj.id} {task_obj.name} was reclaimed by another worker; skipped.")
+        return False
+    # Only while the claim is still ours: a reclaimed task belongs to its new worker
+    claim = Task.objects.filter(id=task_obj.id, status='RUNNING', locked_by=task_obj.locked_by)
+    attempts = task_obj.attempts + 1
+    func = None
+    token = _running.set(task_obj)
+    try:
+        func = import_string(task_obj.name)
+        func(*task_obj.args, **task_obj.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if attempts >= task_obj.max_attempts:
+            logger.error(f"Task {task_obj.id} {task_obj.name} failed permanently: {error}")
+            claim.update(status='FAILED', attempts=attempts, last_error=error)
+        else:
+            delay = getattr(func, 'retry_delay', 30) * 2 ** (attempts - 1)
+            logger.warning(f"Task {task_obj.id} {task_obj.name} failed (attempt {attempts}), retrying in {delay}s.")
+            claim.update(
+                status='QUEUED', attempts=attempts, last_error=error,
+                run_at=timezone.now() + timedelta(seconds=delay), locked_by=None, locked_at=None,
+            )
+        return False
+    finally:
+        _running.reset(token)
+    claim.delete()
+    return True
+
+
+def run_worker(worker_id=None, burst=False, batch_size=10, poll_interval=1.0):
+    """
+    Worker loop: claim and execute due tasks until stopped. With `burst`, return as
+    soon as the queue is empty.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Task worker {worker_id} started.")
+    while True:
+        close_old_connections()
+        tasks = claim_tasks(worker_id, batch_size)
+        if not tasks:
+            if burst:
+                return
+            time.sleep(poll_interval)
+            continue
+        for task_obj in tasks:
+            execute_task(task_obj)
+
+
+# Post-request side effects
+
+@task(max_attempts=5, retry_delay=60)
+def send_order_confirmation(order_id):
+    order = Order.objects.using(locate(Order, order_id)).select_related('customer').get(id=order_id)
+    send_mail(
+        subject=f"Your GreenCart order #{order.id} is confirmed",
+        message=(
+            f"Thank you for your order.\n\n"
+            f"Order: #{order.id}\nTotal: {order.total_amount}\n"
+            f"Tracking number: {order.tracking_number or 'pending'}\n"
+        ),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[order.customer.email],
+    )
+    logger.info(f"Order confirmation sent for order {order.id}.")
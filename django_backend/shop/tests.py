@@ -1,7 +1,76 @@
+import gzip
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction as db_transaction
+from django.db.utils import OperationalError
+from django.contrib import admin
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APITestCase
+from django.utils import timezone
+from PIL import Image
 from rest_framework import status
-from .models import Customer
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import routers
+from .admin import OrderItemInline
+from .analytics import refresh_sales_rollups
+from .archive import archive_orders
+from .bulk import apply_operation, reprice_products, run_bulk_job
+from .compression import GzipCodec, compress_stream, negotiate
+from .coupons import ActiveCouponIndex, coupon_index
+from .idempotency import claim_key, request_fingerprint
+from .models import (
+    Customer, Category, Product, Coupon, CartItem, BulkJob, Order, OrderItem, Task, Invoice, Transaction,
+    ArchivedOrder, ArchivedOrderItem, ArchivedTransaction, DailyProductSales, DailySalesTotal,
+    LowStockProduct, StockAlert, OutboxEvent, IdempotencyKey, ProductRecommendation, Address,
+    CustomerShard, ProductRating
+)
+from .outbox import FileTransport, relay_batch
+from .payments import get_stripe
+from .pdf import render_invoice_pdf
+from .pubsub import OrderStreamToken, broker, order_channel
+from .related import related_products
+from .renderers import FastJSONRenderer
+from .serializers import CheckoutSerializer, ProductSerializer
+from .sharding import (
+    CustomerMoving, check_shard_vendors, reserve_id_range, shard_for,
+)
+from .stock import adjust_stock
+from .tasks import claim_tasks, enqueue, execute_task, run_worker, send_order_confirmation
+from .throttling import take_token
+from .views import OrderViewSet, handle_payment_intent_succeeded
+
+
+class UnshardedCustomersMixin:
+    """
+    With DATABASE_SHARD_URLS set, keep the customers a test creates on the default
+    database, and let the test reach the shards that staff views fan out over.
+    """
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        placement = override_settings(SHARD_NEW_CUSTOMERS=[DEFAULT_DB_ALIAS])
+        placement.enable()
+        cls.addClassCleanup(placement.disable)
+        super().setUpClass()
+
 
 class CustomerTests(APITestCase):
     def setUp(self):
@@ -23,3 +92,1300 @@ class CustomerTests(APITestCase):
         self.assertEqual(Customer.objects.get(email='newuser@example.com').username, 'newuser')
 
 # ...additional test cases as needed...
+
+
+class ConditionalRequestTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        self.user = Customer.objects.create_user(
+            username='shopper', email='shopper@example.com', password='Testpass123', phone_number='+100'
+        )
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category = Category.objects.create(name='Vegetables')
+            self.product = Product.objects.create(name='Kale', price=Decimal('2.50'), stock=5, category=self.category)
+
+    def test_unchanged_list_returns_not_modified(self):
+        url = reverse('product-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_depends_on_negotiated_media_type(self):
+        url = reverse('product-list')
+        json_response = self.client.get(url, HTTP_ACCEPT='application/json')
+        html_response = self.client.get(url, HTTP_ACCEPT='text/html')
+        self.assertNotEqual(json_response['ETag'], html_response['ETag'])
+        self.assertIn('Accept', json_response['Vary'])
+        response = self.client.get(url, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=json_response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_write_changes_etag(self):
+        url = reverse('product-detail', args=[self.product.pk])
+        etag = self.client.get(url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('3.00')
+            self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_expanded_category_changes_product_etag(self):
+        url = reverse('product-detail', args=[self.product.pk])
+        etag = self.client.get(url, {'expand': 'category'})['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Greens'
+            self.category.save()
+        response = self.client.get(url, {'expand': 'category'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['category']['name'], 'Greens')
+
+
+class CouponIndexTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            Coupon.objects.create(code='SPRING', discount_amount=Decimal('5.00'),
+                                  valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1))
+            Coupon.objects.create(code='LATER', discount_amount=Decimal('5.00'),
+                                  valid_from=now + timedelta(days=1), valid_to=now + timedelta(days=2))
+
+    def test_lookup_is_time_aware(self):
+        self.assertIsNotNone(coupon_index.get('SPRING'))
+        self.assertIsNone(coupon_index.get('LATER'))
+        self.assertIsNotNone(coupon_index.get('LATER', now=timezone.now() + timedelta(days=1, hours=1)))
+
+    def test_validation_uses_index_without_queries(self):
+        coupon_index.get('SPRING')
+        serializer = CheckoutSerializer(data={'payment_method_id': '1', 'shipping_address_id': 1, 'coupon_code': 'SPRING'})
+        with self.assertNumQueries(0):
+            self.assertTrue(serializer.is_valid())
+
+    def test_save_signal_invalidates_index(self):
+        self.assertIsNotNone(coupon_index.get('SPRING'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Coupon.objects.filter(code='SPRING').update(active=False)
+            Coupon.objects.get(code='SPRING').save()
+        self.assertIsNone(coupon_index.get('SPRING'))
+
+    def test_invalidation_during_load_is_not_lost(self):
+        index = ActiveCouponIndex()
+        version = index._current_version
+        # A coupon is saved elsewhere while the index is loading
+        index._current_version = lambda: (index.invalidate(), version())[1]
+        self.assertIsNotNone(index.get('SPRING'))
+        self.assertTrue(index._stale)
+
+
+@override_settings(TASK_QUEUE_EAGER=True)
+class ProductImageVariantTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.category = Category.objects.create(name='Fruit')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def _upload(self, name='apple.png', fmt='PNG'):
+        buffer = BytesIO()
+        mode = 'RGBA' if fmt == 'PNG' else 'RGB'
+        Image.new(mode, (1200, 800), (0, 128, 0, 255)[:len(mode)]).save(buffer, fmt)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{fmt.lower()}')
+
+    def test_variants_generated_after_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Apple', price=Decimal('1.00'), category=self.category,
+                                             image=self._upload())
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        with Image.open(product.image.storage.path(product.image_variants['thumbnail']['webp'])) as thumb:
+            self.assertEqual(thumb.size, (200, 133))
+
+        data = ProductSerializer(product).data
+        self.assertTrue(data['image_variants']['medium']['jpeg'].endswith('.jpeg'))
+
+    def test_replaced_image_variants_are_discarded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Apple', price=Decimal('1.00'), category=self.category,
+                                             image=self._upload())
+        product.refresh_from_db()
+        old_thumb = product.image_variants['thumbnail']['webp']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = self._upload('apple.jpg', 'JPEG')
+            product.save()
+        product.refresh_from_db()
+        new_thumb = product.image_variants['thumbnail']['webp']
+        self.assertNotEqual(new_thumb, old_thumb)
+        self.assertTrue(product.image.storage.exists(new_thumb))
+        self.assertFalse(product.image.storage.exists(old_thumb))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertFalse(product.image.storage.exists(new_thumb))
+
+
+class AdminPerformanceTests(UnshardedCustomersMixin, TestCase):
+    def setUp(self):
+        self.admin = Customer.objects.create_superuser(
+            username='admin', email='admin@example.com', password='Adminpass123', phone_number='+200'
+        )
+        self.client.force_login(self.admin)
+        category = Category.objects.create(name='Herbs')
+        product = Product.objects.create(name='Basil', price=Decimal('1.20'), stock=10, category=category)
+        for i in range(3):
+            customer = Customer.objects.create_user(
+                username=f'c{i}', email=f'c{i}@example.com', password='x', phone_number=f'+30{i}'
+            )
+            CartItem.objects.create(customer=customer, product=product, quantity=1)
+
+    def test_changelist_joins_foreign_keys(self):
+        url = reverse('admin:shop_cartitem_changelist')
+        # When sharded, the count and the rows are also read on every shard (not counted here)
+        with self.assertNumQueries(6):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_foreign_keys_use_autocomplete(self):
+        response = self.client.get(reverse('admin:shop_cartitem_add'))
+        self.assertContains(response, 'admin-autocomplete')
+
+    def test_customer_change_page_renders_limited_inlines(self):
+        customer = Customer.objects.get(email='c0@example.com')
+        response = self.client.get(reverse('admin:shop_customer_change', args=[customer.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_inline_formset_queries_do_not_grow_with_rows(self):
+        product = Product.objects.get(name='Basil')
+        request = RequestFactory().get('/')
+        request.user = self.admin
+        counts = []
+        for rows in (2, 15):
+            order = Order.objects.create(customer=self.admin)
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, price=Decimal('1.20')) for _ in range(rows)
+            ])
+            formset_class = OrderItemInline(Order, admin.site).get_formset(request, order)
+            with CaptureQueriesContext(connection) as queries:
+                formset = formset_class(instance=order)
+                self.assertEqual(len([form.instance.pk for form in formset.forms]), rows)
+            counts.append(len(queries.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(counts[1], 1)
+
+
+class AdminBulkActionTests(UnshardedCustomersMixin, TestCase):
+    def setUp(self):
+        self.admin = Customer.objects.create_superuser(
+            username='admin', email='admin@example.com', password='Adminpass123', phone_number='+200'
+        )
+        self.client.force_login(self.admin)
+        self.orders = [Order.objects.create(customer=self.admin) for _ in range(5)]
+
+    def test_small_selection_runs_single_update(self):
+        response = self.client.post(reverse('admin:shop_order_changelist'), {
+            'action': 'mark_cancelled',
+            '_selected_action': [o.pk for o in self.orders[:3]],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Order.objects.filter(status='CANCELLED').count(), 3)
+
+    def test_bulk_cancel_returns_pending_items_to_stock(self):
+        category = Category.objects.create(name='Pantry')
+        product = Product.objects.create(name='Rice', description='', price=Decimal('2.00'), stock=5,
+                                         category=category)
+        for order, quantity in zip(self.orders[:2], (2, 3)):
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price=Decimal('2.00'))
+        Order.objects.filter(pk=self.orders[1].pk).update(status='COMPLETED')
+        self.client.post(reverse('admin:shop_order_changelist'), {
+            'action': 'mark_cancelled', '_selected_action': [o.pk for o in self.orders[:2]],
+        })
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 7)
+
+    @override_settings(BULK_ACTION_SYNC_LIMIT=2, BULK_ACTION_CHUNK_SIZE=2)
+    def test_large_selection_becomes_chunked_job(self):
+        self.client.post(reverse('admin:shop_order_changelist'), {
+            'action': 'mark_completed',
+            '_selected_action': [o.pk for o in self.orders],
+        })
+        job = BulkJob.objects.get()
+        self.assertEqual(job.total, 5)
+        run_bulk_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.updated), ('COMPLETED', 5, 5))
+        self.assertEqual(Order.objects.filter(status='COMPLETED').count(), 5)
+
+    @override_settings(BULK_ACTION_SYNC_LIMIT=1, BULK_ACTION_CHUNK_SIZE=2)
+    def test_rerun_bulk_job_resumes_after_committed_chunks(self):
+        category = Category.objects.create(name='Seeds')
+        products = [Product.objects.create(name=f'Seed {i}', price=Decimal('10.00'), category=category)
+                    for i in range(3)]
+        self.client.post(reverse('admin:shop_product_changelist'), {
+            'action': 'reprice_products', 'percent': '10', '_selected_action': [p.pk for p in products],
+        })
+        job = BulkJob.objects.get()
+        # A run that died after its first chunk, then the retry
+        BulkJob.objects.filter(pk=job.pk).update(processed=2)
+        Product.objects.filter(pk__in=job.object_ids[:2]).update(price=Decimal('11.00'))
+        run_bulk_job(job.pk)
+        run_bulk_job(job.pk)
+        self.assertEqual(set(Product.objects.values_list('price', flat=True)), {Decimal('11.00')})
+
+    def test_reprice_products(self):
+        category = Category.objects.create(name='Nuts')
+        product = Product.objects.create(name='Almonds', price=Decimal('10.00'), category=category)
+        self.client.post(reverse('admin:shop_product_changelist'), {
+            'action': 'reprice_products', 'percent': '-15', '_selected_action': [product.pk],
+        })
+        product.refresh_from_db()
+        self.assertEqual(product.price, Decimal('8.50'))
+
+
+def flaky_task(marker):
+    raise RuntimeError("boom")
+
+
+class TaskQueueTests(UnshardedCustomersMixin, TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create_user(
+            username='buyer', email='buyer@example.com', password='x', phone_number='+400'
+        )
+
+    def test_enqueued_on_commit_and_run_by_worker(self):
+        order = Order.objects.create(customer=self.customer, tracking_number='TRACK-1')
+        with self.captureOnCommitCallbacks(execute=True):
+            send_order_confirmation.delay(order.id)
+        self.assertEqual(Task.objects.count(), 1)
+        run_worker(burst=True)
+        self.assertEqual(Task.objects.count(), 0)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+
+    def test_failed_task_is_retried_then_marked_failed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue('shop.tests.flaky_task', 1)
+        task_obj = Task.objects.get()
+        Task.objects.filter(pk=task_obj.pk).update(max_attempts=2)
+        run_worker(burst=True)
+        task_obj.refresh_from_db()
+        self.assertEqual((task_obj.status, task_obj.attempts), ('QUEUED', 1))
+
+        Task.objects.filter(pk=task_obj.pk).update(run_at=timezone.now())
+        run_worker(burst=True)
+        task_obj.refresh_from_db()
+        self.assertEqual((task_obj.status, task_obj.attempts), ('FAILED', 2))
+        self.assertIn('boom', task_obj.last_error)
+
+    def test_stale_worker_leaves_reclaimed_task_alone(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue('shop.tests.flaky_task', 1)
+        stale = claim_tasks('worker-1', 10)[0]
+        # The lock timed out and another worker took the task over
+        Task.objects.filter(pk=stale.pk).update(locked_by='worker-2')
+        self.assertFalse(execute_task(stale))
+        task_obj = Task.objects.get()
+        self.assertEqual((task_obj.status, task_obj.locked_by, task_obj.attempts), ('RUNNING', 'worker-2', 0))
+
+    @override_settings(TASK_QUEUE_LOCK_TIMEOUT=60)
+    def test_reclaimed_task_counts_as_an_attempt(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue('shop.tests.flaky_task', 1)
+        Task.objects.update(max_attempts=2)
+        for worker_id, attempts in (('worker-1', 0), ('worker-2', 1)):
+            self.assertEqual(claim_tasks(worker_id, 10)[0].attempts, attempts)
+            # The worker crashed mid-run and its lock expired
+            Task.objects.update(locked_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(claim_tasks('worker-3', 10), [])
+        task_obj = Task.objects.get()
+        self.assertEqual((task_obj.status, task_obj.attempts), ('FAILED', 2))
+        self.assertIn('worker-2', task_obj.last_error)
+
+
+@override_settings(TASK_QUEUE_EAGER=True)
+class InvoiceDocumentTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.customer = Customer.objects.create_user(
+            username='payer', email='payer@example.com', password='x', phone_number='+500'
+        )
+        self.client.force_authenticate(self.customer)
+        category = Category.objects.create(name='Grains')
+        product = Product.objects.create(name='Oats (rolled)', price=Decimal('4.00'), stock=9, category=category)
+        self.order = Order.objects.create(customer=self.customer, total_amount=Decimal('8.00'))
+        OrderItem.objects.create(order=self.order, product=product, quantity=2, price=Decimal('4.00'))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_pdf_renderer_output(self):
+        pdf = render_invoice_pdf({
+            'invoice_id': 1, 'order_id': 2, 'issued_at': '2026-01-31', 'customer_name': 'A',
+            'customer_email': 'a@example.com', 'total_amount': '8.00',
+            'items': [{'name': 'Oats (rolled)', 'quantity': 2, 'price': '4.00', 'amount': '8.00'}],
+        })
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertTrue(pdf.rstrip().endswith(b'%%EOF'))
+        self.assertIn(b'Oats \\(rolled\\)', pdf)
+
+    def test_download_is_rendered_in_background_and_supports_ranges(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice = Invoice.objects.create(order=self.order, customer=self.customer, total_amount=Decimal('8.00'))
+        invoice.refresh_from_db()
+        self.assertTrue(invoice.document.startswith('invoices/'))
+
+        url = reverse('invoice-download', args=[invoice.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = b''.join(response.streaming_content)
+        self.assertTrue(body.startswith(b'%PDF'))
+
+        response = self.client.get(url, HTTP_RANGE='bytes=0-3')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+        self.assertEqual(response['Content-Range'], f'bytes 0-3/{len(body)}')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_download_without_document_queues_render(self):
+        invoice = Invoice.objects.create(order=self.order, customer=self.customer, total_amount=Decimal('8.00'))
+        response = self.client.get(reverse('invoice-download', args=[invoice.pk]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReadReplicaRouterTests(UnshardedCustomersMixin, TestCase):
+    def setUp(self):
+        self.router = routers.ReadReplicaRouter()
+        self.token = routers.begin_request()
+        routers._unavailable.clear()
+        self.connections = mock.MagicMock()
+        self.connections['default'].in_atomic_block = False
+        patcher = mock.patch.object(routers, 'connections', self.connections)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        routers.end_request(self.token)
+
+    def test_reads_stay_on_primary_outside_replica_views(self):
+        self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_safe_reads_use_replica_until_a_write(self):
+        routers.use_replica()
+        self.assertEqual(self.router.db_for_read(Product), 'replica_1')
+        self.router.db_for_write(Product)
+        self.assertIsNone(self.router.db_for_read(Product))
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        routers.use_replica()
+        self.connections['replica_1'].ensure_connection.side_effect = OperationalError
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+        self.assertIn('replica_1', routers._unavailable)
+
+    def test_recent_writer_is_pinned_to_primary(self):
+        routers.pin_to_primary(42)
+        self.assertTrue(routers.is_pinned(42))
+        self.assertFalse(routers.is_pinned(43))
+
+
+class OrderArchivalTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create_user(
+            username='history', email='history@example.com', password='x', phone_number='+600'
+        )
+        self.client.force_authenticate(self.customer)
+        category = Category.objects.create(name='Tea')
+        product = Product.objects.create(name='Green tea', price=Decimal('6.00'), stock=3, category=category)
+        self.old = Order.objects.create(customer=self.customer, status='COMPLETED', total_amount=Decimal('6.00'))
+        Order.objects.filter(pk=self.old.pk).update(created_at=timezone.now() - timedelta(days=400))
+        OrderItem.objects.create(order=self.old, product=product, quantity=1, price=Decimal('6.00'))
+        Transaction.objects.create(order=self.old, customer=self.customer, amount=Decimal('6.00'))
+        Invoice.objects.create(order=self.old, customer=self.customer, total_amount=Decimal('6.00'))
+        self.recent = Order.objects.create(customer=self.customer, status='COMPLETED')
+
+    def test_old_finished_orders_move_with_children(self):
+        self.assertEqual(archive_orders(timezone.now() - timedelta(days=365), batch_size=1), 1)
+        self.assertEqual(list(Order.objects.values_list('id', flat=True)), [self.recent.pk])
+        self.assertFalse(OrderItem.objects.exists() or Transaction.objects.exists() or Invoice.objects.exists())
+        self.assertEqual(ArchivedOrder.objects.get().pk, self.old.pk)
+        self.assertEqual(ArchivedOrderItem.objects.count(), 1)
+        self.assertEqual(ArchivedTransaction.objects.count(), 1)
+
+    def test_interrupted_batch_is_copied_again_and_deleted(self):
+        # A run that copied the order, then crashed before deleting it from the hot table
+        ArchivedOrder.objects.create(id=self.old.pk, customer=self.customer, total_amount=Decimal('0.00'),
+                                     status='PENDING', created_at=self.old.created_at)
+        self.assertEqual(archive_orders(timezone.now() - timedelta(days=365)), 1)
+        self.assertFalse(Order.objects.filter(pk=self.old.pk).exists())
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual((archived.status, archived.total_amount), ('COMPLETED', Decimal('6.00')))
+        self.assertEqual(ArchivedOrderItem.objects.count(), 1)
+
+    def test_archived_rows_are_listed_separately(self):
+        archive_orders(timezone.now() - timedelta(days=365))
+        self.assertEqual([o['order_id'] for o in self.client.get(reverse('order-list')).data], [self.recent.pk])
+        data = self.client.get(reverse('order-archived')).data
+        self.assertEqual([o['order_id'] for o in data], [self.old.pk])
+        self.assertTrue(data[0]['archived'])
+        self.assertEqual(len(data[0]['order_items']), 1)
+        data = self.client.get(reverse('order-archived'), {'fields': 'order_id,status'}).data
+        self.assertEqual(data, [{'order_id': self.old.pk, 'status': 'COMPLETED'}])
+
+        self.assertEqual(len(self.client.get(reverse('transaction-list')).data), 0)
+        self.assertEqual(len(self.client.get(reverse('transaction-archived')).data), 1)
+
+
+class SalesRollupTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        self.staff = Customer.objects.create_user(
+            username='analyst', email='analyst@example.com', password='x', phone_number='+700', is_staff=True
+        )
+        self.client.force_authenticate(self.staff)
+        self.fruit = Category.objects.create(name='Fruit')
+        self.apple = Product.objects.create(name='Apple', price=Decimal('1.00'), stock=50, category=self.fruit)
+        self.pear = Product.objects.create(name='Pear', price=Decimal('2.00'), stock=50, category=self.fruit)
+        self.order = self.place_order({self.apple: 3, self.pear: 1}, days_ago=1)
+        payment = Transaction.objects.create(order=self.order, customer=self.staff, amount=Decimal('5.00'))
+        Transaction.objects.filter(pk=payment.pk).update(transaction_date=timezone.now() - timedelta(days=1))
+
+    def place_order(self, items, days_ago=0, status='COMPLETED'):
+        order = Order.objects.create(customer=self.staff, status=status)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        for product, quantity in items.items():
+            OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.price)
+        return order
+
+    def test_refresh_builds_daily_rollups(self):
+        refresh_sales_rollups()
+        apple = DailyProductSales.objects.get(product=self.apple)
+        self.assertEqual((apple.units, apple.revenue, apple.orders), (3, Decimal('3.00'), 1))
+        total = DailySalesTotal.objects.get()
+        self.assertEqual((total.orders, total.units, total.revenue), (1, 4, Decimal('5.00')))
+        self.assertEqual((total.transactions, total.payments), (1, Decimal('5.00')))
+
+    def test_incremental_refresh_keeps_history_and_adds_new_orders(self):
+        old = self.place_order({self.apple: 1}, days_ago=10)
+        refresh_sales_rollups()
+        OrderItem.objects.filter(order=old).delete()  # Days before the refresh window are not recomputed
+        self.place_order({self.pear: 2})
+        self.place_order({self.pear: 5}, status='CANCELLED')
+        self.place_order({self.pear: 7}, status='PENDING')
+        refresh_sales_rollups()
+        self.assertEqual(DailySalesTotal.objects.count(), 3)
+        self.assertEqual(DailyProductSales.objects.filter(product=self.apple).count(), 2)
+        self.assertEqual(sum(DailyProductSales.objects.filter(product=self.pear).values_list('units', flat=True)), 3)
+
+    def test_late_completion_recomputes_the_order_day(self):
+        late = self.place_order({self.apple: 2}, days_ago=10, status='PENDING')
+        refresh_sales_rollups()
+        order = Order.objects.get(pk=late.pk)
+        order.status = 'COMPLETED'
+        order.save()
+        refresh_sales_rollups()
+        self.assertEqual(DailySalesTotal.objects.count(), 2)
+        self.assertEqual(sum(DailyProductSales.objects.filter(product=self.apple).values_list('units', flat=True)), 5)
+
+    def test_reporting_endpoints(self):
+        refresh_sales_rollups()
+        daily = self.client.get(reverse('salesreport-daily'))
+        self.assertEqual(daily.status_code, status.HTTP_200_OK)
+        self.assertEqual(daily.data['totals']['revenue'], Decimal('5.00'))
+        top = self.client.get(reverse('salesreport-top-products'), {'order_by': 'units', 'limit': 1}).data['results']
+        self.assertEqual([row['product__name'] for row in top], ['Apple'])
+        categories = self.client.get(reverse('salesreport-categories')).data['results']
+        self.assertEqual(categories[0]['category__name'], 'Fruit')
+        self.assertEqual(self.client.get(reverse('salesreport-daily'), {'start': '2024-02-01', 'end': '2024-01-01'})
+                         .status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse('salesreport-daily')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class CartBatchTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create_user(
+            username='merger', email='merger@example.com', password='x', phone_number='+800'
+        )
+        self.client.force_authenticate(self.customer)
+        category = Category.objects.create(name='Bakery')
+        self.bread = Product.objects.create(name='Bread', price=Decimal('3.00'), stock=10, category=category)
+        self.bun = Product.objects.create(name='Bun', price=Decimal('1.00'), stock=4, category=category)
+        self.url = reverse('cartitem-batch')
+        cache.clear()  # Memoized cart summaries are keyed by customer id
+
+    def test_readding_a_product_increments_the_line(self):
+        url = reverse('cartitem-list')
+        for _ in range(2):
+            response = self.client.post(url, {'customer': self.customer.pk, 'product': self.bread.pk, 'quantity': 2})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(CartItem.objects.get().quantity, 4)
+        self.bread.refresh_from_db()
+        self.assertEqual(self.bread.stock, 6)
+
+    def test_batch_merge_upserts_and_returns_cart(self):
+        CartItem.objects.create(customer=self.customer, product=self.bread, quantity=1)
+        items = [{'product': self.bread.pk, 'quantity': 2}, {'product': self.bun.pk, 'quantity': 1},
+                 {'product': self.bun.pk, 'quantity': 2}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({line['product']: line['quantity'] for line in response.data['lines']},
+                         {self.bread.pk: 3, self.bun.pk: 3})
+        self.assertEqual(response.data['total'], '12.00')
+        self.bun.refresh_from_db()
+        self.assertEqual(self.bun.stock, 1)
+
+        response = self.client.post(self.url, {'mode': 'set', 'items': [{'product': self.bun.pk, 'quantity': 0}]},
+                                    format='json')
+        self.assertEqual([line['product'] for line in response.data['lines']], [self.bread.pk])
+        self.bun.refresh_from_db()
+        self.assertEqual(self.bun.stock, 4)
+
+    def test_batch_is_all_or_nothing(self):
+        items = [{'product': self.bread.pk, 'quantity': 2}, {'product': self.bun.pk, 'quantity': 5}]
+        response = self.client.post(self.url, {'items': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(CartItem.objects.exists())
+        self.bread.refresh_from_db()
+        self.assertEqual(self.bread.stock, 10)
+
+    def test_summary_prices_cart_and_applies_coupon(self):
+        now = timezone.now()
+        Coupon.objects.create(code='BREAD1', discount_amount=Decimal('1.00'),
+                              valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1))
+        coupon_index.invalidate()
+        with self.captureOnCommitCallbacks(execute=True):
+            CartItem.objects.create(customer=self.customer, product=self.bread, quantity=2)
+        url = reverse('cartitem-summary')
+        response = self.client.get(url, {'coupon': 'BREAD1'})
+        self.assertEqual(response.data['lines'][0]['subtotal'], '6.00')
+        self.assertEqual((response.data['coupon'], response.data['discount'], response.data['total']),
+                         ('BREAD1', '1.00', '5.00'))
+        self.assertEqual(self.client.get(url, {'coupon': 'NOPE'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_summary_memo_follows_cart_and_price_changes(self):
+        url = reverse('cartitem-summary')
+        with self.captureOnCommitCallbacks(execute=True):
+            CartItem.objects.create(customer=self.customer, product=self.bread, quantity=1)
+        self.assertEqual(self.client.get(url).data['total'], '3.00')
+        # The versions are in the cache too
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.get(pk=self.bread.pk)
+            product.price = Decimal('4.00')
+            product.save()
+        self.assertEqual(self.client.get(url).data['total'], '4.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('cartitem-batch'), {'items': [{'product': self.bun.pk, 'quantity': 1}]},
+                             format='json')
+        self.assertEqual(self.client.get(url).data['total'], '5.00')
+
+        line = CartItem.objects.get(product=self.bun)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse('cartitem-detail', args=[line.pk]),
+                            {'customer': self.customer.pk, 'product': self.bun.pk, 'quantity': 3})
+        self.assertEqual(self.client.get(url).data['total'], '7.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('cartitem-detail', args=[line.pk]))
+        self.assertEqual(self.client.get(url).data['total'], '4.00')
+
+
+class CatalogFacetTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(Customer.objects.create_user(
+            username='browser', email='browser@example.com', password='x', phone_number='+900'
+        ))
+        fruit = Category.objects.create(name='Fruit')
+        dairy = Category.objects.create(name='Dairy')
+        Product.objects.create(name='Lime', price=Decimal('5.00'), stock=3, category=fruit)
+        Product.objects.create(name='Mango', price=Decimal('30.00'), stock=0, category=fruit)
+        Product.objects.create(name='Cheese', price=Decimal('120.00'), stock=2, category=dairy)
+        self.url = reverse('product-list')
+
+    def test_filters_search_and_ordering_are_active(self):
+        names = lambda params: [p['name'] for p in self.client.get(self.url, params).data]
+        self.assertEqual(names({'category__name': 'Fruit', 'ordering': '-price'}), ['Mango', 'Lime'])
+        self.assertEqual(names({'min_price': 10, 'in_stock': 'true'}), ['Cheese'])
+        self.assertEqual(names({'search': 'chee'}), ['Cheese'])
+
+    def test_facets_come_from_one_query_and_are_cached(self):
+        with self.assertNumQueries(3):  # Change counters, results, facets
+            data = self.client.get(self.url, {'facets': 'true', 'category__name': 'Fruit'}).data
+        self.assertEqual(len(data['results']), 2)
+        facets = data['facets']
+        self.assertEqual([(c['name'], c['count']) for c in facets['categories']], [('Fruit', 2)])
+        self.assertEqual({r['label']: r['count'] for r in facets['price_ranges'] if r['count']},
+                         {'0-10': 1, '25-50': 1})
+        self.assertEqual(facets['availability'], {'in_stock': 1, 'out_of_stock': 1})
+
+        with self.assertNumQueries(2):
+            self.client.get(self.url, {'facets': 'true', 'category__name': 'Fruit', 'ordering': 'price'})
+
+
+@override_settings(STOCK_ALERT_SINKS=['shop.stock.DatabaseSink', 'shop.stock.WebhookSink'],
+                   STOCK_ALERT_WEBHOOK_URL='http://127.0.0.1:8099/', TASK_QUEUE_EAGER=True)
+class LowStockAlertTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        self.staff = Customer.objects.create_user(
+            username='ops', email='ops@example.com', password='x', phone_number='+1000', is_staff=True
+        )
+        self.client.force_authenticate(self.staff)
+        self.produce = Category.objects.create(name='Produce', reorder_point=3)
+        self.leek = Product.objects.create(name='Leek', price=Decimal('1.00'), stock=10, category=self.produce)
+        self.salt = Product.objects.create(name='Salt', price=Decimal('1.00'), stock=10, category=self.produce,
+                                           reorder_point=8)
+        patcher = mock.patch('shop.stock.requests.post')
+        self.post = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_crossing_thresholds_emits_deduplicated_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock({self.leek.pk: -6, self.salt.pk: -2})  # Salt reaches its own reorder point
+        self.assertEqual(list(StockAlert.objects.values_list('product__name', 'level')), [('Salt', 'LOW')])
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock({self.leek.pk: -1, self.salt.pk: -1})  # Leek hits the category's; Salt stays LOW
+            adjust_stock({self.salt.pk: -7})
+        self.assertEqual(sorted(StockAlert.objects.values_list('product__name', 'level')),
+                         [('Leek', 'LOW'), ('Salt', 'LOW'), ('Salt', 'OUT')])
+        self.assertEqual(self.post.call_count, 3)
+        self.assertEqual(self.post.call_args.kwargs['json']['events'][0]['level'], 'OUT')
+
+        adjust_stock({self.leek.pk: 20})
+        self.assertFalse(LowStockProduct.objects.filter(product=self.leek).exists())
+
+    def test_decrements_are_all_or_nothing(self):
+        with self.assertRaises(ValidationError):
+            adjust_stock({self.leek.pk: -1, self.salt.pk: -11})
+        self.leek.refresh_from_db()
+        self.assertEqual(self.leek.stock, 10)
+
+    def test_low_stock_endpoint_and_admin_edits(self):
+        self.client.post(reverse('product-update-stock', args=[self.leek.pk]), {'stock': 0})
+        self.salt.stock = 4
+        self.salt.save()
+        data = self.client.get(reverse('product-low-stock')).data
+        self.assertEqual([(row['product_name'], row['level']) for row in data], [('Leek', 'OUT'), ('Salt', 'LOW')])
+        self.assertEqual(len(self.client.get(reverse('product-low-stock'), {'level': 'out'}).data), 1)
+
+
+@override_settings(OUTBOX_CURSOR_LAG_SECONDS=0)
+class OutboxTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create_user(
+            username='buyer', email='buyer@example.com', password='x', phone_number='+1100'
+        )
+        category = Category.objects.create(name='Spices')
+        self.pepper = Product.objects.create(name='Pepper', price=Decimal('4.00'), stock=10, category=category)
+        with db_transaction.atomic():
+            self.order = Order.objects.create(customer=self.customer, total_amount=Decimal('8.00'))
+            OrderItem.objects.create(order=self.order, product=self.pepper, quantity=2, price=Decimal('4.00'))
+
+    def topics(self):
+        return list(OutboxEvent.objects.values_list('topic', flat=True))
+
+    def test_payment_records_events_with_the_change(self):
+        handle_payment_intent_succeeded({'id': 'pi_1', 'amount': 800, 'metadata': {'order_id': self.order.pk}})
+        self.assertEqual(self.topics(), ['order.created', 'transaction.created', 'order.status_changed'])
+        event = OutboxEvent.objects.last()
+        self.assertEqual((event.payload['previous_status'], event.payload['status']), ('PENDING', 'COMPLETED'))
+        self.assertTrue(event.payload['tracking_number'])
+
+        with self.assertRaises(RuntimeError), db_transaction.atomic():
+            Order.objects.create(customer=self.customer)
+            raise RuntimeError
+        self.assertEqual(len(self.topics()), 3)
+
+    def test_cancel_restocks_and_relay_publishes_in_order(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post(reverse('order-cancel', args=[self.order.pk]))
+        self.assertEqual(response.data['status'], 'CANCELLED')
+        self.pepper.refresh_from_db()
+        self.assertEqual(self.pepper.stock, 12)
+        self.assertEqual(self.client.post(reverse('order-cancel', args=[self.order.pk])).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+        with tempfile.NamedTemporaryFile('r', suffix='.ndjson') as fh, override_settings(OUTBOX_FILE=fh.name):
+            self.assertEqual(relay_batch(FileTransport(), batch_size=10), 2)
+            self.assertEqual(relay_batch(FileTransport(), batch_size=10), 0)
+            lines = [json.loads(line) for line in fh.read().splitlines()]
+        self.assertEqual([line['topic'] for line in lines], ['order.created', 'order.status_changed'])
+        self.assertFalse(OutboxEvent.objects.filter(published_at__isnull=True).exists())
+
+    def test_cursor_feed(self):
+        handle_payment_intent_succeeded({'id': 'pi_2', 'amount': 800, 'metadata': {'order_id': self.order.pk}})
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get(reverse('event-feed')).status_code, status.HTTP_403_FORBIDDEN)
+        self.customer.is_staff = True
+        self.customer.save()
+        page = self.client.get(reverse('event-feed'), {'limit': 2}).data
+        self.assertEqual(len(page['events']), 2)
+        rest = self.client.get(reverse('event-feed'), {'after': page['next_cursor'], 'topic': 'order.'}).data
+        self.assertEqual([event['topic'] for event in rest['events']], ['order.status_changed'])
+
+
+@override_settings(ORDER_STREAM_RECHECK_SECONDS=5, ORDER_STREAM_TIMEOUT=10)
+class OrderStreamTests(UnshardedCustomersMixin, TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create_user(
+            username='waiter', email='waiter@example.com', password='x', phone_number='+1200'
+        )
+        self.order = Order.objects.create(customer=self.customer)
+        self.url = reverse('order-stream', args=[self.order.pk])
+        self.token = str(OrderStreamToken.for_order(self.order.pk, self.customer))
+
+    def test_requires_owner(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        other = Customer.objects.create_user(
+            username='other', email='other@example.com', password='x', phone_number='+1201'
+        )
+        response = self.client.get(self.url, {'token': str(OrderStreamToken.for_order(self.order.pk, other))})
+        self.assertEqual(response.status_code, 404)
+
+    def test_stream_token_is_single_purpose(self):
+        data = self.client.post(reverse('order-stream-token', args=[self.order.pk]),
+                                HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.customer)}").json()
+        self.assertIn(f"?token={data['token']}", data['stream_url'])
+        self.assertEqual(self.client.get(self.url, {'token': data['token']}).status_code, 200)
+        # Neither an access token nor a token for another order opens the stream
+        self.assertEqual(self.client.get(self.url, {'token': str(AccessToken.for_user(self.customer))}).status_code, 401)
+        other_order = Order.objects.create(customer=self.customer)
+        token = str(OrderStreamToken.for_order(other_order.pk, self.customer))
+        self.assertEqual(self.client.get(self.url, {'token': token}).status_code, 401)
+
+    def test_wsgi_gets_current_state_and_reconnects(self):
+        response = self.client.get(self.url, {'token': self.token})
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.content.startswith(b'retry: '))
+        self.assertIn(b'"status": "PENDING"', response.content)
+
+    async def test_pushes_changes_until_final(self):
+        response = await self.async_client.get(self.url, {'token': self.token})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content.__aiter__()
+        self.assertIn(b'"status": "PENDING"', await stream.__anext__())
+
+        broker.publish(order_channel(self.order.pk),
+                       {'order_id': self.order.pk, 'status': 'COMPLETED', 'tracking_number': 'TRACK-1'})
+        self.assertIn(b'"tracking_number": "TRACK-1"', await stream.__anext__())
+        with self.assertRaises(StopAsyncIteration):
+            await stream.__anext__()
+
+
+class IdempotencyTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create_user(
+            username='retrier', email='retrier@example.com', password='x', phone_number='+1202'
+        )
+        self.client.force_authenticate(self.customer)
+
+    def test_retry_replays_the_first_order(self):
+        first = self.client.post(reverse('order-list'), {}, format='json', HTTP_IDEMPOTENCY_KEY='k-1')
+        retry = self.client.post(reverse('order-list'), {}, format='json', HTTP_IDEMPOTENCY_KEY='k-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data['order_id'], first.data['order_id'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 1)
+
+        self.client.post(reverse('order-list'), {}, format='json')
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 2)
+
+    def test_reused_key_with_another_body_is_rejected(self):
+        self.client.post(reverse('order-list'), {}, format='json', HTTP_IDEMPOTENCY_KEY='k-2')
+        response = self.client.post(reverse('order-list'), {'status': 'COMPLETED'}, format='json',
+                                    HTTP_IDEMPOTENCY_KEY='k-2')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_expired_key_is_claimed_again(self):
+        self.client.post(reverse('order-list'), {}, format='json', HTTP_IDEMPOTENCY_KEY='k-3')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        response = self.client.post(reverse('order-list'), {}, format='json', HTTP_IDEMPOTENCY_KEY='k-3')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.filter(customer=self.customer).count(), 2)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_stale_in_progress_key_is_taken_over(self):
+        fingerprint = request_fingerprint(RequestFactory().post(
+            reverse('order-list'), {}, content_type='application/json'))
+        claim_key(self.customer.pk, 'k-4', fingerprint)
+        response = self.client.post(reverse('order-list'), {}, format='json', HTTP_IDEMPOTENCY_KEY='k-4')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        IdempotencyKey.objects.update(locked_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT + 1))
+        response = self.client.post(reverse('order-list'), {}, format='json', HTTP_IDEMPOTENCY_KEY='k-4')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(IdempotencyKey.objects.get().status, 'COMPLETED')
+
+    def test_transient_payment_error_is_not_stored(self):
+        order_id = self.client.post(reverse('order-list'), {}, format='json').data['order_id']
+        stripe = get_stripe()
+        url, data = reverse('create_payment_intent'), {'amount': 500, 'order_id': order_id}
+        with mock.patch.object(stripe.PaymentIntent, 'create', side_effect=stripe.error.APIConnectionError('down')):
+            response = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='k-5')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        with mock.patch.object(stripe.PaymentIntent, 'create', return_value=mock.Mock(client_secret='pi_secret')):
+            response = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY='k-5')
+        self.assertEqual(response.data, {'client_secret': 'pi_secret'})
+
+
+class ThrottlingTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_bucket_bursts_then_refills(self):
+        # 3 tokens, one every 100 ms
+        self.assertEqual([take_token('bucket', 1000, 100, 300) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(take_token('bucket', 1000, 100, 300), 100)
+        self.assertEqual(take_token('bucket', 1050, 100, 300), 50)
+        self.assertEqual(take_token('bucket', 1100, 100, 300), 0)
+        self.assertEqual(take_token('bucket', 5000, 100, 300), 0)  # Idle: full again
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {
+        **settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'auth': '2/min'}})
+    def test_scoped_limit_returns_retry_after(self):
+        url = reverse('login')
+        for _ in range(2):
+            self.assertNotEqual(self.client.post(url, {}).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post(url, {})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response['Retry-After'], '30')
+        # Other scopes keep their own buckets
+        self.assertNotEqual(self.client.get(reverse('product-list')).status_code,
+                            status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class CompressionTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_authenticate(Customer.objects.create_user(
+            username='zipper', email='zipper@example.com', password='x', phone_number='+1203'
+        ))
+        category = Category.objects.create(name='Bulk')
+        Product.objects.bulk_create([
+            Product(name=f'Carrot {i}', description='Crunchy ' * 10, price=Decimal('0.99'), stock=5, category=category)
+            for i in range(40)
+        ])
+
+    def test_large_json_is_gzipped_small_is_not(self):
+        response = self.client.get(reverse('product-list'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(len(json.loads(gzip.decompress(response.content))), 40)
+
+        response = self.client.get(reverse('category-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_pages_with_a_csrf_token_are_not_compressed(self):
+        response = self.client.get(reverse('admin:login'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        self.assertGreaterEqual(len(response.content), settings.COMPRESSION_MIN_SIZE)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_negotiation_and_streaming(self):
+        codecs = [GzipCodec()]
+        self.assertIsNone(negotiate('identity', codecs))
+        self.assertIsNone(negotiate('gzip;q=0', codecs))
+        self.assertEqual(negotiate('br;q=1.0, *;q=0.5', codecs).encoding, 'gzip')
+        chunks = list(compress_stream(GzipCodec(), [b'event: one\n\n', b'event: two\n\n']))
+        self.assertEqual(gzip.decompress(b''.join(chunks)), b'event: one\n\nevent: two\n\n')
+
+    def test_fast_renderer_matches_stock_renderer(self):
+        data = {'price': Decimal('12.50'), 'at': timezone.now(), 'day': timezone.now().date(), 1: 'key',
+                'names': ['café', 'line break']}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class RelatedProductTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.client.force_authenticate(Customer.objects.create_user(
+            username='browser', email='browser@example.com', password='x', phone_number='+1204'
+        ))
+        herbs = Category.objects.create(name='Herbs')
+        self.basil = Product.objects.create(name='Basil', price=Decimal('2.00'), stock=5, category=herbs)
+        self.mint = Product.objects.create(name='Mint', price=Decimal('1.50'), stock=1, category=herbs)
+        self.dill = Product.objects.create(name='Dill', price=Decimal('1.25'), stock=4, category=herbs)
+        ProductRecommendation.objects.create(product=self.basil, recommended_product=self.mint)
+        ProductRecommendation.objects.create(product=self.basil, recommended_product=self.dill)
+        self.url = reverse('product-related', args=[self.basil.pk])
+
+    def related(self):
+        return [(item['name'], item['price'], item['in_stock']) for item in self.client.get(self.url).data['results']]
+
+    def test_blob_is_served_from_one_cache_lookup(self):
+        self.assertEqual(self.related(), [('Mint', '1.50', True), ('Dill', '1.25', True)])
+        with self.assertNumQueries(0):
+            related_products(self.basil.pk)
+        self.assertEqual(self.client.get(reverse('product-related', args=[999999])).status_code, 404)
+
+    def test_price_stock_and_recommendation_changes_invalidate(self):
+        self.related()
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock({self.mint.pk: -1})  # Out of stock: sorted last
+        self.assertEqual(self.related(), [('Dill', '1.25', True), ('Mint', '1.50', False)])
+        with self.captureOnCommitCallbacks(execute=True):
+            reprice_products(Product.objects.filter(pk=self.dill.pk), {'percent': 100})
+        self.assertEqual(self.related()[0], ('Dill', '2.50', True))
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductRecommendation.objects.filter(recommended_product=self.mint).delete()
+            ProductRecommendation.objects.get(recommended_product=self.dill).delete()
+        self.assertEqual(self.related(), [])
+
+    def test_stock_change_without_flag_change_keeps_the_blob(self):
+        self.related()
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock({self.dill.pk: -1})  # Still in stock
+        with self.assertNumQueries(0):
+            related_products(self.basil.pk)
+
+    def test_changes_drop_only_the_blobs_showing_the_product(self):
+        ProductRecommendation.objects.create(product=self.mint, recommended_product=self.basil)
+        self.related()
+        related_products(self.mint.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            reprice_products(Product.objects.filter(pk=self.dill.pk), {'percent': 100})
+        with self.assertNumQueries(0):
+            related_products(self.mint.pk)
+        self.assertEqual(self.related()[1], ('Dill', '2.50', True))
+
+
+class SparseFieldsTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.customer = Customer.objects.create_user(
+            username='sparse', email='sparse@example.com', password='x', phone_number='+1205'
+        )
+        self.client.force_authenticate(self.customer)
+        self.fruit = Category.objects.create(name='Fruit')
+        self.plum = Product.objects.create(name='Plum', description='Sweet ' * 50, price=Decimal('3.00'),
+                                           stock=9, category=self.fruit)
+
+    def test_fields_trim_the_payload_and_the_select(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('product-list'), {'fields': 'product_id,name,price'}).data
+        self.assertEqual(data, [{'product_id': self.plum.pk, 'name': 'Plum', 'price': '3.00'}])
+        product_sql = [q['sql'] for q in queries.captured_queries if 'FROM "shop_product"' in q['sql']]
+        self.assertTrue(product_sql)
+        self.assertNotIn('"description"', product_sql[-1])
+
+        data = self.client.get(reverse('product-list'), {'fields': 'name,category', 'expand': 'category'}).data
+        self.assertEqual(data[0]['category']['name'], 'Fruit')
+        self.assertEqual(self.client.get(reverse('product-list')).data[0]['category'], self.fruit.pk)
+
+    def test_nested_fields_prefetch_once(self):
+        for _ in range(3):
+            order = Order.objects.create(customer=self.customer)
+            OrderItem.objects.create(order=order, product=self.plum, quantity=1, price=Decimal('3.00'))
+        url = reverse('order-list')
+        params = {'fields': 'order_id,order_items.product_id,order_items.product', 'expand': 'order_items.product'}
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, params).data
+        self.assertEqual(set(data[0]), {'order_id', 'order_items'})
+        self.assertEqual(set(data[0]['order_items'][0]), {'product_id', 'product'})
+        self.assertEqual(data[0]['order_items'][0]['product']['name'], 'Plum')
+        Order.objects.create(customer=self.customer)
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url, params)
+
+
+class BatchGetTests(UnshardedCustomersMixin, APITestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.customer = Customer.objects.create_user(
+            username='batch', email='batch@example.com', password='x', phone_number='+1206'
+        )
+        self.other = Customer.objects.create_user(
+            username='batch2', email='batch2@example.com', password='x', phone_number='+1207'
+        )
+        self.client.force_authenticate(self.customer)
+        category = Category.objects.create(name='Batch')
+        self.products = [
+            Product.objects.create(name=f"Batch {i}", description='', price=Decimal('2.00'), stock=5,
+                                   category=category)
+            for i in range(3)
+        ]
+
+    def test_products_in_request_order_and_cached(self):
+        a, b, c = self.products
+        url = reverse('product-batch')
+        params = {'ids': f"{c.pk},999999,{a.pk},{c.pk}"}
+        response = self.client.get(url, params)
+        self.assertEqual([item['product_id'] for item in response.data['results']], [c.pk, a.pk])
+        self.assertEqual(response.data['missing'], [999999])
+
+        # Hits come from the cache; only the unknown id is looked up again
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, params)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('FROM "shop_product"', queries[0]['sql'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            adjust_stock({a.pk: -2})
+        data = self.client.get(url, {'ids': str(a.pk), 'fields': 'stock'}).data
+        self.assertEqual(data['results'], [{'stock': 3}])
+
+        self.assertEqual(self.client.get(url, {'ids': 'x'}).status_code, 400)
+        with self.settings(BATCH_MAX_IDS=2):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    def test_products_render_like_the_detail_endpoint(self):
+        product = self.products[0]
+        Product.objects.filter(pk=product.pk).update(image='products/batch.jpg')
+        detail = self.client.get(reverse('product-detail', args=[product.pk])).data
+        self.assertTrue(detail['image'].startswith('http://testserver/'))
+        url = reverse('product-batch')
+        for _ in range(2):  # Rendered, then from the cache
+            self.assertEqual(self.client.get(url, {'ids': str(product.pk), 'fields': 'image'}).data['results'],
+                             [{'image': detail['image']}])
+
+        data = self.client.get(url, {'ids': str(product.pk), 'expand': 'category'}).data
+        self.assertEqual(data['results'][0]['category']['name'], 'Batch')
+
+    def test_orders_are_owner_filtered(self):
+        mine = Order.objects.create(customer=self.customer)
+        theirs = Order.objects.create(customer=self.other)
+        OrderItem.objects.create(order=mine, product=self.products[0], quantity=1, price=Decimal('2.00'))
+        url = reverse('order-batch')
+        params = {'ids': f"{theirs.pk},{mine.pk}"}
+
+        data = self.client.get(url, params).data
+        self.assertEqual([item['order_id'] for item in data['results']], [mine.pk])
+        self.assertEqual(len(data['results'][0]['order_items']), 1)
+        self.assertEqual(data['missing'], [theirs.pk])
+
+        # Cached by another customer's request, still not visible here
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get(url, params).data['missing'], [mine.pk])
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get(url, params).data['missing'], [theirs.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            OrderItem.objects.create(order=mine, product=self.products[1], quantity=1, price=Decimal('2.00'))
+        self.assertEqual(len(self.client.get(url, params).data['results'][0]['order_items']), 2)
+
+    def test_updates_without_signals_drop_only_their_entries(self):
+        shipped, other = (Order.objects.create(customer=self.customer, status='PENDING') for _ in range(2))
+        url = reverse('order-batch')
+        params = {'ids': f"{shipped.pk},{other.pk}"}
+        self.client.get(url, params)
+
+        # A bulk action's plain UPDATE
+        with self.captureOnCommitCallbacks(execute=True):
+            apply_operation('order_status', [shipped.pk], {'status': 'SHIPPED'})
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, params).data
+        self.assertEqual([item['status'] for item in data['results']], ['SHIPPED', 'PENDING'])
+        reads = [q['sql'] for q in queries.captured_queries if 'FROM "shop_order"' in q['sql']]
+        self.assertEqual(len(reads), 1)
+        self.assertIn(f'"shop_order"."id" IN ({shipped.pk})', reads[0])
+
+
+def foreign_key_columns(alias, table):
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return {column for constraint in constraints.values() if constraint['foreign_key'] for column in constraint['columns']}
+
+
+class SchemaTests(TestCase):
+    def test_deferred_overrides_reach_the_schema(self):
+        schema = json.loads(self.client.get('/swagger.json', HTTP_ACCEPT='application/openapi+json').content)
+        batch = schema['paths']['/cart-items/batch/']['post']
+        self.assertEqual(batch['responses']['200']['schema'], {'$ref': '#/definitions/CartSummary'})
+        daily = schema['paths']['/reports/sales/daily/']['get']  # Wrapped by method_decorator
+        self.assertEqual([parameter['name'] for parameter in daily['parameters']][:2], ['start', 'end'])
+
+
+class CrossShardConstraintTests(UnshardedCustomersMixin, TestCase):
+    def test_default_database_keeps_customer_and_product_foreign_keys(self):
+        self.assertEqual(foreign_key_columns(DEFAULT_DB_ALIAS, 'shop_cart_item'), {'customer_id', 'product_id'})
+        self.assertEqual(foreign_key_columns(DEFAULT_DB_ALIAS, 'shop_order_item'), {'order_id', 'product_id'})
+        archive = foreign_key_columns(DEFAULT_DB_ALIAS, ArchivedTransaction._meta.db_table)
+        self.assertEqual('payment_method_id' in archive, not settings.DATABASE_SHARDS)
+
+
+class ShardVendorTests(TestCase):
+    def test_shards_without_id_ranges_are_refused(self):
+        with override_settings(DATABASE_SHARDS=[DEFAULT_DB_ALIAS]):
+            check_shard_vendors()
+            with mock.patch.object(connections[DEFAULT_DB_ALIAS], 'vendor', 'oracle'):
+                with self.assertRaises(ImproperlyConfigured):
+                    check_shard_vendors()
+
+
+# Run with e.g. DATABASE_SHARD_URLS=sqlite:///shard1.sqlite3,sqlite:///shard2.sqlite3
+@skipUnless(len(settings.DATABASE_SHARDS) >= 2, "needs two shards in DATABASE_SHARD_URLS")
+@override_settings(SHARD_MOVE_GRACE_SECONDS=0)
+class ShardingTests(APITestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        caches['default'].clear()
+        for alias in settings.DATABASE_SHARDS:
+            reserve_id_range(alias)
+        self.category = Category.objects.create(name='Sharded')
+        self.jam = Product.objects.create(name='Jam', description='', price=Decimal('4.00'), stock=10,
+                                          category=self.category)
+
+    def customer(self, name, phone, shard):
+        with self.settings(SHARD_NEW_CUSTOMERS=[shard]):
+            return Customer.objects.create_user(name, f"{name}@example.com", 'x', phone_number=phone)
+
+    def test_shards_do_not_constrain_keys_to_the_default_database(self):
+        self.assertEqual(foreign_key_columns('shard_1', 'shop_cart_item'), set())
+        self.assertEqual(foreign_key_columns('shard_2', 'shop_order_item'), {'order_id'})
+        self.assertEqual(foreign_key_columns('shard_2', 'shop_transaction'), {'order_id', 'payment_method_id'})
+
+    def test_customer_rows_live_on_their_shard(self):
+        customer = self.customer('shard2', '+1208', 'shard_2')
+        self.assertEqual(CustomerShard.objects.get(customer=customer).alias, 'shard_2')
+        self.client.force_authenticate(customer)
+
+        response = self.client.post(reverse('address-list'), {
+            'street': '1 Main St', 'city': 'Town', 'state': 'ST', 'postal_code': '1', 'country': 'NL'
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Address.objects.using('shard_2').filter(customer_id=customer.pk).exists())
+        self.assertFalse(Address.objects.using('default').filter(customer_id=customer.pk).exists())
+
+        # Cart lines on the shard, priced and reserved against products on the default database
+        summary = self.client.post(reverse('cartitem-batch'),
+                                   {'items': [{'product': self.jam.pk, 'quantity': 3}]}, format='json').data
+        self.assertEqual(summary['subtotal'], '12.00')
+        self.assertEqual(CartItem.objects.using('shard_2').get(customer_id=customer.pk).quantity, 3)
+        self.jam.refresh_from_db()
+        self.assertEqual(self.jam.stock, 7)
+        self.assertEqual(self.client.get(reverse('cartitem-list')).data[0]['product_name'], 'Jam')
+
+        order = Order.objects.create(customer=customer)
+        self.assertGreaterEqual(order.pk, 2 * settings.SHARD_ID_SPAN)
+        OrderItem.objects.create(order=order, product=self.jam, quantity=1, price=Decimal('4.00'))
+        data = self.client.get(reverse('order-list'), {'expand': 'order_items.product'}).data
+        self.assertEqual(data[0]['order_items'][0]['product']['name'], 'Jam')
+
+    def test_staff_fan_out_and_move(self):
+        first = self.customer('shard1', '+1209', 'shard_1')
+        second = self.customer('shard2b', '+1210', 'shard_2')
+        older = Order.objects.create(customer=first)
+        newer = Order.objects.create(customer=second)
+        OrderItem.objects.create(order=older, product=self.jam, quantity=2, price=Decimal('4.00'))
+        Address.objects.create(customer=first, street='2 Side St', city='Town', state='ST', postal_code='2',
+                               country='NL')
+
+        staff = Customer.objects.create_superuser('boss', 'boss@example.com', 'x', phone_number='+1211')
+        self.client.force_authenticate(staff)
+        data = self.client.get(reverse('order-list')).data
+        self.assertEqual([row['order_id'] for row in data], [newer.pk, older.pk])
+        self.assertEqual(self.client.get(reverse('order-detail', args=[older.pk])).status_code, 200)
+
+        # A page reads each shard only up to its end
+        with mock.patch.object(OrderViewSet, 'pagination_class', LimitOffsetPagination), \
+                CaptureQueriesContext(connections['shard_1']) as queries:
+            page = self.client.get(reverse('order-list'), {'limit': 1, 'offset': 1}).data
+        self.assertEqual((page['count'], [row['order_id'] for row in page['results']]), (2, [older.pk]))
+        self.assertTrue(any('LIMIT 2' in query['sql'] for query in queries))
+
+        call_command('move_customer', str(first.pk), to='shard_2', stdout=StringIO())
+        self.assertEqual(shard_for(first.pk), 'shard_2')
+        self.assertFalse(Order.objects.using('shard_1').filter(customer_id=first.pk).exists())
+        moved = Order.objects.using('shard_2').get(pk=older.pk)
+        self.assertEqual(moved.order_items.get().quantity, 2)
+        self.assertEqual(Address.objects.using('shard_2').filter(customer_id=first.pk).count(), 1)
+
+        self.client.force_authenticate(first)
+        data = self.client.get(reverse('order-list')).data
+        self.assertEqual([row['order_id'] for row in data], [older.pk])
+
+    def test_staff_customer_list_prefetches_from_each_shard(self):
+        first = self.customer('nested1', '+1217', 'shard_1')
+        second = self.customer('nested2', '+1218', 'shard_2')
+        orders = {customer.pk: Order.objects.create(customer=customer).pk for customer in (first, second)}
+        CartItem.objects.create(customer=second, product=self.jam, quantity=2)
+
+        self.client.force_authenticate(Customer.objects.create_superuser('lead', 'lead@example.com', 'x',
+                                                                         phone_number='+1219'))
+        rows = {row['customer_id']: row for row in self.client.get(reverse('customer-list')).data}
+        for customer in (first, second):
+            self.assertEqual([order['order_id'] for order in rows[customer.pk]['orders']], [orders[customer.pk]])
+        self.assertEqual([line['quantity'] for line in rows[second.pk]['cart_items']], [2])
+        self.assertEqual(rows[first.pk]['cart_items'], [])
+
+    @override_settings(BULK_ACTION_SYNC_LIMIT=2, BULK_ACTION_CHUNK_SIZE=2)
+    def test_admin_and_bulk_actions_reach_every_shard(self):
+        first = self.customer('admin1', '+1214', 'shard_1')
+        second = self.customer('admin2', '+1215', 'shard_2')
+        orders = [Order.objects.create(customer=customer) for customer in (first, second, first)]
+        self.client.force_login(Customer.objects.create_superuser('chief', 'chief@example.com', 'x',
+                                                                  phone_number='+1216'))
+
+        changelist = self.client.get(reverse('admin:shop_order_changelist')).context['cl']
+        self.assertEqual(changelist.result_count, 3)
+        self.assertEqual([order.pk for order in changelist.result_list], sorted((o.pk for o in orders), reverse=True))
+        self.assertEqual(self.client.get(reverse('admin:shop_order_change', args=[orders[1].pk])).status_code, 200)
+        response = self.client.get(reverse('admin:shop_customer_change', args=[second.pk]))
+        self.assertContains(response, reverse('admin:shop_order_change', args=[orders[1].pk]))  # Order inline
+
+        url = reverse('admin:shop_order_changelist')
+        self.client.post(url, {'action': 'mark_cancelled', '_selected_action': [orders[0].pk, orders[1].pk]})
+        self.client.post(url, {'action': 'mark_completed', '_selected_action': [order.pk for order in orders]})
+        run_bulk_job(BulkJob.objects.get().pk)
+        self.assertEqual(BulkJob.objects.get().updated, 3)
+        self.assertEqual([Order.objects.using(alias).get(pk=order.pk).status
+                          for alias, order in zip(('shard_1', 'shard_2', 'shard_1'), orders)], ['COMPLETED'] * 3)
+
+    def test_deleting_a_product_cleans_up_the_shards(self):
+        customer = self.customer('shard1b', '+1212', 'shard_1')
+        bread = Product.objects.create(name='Bread', description='', price=Decimal('3.00'), stock=5,
+                                       category=self.category)
+        self.client.force_authenticate(customer)
+        self.client.post(reverse('cartitem-batch'), {'items': [
+            {'product': self.jam.pk, 'quantity': 1}, {'product': bread.pk, 'quantity': 1},
+        ]}, format='json')
+        ProductRating.objects.create(customer=customer, product=bread, rating=5)
+
+        # A line whose product is gone from the default database but not yet from the shard
+        CartItem.objects.using('shard_1').create(customer_id=customer.pk, product_id=999999, quantity=1)
+        self.assertEqual(self.client.get(reverse('cartitem-summary')).data['subtotal'], '7.00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bread.delete()
+        self.assertEqual(list(CartItem.objects.using('shard_1').values_list('product_id', flat=True).order_by('id')),
+                         [self.jam.pk, 999999])
+        self.assertFalse(ProductRating.objects.using('shard_1').exists())
+        self.assertEqual(self.client.get(reverse('cartitem-summary')).data['subtotal'], '4.00')
+
+    def test_writes_are_refused_while_moving(self):
+        customer = self.customer('mover', '+1213', 'shard_1')
+        Address.objects.create(customer=customer, street='3 Side St', city='Town', state='ST', postal_code='3',
+                               country='NL')
+        CustomerShard.objects.filter(customer=customer).update(moving_from='shard_1')
+        self.client.force_authenticate(customer)
+        self.assertEqual(len(self.client.get(reverse('address-list')).data), 1)
+        response = self.client.post(reverse('cartitem-batch'), {'items': [{'product': self.jam.pk, 'quantity': 1}]},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        with self.assertRaises(CustomerMoving):
+            Order.objects.create(customer=customer)
+
+        # Running the move again finishes it
+        call_command('move_customer', str(customer.pk), to='shard_2', stdout=StringIO())
+        self.assertEqual(CustomerShard.objects.get(customer=customer).moving_from, '')
+        self.assertEqual(Address.objects.using('shard_2').filter(customer_id=customer.pk).count(), 1)
+        self.assertEqual(self.client.post(reverse('cartitem-batch'), {'items': [{'product': self.jam.pk, 'quantity': 1}]},
+                                          format='json').status_code, status.HTTP_200_OK)
@@ -0,0 +1,102 @@
+import logging
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import AnonRateThrottle, ScopedRateThrottle, SimpleRateThrottle
+
+logger = logging.getLogger(__name__)
+
+# Per-process buckets used while the shared cache is unreachable
+local_cache = LocMemCache('greencart-throttle', {'OPTIONS': {'MAX_ENTRIES': 10000}})
+
+
+def _take(cache, key, now, interval, capacity):
+    try:
+        tat = cache.incr(key, interval)
+    except ValueError:  # No bucket yet, i.e. it is full
+        if cache.add(key, now + interval, capacity // 1000 + 1):
+            return 0
+        tat = cache.incr(key, interval)
+    if tat - interval < now:
+        # Idle long enough for the bucket to refill completely: start again from now
+        cache.set(key, now + interval, capacity // 1000 + 1)
+        return 0
+    if tat - now > capacity:
+        cache.decr(key, interval)  # Rejected requests take no token
+        cache.touch(key, capacity // 1000 + 1)
+        return tat - now - capacity
+    if tat - now > capacity // 2:
+        # The key must outlive the drained bucket, or the client would get a fresh one
+        cache.touch(key, capacity // 1000 + 1)
+    return 0
+
+
+def take_token(key, now, interval, capacity):
+    """
+    Take one token from the bucket stored at `key` and return 0, or the milliseconds
+    until a token is available when the bucket is empty. Times are in integer ms.
+
+    The bucket is kept as a single counter, its "theoretical arrival time" (GCRA): every
+    request adds `interval` with an atomic increment and is allowed while the counter
+    stays within `capacity` of now. That is one cache round trip for most requests and
+    needs no locks. A client whose counter fell behind now gets a full bucket again.
+    """
+    try:
+        return _take(caches[settings.THROTTLE_CACHE], key, now, interval, capacity)
+    except Exception as exc:
+        logger.warning(f"Throttle cache unavailable, using per-process buckets: {exc}")
+        return _take(local_cache, key, now, interval, capacity)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle with a token bucket instead of a request history list. A rate of
+    'N/period' refills N tokens per period into a bucket holding N, so clients may burst
+    up to N requests and are then held to the steady rate.
+    """
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def get_rate(self):
+        # Read the rates on every request rather than once at import
+        self.THROTTLE_RATES = api_settings.DEFAULT_THROTTLE_RATES
+        return super().get_rate()
+
+    def allow_request(self, request, view):
+        self.wait_ms = 0
+        if self.rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+        interval = max(self.duration * 1000 // self.num_requests, 1)
+        now = int(self.timer() * 1000)
+        self.wait_ms = take_token(key, now, interval, interval * self.num_requests)
+        return not self.wait_ms
+
+    def wait(self):
+        return self.wait_ms / 1000 if self.wait_ms else None
+
+
+class AnonBucketThrottle(AnonRateThrottle, TokenBucketThrottle):
+    """
+    Anonymous requests, one bucket per client IP ('anon' rate).
+    """
+
+
+class CustomerBucketThrottle(TokenBucketThrottle):
+    """
+    Authenticated requests, one bucket per customer ('user' rate).
+    """
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not (request.user and request.user.is_authenticated):
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': request.user.pk}
+
+
+class ScopedBucketThrottle(ScopedRateThrottle, TokenBucketThrottle):
+    """
+    Views with a `throttle_scope`, one bucket per customer (or IP) and scope.
+    """
@@ -7,9 +7,10 @@ from .views import (
     ProductRecommendationViewSet, CartItemViewSet, AddressViewSet,
     CouponViewSet, RegisterView, LoginView, LogoutView, ChangePasswordView,
     CreatePaymentIntentView, StripeWebhookView, OrderListView, OrderDetailView, CreateOrderView,
-    CartItemDetailView, CartItemCreateView
+    CartItemDetailView, CartItemCreateView, SalesReportViewSet, OutboxEventFeedView,
+    order_status_stream, AuthTokenObtainPairView
 )
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 
 # Initialize the router
 router = DefaultRouter()
@@ -26,6 +27,7 @@ router.register(r'product-recommendations', ProductRecommendationViewSet, basena
 router.register(r'cart-items', CartItemViewSet, basename='cartitem')
 router.register(r'addresses', AddressViewSet, basename='address')
 router.register(r'coupons', CouponViewSet, basename='coupon')
+router.register(r'reports/sales', SalesReportViewSet, basename='salesreport')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -33,14 +35,16 @@ urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
     # JWT Authentication endpoints
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', AuthTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('change-password/', ChangePasswordView.as_view(), name='change_password'),
     path('create-payment-intent/', CreatePaymentIntentView.as_view(), name='create_payment_intent'),
     path('stripe-webhook/', StripeWebhookView.as_view(), name='stripe_webhook'),
+    path('events/', OutboxEventFeedView.as_view(), name='event-feed'),
     path('orders/', OrderListView.as_view(), name='order-list'),
     path('orders/<int:id>/', OrderDetailView.as_view(), name='order-detail'),
     path('orders/create/', CreateOrderView.as_view(), name='order-create'),
+    path('orders/<int:pk>/stream/', order_status_stream, name='order-stream'),
     path('cart-items/<int:pk>/', CartItemDetailView.as_view(), name='cartitem-detail'),
     path('cart-items/', CartItemCreateView.as_view(), name='cartitem-create'),
 ]
@@ -1,6 +1,6 @@
 import uuid
 import logging
-import stripe
+from datetime import timedelta
 from rest_framework import viewsets, status, generics, serializers, permissions
 from rest_framework.serializers import Serializer as EmptySerializer
 from rest_framework.permissions import IsAuthenticated, AllowAny
@@ -11,11 +11,11 @@ from django.core.exceptions import ValidationError
 from django.shortcuts import render, redirect
 from rest_framework.reverse import reverse
 from rest_framework_simplejwt.tokens import RefreshToken
-from drf_yasg.utils import swagger_auto_schema
 from .models import (
     Customer, CartItem, Order as ShopOrder, PaymentMethod, Transaction,
     Invoice, ProductRating, ProductRecommendation, Product, Category, Order,
-    OrderItem, Address, Coupon
+    OrderItem, Address, Coupon, ArchivedOrder, ArchivedTransaction, DailyProductSales, DailySalesTotal,
+    LowStockProduct, OutboxEvent
 )
 from .serializers import (
     CustomerSerializer, CartItemSerializer, OrderSerializer, PaymentMethodSerializer,
@@ -24,48 +24,118 @@ from .serializers import (
     ProductSerializer, ProductRecommendationSerializer, CategorySerializer,
     StockUpdateSerializer,
     AddressSerializer, CouponSerializer, RegisterSerializer, LoginSerializer,
-    OrderItemSerializer, EmptySerializer
+    OrderItemSerializer, EmptySerializer, ArchivedOrderSerializer, ArchivedTransactionSerializer,
+    SalesReportQuerySerializer, CartBatchSerializer, CartSummarySerializer, LowStockProductSerializer,
+    OutboxEventSerializer, RelatedProductSerializer
 )
 from django.utils import timezone
 from rest_framework.decorators import action
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth.password_validation import validate_password
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from django.db.models import Sum
+from .conditional import versioned_condition, coupon_validity_window
+from .tasks import task, send_order_confirmation
+from .invoices import document_response, render_invoice
+from .routers import ReplicaReadMixin
+from .schema import swagger_auto_schema
+from .carts import apply_cart_lines, cart_summary
+from .facets import cached_facets
+from .filters import ProductFilter
+from .stock import adjust_stock, set_stock
+from .pubsub import OrderStreamToken, load_snapshot, order_status_events, sse
+from .idempotency import idempotent, HEADER as IDEMPOTENCY_HEADER
+from .payments import get_stripe
+from .related import related_products
+from .sparse import SparseQuerysetMixin, parse_paths, project, sparse_queryset
+from .batch import absolute_urls, batch_get, parse_ids
+from .sharding import ShardFanOutMixin, atomic as shard_atomic, bind_shard, locate
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 
 User = get_user_model()
 
 logger = logging.getLogger(__name__)
 
-# Stripe API Configuration
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
 # Utility Functions
 def generate_tracking_number():
     return f"TRACK-{uuid.uuid4().hex.upper()[:10]}"  # Example implementation
 
+@task(max_attempts=5)
 def handle_payment_intent_succeeded(payment_intent):
-    try:
-        transaction = Transaction.objects.get(stripe_payment_intent_id=payment_intent['id'])
-        order = transaction.order
-        order.status = 'COMPLETED'
-        order.tracking_number = generate_tracking_number()
-        order.save()
-        logger.info(f"Order {order.id} marked as COMPLETED.")
-    except Transaction.DoesNotExist:
-        logger.error(f"No transaction found for PaymentIntent ID {payment_intent['id']}")
+    """
+    Record the payment and complete the order. Runs on the task workers; Stripe may
+    deliver the same event more than once, so it is safe to run repeatedly.
+    """
+    order_id = payment_intent['metadata'].get('order_id')
+    with bind_shard(locate(Order, order_id)), shard_atomic():
+        try:
+            order = Order.objects.select_for_update().get(id=order_id)
+        except Order.DoesNotExist:
+            logger.error(f"No order {order_id} found for PaymentIntent ID {payment_intent['id']}")
+            return
+        Transaction.objects.get_or_create(
+            stripe_payment_intent_id=payment_intent['id'],
+            defaults={
+                'order': order,
+                'payment_method': None,  # Update if applicable
+                'customer_id': order.customer_id,
+                'amount': payment_intent['amount'] / 100,
+            },
+        )
+        if order.status != 'COMPLETED':
+            order.status = 'COMPLETED'
+            order.tracking_number = order.tracking_number or generate_tracking_number()
+            order.save()
+            send_order_confirmation.delay(order.id)
+            logger.info(f"Order {order.id} marked as COMPLETED.")
+
+class PDFRenderer(BaseRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
 
 # API Endpoints
 
+def batch_response(request, kind, queryset, serializer_class, visible=None, url_fields=()):
+    """
+    `?ids=` resolved through the per-object cache, in request order. Cached representations
+    are the full ones, rendered without the request: `url_fields` are made absolute and
+    `?fields=` is applied afterwards. `?expand=` embeds other rows, which the cache does
+    not track, so expanded requests are read from the database.
+    """
+    ids = parse_ids(request.query_params.get('ids'))
+    context = {'request': request}
+    if request.query_params.get('expand'):
+        objects = sparse_queryset(queryset, serializer_class(context=context)).in_bulk(ids)
+        found = [objects[pk] for pk in ids if pk in objects]
+        return Response({
+            'results': serializer_class(found, many=True, context=context).data,
+            'missing': [pk for pk in ids if pk not in objects],
+        })
+    results, missing = batch_get(kind, ids, queryset, lambda obj: serializer_class(obj).data, visible)
+    fields = parse_paths(request.query_params.get('fields'))
+    return Response({
+        'results': [project(absolute_urls(request, item, url_fields), fields) for item in results],
+        'missing': missing,
+    })
+
 # Homepage View
 def homepage(request):
     return render(request, 'endpoint_homepage.html')  # Ensure 'endpoint_homepage.html' exists
 
-class CartItemViewSet(viewsets.ModelViewSet):
-    queryset = CartItem.objects.all()
+class CartItemViewSet(SparseQuerysetMixin, ShardFanOutMixin, viewsets.ModelViewSet):
+    queryset = CartItem.objects.select_related('product')
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
 
@@ -77,33 +147,53 @@ class CartItemViewSet(viewsets.ModelViewSet):
         return self.queryset.filter(customer=self.request.user)
 
     def perform_create(self, serializer):
+        # Adding a product already in the cart increases that line's quantity
         product = serializer.validated_data['product']
-        quantity = serializer.validated_data['quantity']
-        if product.stock < quantity:
-            raise serializers.ValidationError("Not enough stock available.")
-        product.stock -= quantity
-        product.save()
-        serializer.save(customer=self.request.user)
+        apply_cart_lines(self.request.user, [(product.id, serializer.validated_data['quantity'])])
+        serializer.instance = CartItem.objects.get(customer=self.request.user, product=product)
+
+    @swagger_auto_schema(request_body=CartBatchSerializer, responses={200: CartSummarySerializer})
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Add or set many cart lines in one request and return the whole priced cart.
+        """
+        serializer = CartBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = [(line['product'], line['quantity']) for line in serializer.validated_data['items']]
+        apply_cart_lines(request.user, lines, mode=serializer.validated_data['mode'])
+        return Response(CartSummarySerializer(cart_summary(request.user.pk)).data)
+
+    @swagger_auto_schema(responses={200: CartSummarySerializer})
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """
+        The priced cart: per-line price and subtotal, applied coupon (`?coupon=CODE`) and total.
+        """
+        summary = cart_summary(request.user.pk, request.query_params.get('coupon'))
+        return Response(CartSummarySerializer(summary).data)
 
     def perform_update(self, serializer):
         instance = self.get_object()
         product = serializer.validated_data['product']
         new_quantity = serializer.validated_data['quantity']
-        old_quantity = instance.quantity
-        quantity_difference = new_quantity - old_quantity
-        if product.stock < quantity_difference:
-            raise serializers.ValidationError("Not enough stock available.")
-        product.stock -= quantity_difference
-        product.save()
-        serializer.save()
+        if product != instance.product and self.get_queryset().filter(
+            customer=instance.customer, product=product
+        ).exists():
+            raise serializers.ValidationError("This product is already in the cart.")
+        # Return the old reservation and take the new one; the product may have changed
+        changes = {instance.product_id: instance.quantity}
+        changes[product.id] = changes.get(product.id, 0) - new_quantity
+        with shard_atomic(instance._state.db):
+            adjust_stock(changes)
+            serializer.save()
 
     def perform_destroy(self, instance):
-        product = instance.product
-        product.stock += instance.quantity
-        product.save()
-        instance.delete()
+        with shard_atomic(instance._state.db):
+            adjust_stock({instance.product_id: instance.quantity})
+            instance.delete()
 
-class CartItemDetailView(generics.RetrieveAPIView):
+class CartItemDetailView(SparseQuerysetMixin, generics.RetrieveAPIView):
     queryset = CartItem.objects.all()
     serializer_class = CartItemSerializer
     permission_classes = [permissions.IsAuthenticated]  # Ensure only authenticated users can access
@@ -115,7 +205,12 @@ class CartItemCreateView(generics.CreateAPIView):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)  # Associate cart item with the authenticated user
 
-class OrderViewSet(viewsets.ModelViewSet):
+# Tables embedded in orders by ?expand=, which the order counters do not cover
+ORDER_EXPANSIONS = {'order_items.product': ('shop_product',), 'order_items.product.category': ('shop_category',)}
+
+@method_decorator(versioned_condition('shop_order', 'shop_order_item', per_user=True,
+                                      expanded=ORDER_EXPANSIONS), name='retrieve')
+class OrderViewSet(SparseQuerysetMixin, ShardFanOutMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
@@ -123,20 +218,78 @@ class OrderViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Order.objects.none()
+        queryset = ArchivedOrder.objects.all() if self.action == 'archived' else self.queryset
         if self.request.user.is_staff:
-            return self.queryset  # Admin users can see all orders
-        return self.queryset.filter(customer=self.request.user)
+            return queryset  # Admin users can see all orders
+        return queryset.filter(customer=self.request.user)
+
+    @action(detail=False, methods=['get'], serializer_class=ArchivedOrderSerializer)
+    def archived(self, request):
+        """
+        Orders moved to the archive by `archive_orders`, listed like the live ones: same
+        filters, ordering, `?fields=` and pagination.
+        """
+        return self.list(request)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
 
     def perform_create(self, serializer):
-        order = serializer.save(customer=self.request.user)
-        for item in order.order_items.all():
-            product = item.product
-            if product.stock < item.quantity:
-                raise serializers.ValidationError(f"Not enough stock for {product.name}.")
-            product.stock -= item.quantity
-            product.save()
-
-class PaymentMethodViewSet(viewsets.ModelViewSet):
+        with shard_atomic():
+            order = serializer.save(customer=self.request.user)
+            changes = {}
+            for item in order.order_items.all():
+                changes[item.product_id] = changes.get(item.product_id, 0) - item.quantity
+            adjust_stock(changes)
+
+    @action(detail=True, methods=['post'], url_path='stream-token')
+    def stream_token(self, request, pk=None):
+        """
+        Token for `/orders/{id}/stream/?token=`: it opens this order's status stream only and
+        expires after ORDER_STREAM_TOKEN_LIFETIME seconds, so no access token ends up in URLs.
+        """
+        order = self.get_object()
+        token = OrderStreamToken.for_order(order.pk, request.user)
+        return Response({
+            'token': str(token),
+            'expires_in': settings.ORDER_STREAM_TOKEN_LIFETIME,
+            'stream_url': f"{reverse('order-stream', args=[order.pk], request=request)}?token={token}",
+        })
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """
+        Cancel a pending order and return its items to stock.
+        """
+        with shard_atomic():
+            order = self.get_queryset().select_for_update().filter(pk=pk).first()
+            if order is None:
+                return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+            if order.status != 'PENDING':
+                return Response({'error': f"Order is {order.status.lower()} and cannot be cancelled."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            changes = {}
+            for product_id, quantity in order.order_items.values_list('product_id', 'quantity'):
+                changes[product_id] = changes.get(product_id, 0) + quantity
+            adjust_stock(changes)
+            order.status = 'CANCELLED'
+            order.save()
+        return Response(OrderSerializer(order).data)
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """
+        Several orders in one request: `?ids=3,1,2` (up to BATCH_MAX_IDS). Results keep the
+        order of `ids`; ids that do not exist or belong to someone else are listed in `missing`.
+        """
+        user = request.user
+        return batch_response(
+            request, 'order', self.get_queryset().prefetch_related('order_items'), OrderSerializer,
+            visible=lambda data: user.is_staff or data['customer_id'] == user.pk,
+        )
+
+class PaymentMethodViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = PaymentMethod.objects.all()
     serializer_class = PaymentMethodSerializer
     permission_classes = [IsAuthenticated]
@@ -149,7 +302,7 @@ class PaymentMethodViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(customer=self.request.user)
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(SparseQuerysetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Transaction.objects.all()
     serializer_class = TransactionSerializer
     permission_classes = [IsAuthenticated]
@@ -157,14 +310,22 @@ class TransactionViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Transaction.objects.none()
-        return self.queryset.filter(customer=self.request.user)
+        queryset = ArchivedTransaction.objects.all() if self.action == 'archived' else self.queryset
+        return queryset.filter(customer=self.request.user)
+
+    @action(detail=False, methods=['get'], serializer_class=ArchivedTransactionSerializer)
+    def archived(self, request):
+        """
+        Transactions of archived orders, listed like the live ones.
+        """
+        return self.list(request)
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [permissions.IsAdminUser]
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+class InvoiceViewSet(SparseQuerysetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing invoices.
     """
@@ -177,7 +338,21 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             return Invoice.objects.none()
         return self.queryset.filter(customer=self.request.user)
 
-class ProductRatingViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'], renderer_classes=[JSONRenderer, PDFRenderer])
+    def download(self, request, pk=None):
+        """
+        Serve the cached invoice PDF (with Range support). Documents are never rendered in
+        the request: if none is ready yet, rendering is queued and 202 is returned.
+        """
+        invoice = self.get_object()
+        if not invoice.document:
+            render_invoice.delay(invoice.pk)
+            response = JsonResponse({'status': 'rendering'}, status=status.HTTP_202_ACCEPTED)
+            response['Retry-After'] = '5'
+            return response
+        return document_response(request, invoice.document, f"invoice-{invoice.pk}.pdf")
+
+class ProductRatingViewSet(SparseQuerysetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing product ratings.
     """
@@ -190,38 +365,94 @@ class ProductRatingViewSet(viewsets.ModelViewSet):
             return ProductRating.objects.none()
         return self.queryset.filter(customer=self.request.user)
 
-class ProductRecommendationViewSet(viewsets.ModelViewSet):
-    queryset = ProductRecommendation.objects.all()
+class ProductRecommendationViewSet(SparseQuerysetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
+    queryset = ProductRecommendation.objects.select_related('product', 'recommended_product')
     serializer_class = ProductRecommendationSerializer
     filterset_fields = ['product__name', 'recommended_product__name']
     search_fields = ['product__name', 'recommended_product__name']
     ordering_fields = ['product__name']
 
-class ProductViewSet(viewsets.ModelViewSet):
+@method_decorator(versioned_condition('shop_product', 'shop_category'), name='list')
+@method_decorator(versioned_condition('shop_product', expanded={'category': ('shop_category',)}), name='retrieve')
+class ProductViewSet(SparseQuerysetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    filterset_fields = ['category__name', 'price']
+    filterset_class = ProductFilter
+    throttle_scope = 'catalog'
     search_fields = ['name', 'description']
     ordering_fields = ['price', 'created_at']
 
+    def list(self, request, *args, **kwargs):
+        """
+        With `?facets=true` the results come wrapped together with category, price range
+        and availability counts for the same filters.
+        """
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets', '').lower() in ('1', 'true', 'yes'):
+            facets = cached_facets(request, self.filter_queryset(self.get_queryset()))
+            if isinstance(response.data, dict):
+                response.data['facets'] = facets
+            else:
+                response.data = {'results': response.data, 'facets': facets}
+        return response
+
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def update_stock(self, request, pk=None):
         product = self.get_object()
         serializer = StockUpdateSerializer(data=request.data)
         if serializer.is_valid():
-            product.stock = serializer.validated_data['stock']
-            product.save()
-            return Response({'status': 'stock updated', 'stock': product.stock})
+            stock = set_stock(product.pk, serializer.validated_data['stock'])
+            return Response({'status': 'stock updated', 'stock': stock})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+    @swagger_auto_schema(responses={200: LowStockProductSerializer(many=True)})
+    @action(detail=False, methods=['get'], url_path='low-stock', permission_classes=[permissions.IsAdminUser])
+    def low_stock(self, request):
+        """
+        Products at or below their reorder point, read from the low-stock index.
+        Filter with `?level=LOW` or `?level=OUT`.
+        """
+        queryset = LowStockProduct.objects.select_related('product')
+        level = request.query_params.get('level')
+        if level:
+            queryset = queryset.filter(level=level.upper())
+        return Response(LowStockProductSerializer(queryset, many=True).data)
+
+    @swagger_auto_schema(responses={200: RelatedProductSerializer(many=True)})
+    @action(detail=True, methods=['get'])
+    def related(self, request, pk=None):
+        """
+        Compact related products (id, name, price, thumbnail, in-stock flag), served from a
+        per-product cached blob. `?limit=` returns fewer than RELATED_PRODUCTS_LIMIT.
+        """
+        try:
+            limit = int(request.query_params.get('limit', settings.RELATED_PRODUCTS_LIMIT))
+        except ValueError:
+            return Response({'limit': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        items = related_products(int(pk)) if pk.isdigit() else None
+        if items is None:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'product_id': int(pk), 'results': items[:max(limit, 0)]})
+
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """
+        Several products in one request: `?ids=3,1,2` (up to BATCH_MAX_IDS). Results keep the
+        order of `ids`; unknown ids are listed in `missing`.
+        """
+        return batch_response(request, 'product', self.get_queryset(), ProductSerializer,
+                              url_fields=('image', 'image_variants'))
+
+@method_decorator(versioned_condition('shop_category'), name='list')
+@method_decorator(versioned_condition('shop_category'), name='retrieve')
+class CategoryViewSet(SparseQuerysetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     filterset_fields = ['name']
     search_fields = ['name', 'description']
     ordering_fields = ['created_at']
 
-class AddressViewSet(viewsets.ModelViewSet):
+class AddressViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = Address.objects.all()
     serializer_class = AddressSerializer
     filterset_fields = ['customer__username', 'city', 'country']
@@ -237,7 +468,9 @@ class AddressViewSet(viewsets.ModelViewSet):
         serializer.save(customer=self.request.user)
         logger.info(f"Address created for user: {self.request.user.email}")
 
-class CouponViewSet(viewsets.ModelViewSet):
+@method_decorator(versioned_condition('shop_coupon', window=coupon_validity_window), name='list')
+@method_decorator(versioned_condition('shop_coupon', window=coupon_validity_window), name='retrieve')
+class CouponViewSet(SparseQuerysetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Coupon.objects.all()
     serializer_class = CouponSerializer
     filterset_fields = ['code', 'active']
@@ -247,11 +480,130 @@ class CouponViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Coupon.objects.none()
-        return Coupon.objects.filter(active=True, valid_from__lte=timezone.now(), valid_to__gte=timezone.now())
+        now = timezone.now()
+        return Coupon.objects.filter(active=True, valid_from__lte=now, valid_to__gte=now)
+
+SALES_ROLLUP_TABLES = ('shop_daily_product_sales', 'shop_daily_sales_total')
+
+@method_decorator(versioned_condition(*SALES_ROLLUP_TABLES), name='daily')
+@method_decorator(versioned_condition(*SALES_ROLLUP_TABLES), name='categories')
+@method_decorator(versioned_condition(*SALES_ROLLUP_TABLES), name='top_products')
+class SalesReportViewSet(ReplicaReadMixin, viewsets.ViewSet):
+    """
+    Read-only sales dashboards served from the daily rollup tables, so the cost depends
+    on the date range rather than on the order history.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get_params(self, request):
+        serializer = SalesReportQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    @swagger_auto_schema(query_serializer=SalesReportQuerySerializer)
+    @action(detail=False, methods=['get'])
+    def daily(self, request):
+        params = self.get_params(request)
+        rows = DailySalesTotal.objects.filter(date__range=(params['start'], params['end'])).order_by('date')
+        results = list(rows.values('date', 'orders', 'units', 'revenue', 'transactions', 'payments'))
+        totals = rows.aggregate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'),
+                                transactions=Sum('transactions'), payments=Sum('payments'))
+        return Response({'start': params['start'], 'end': params['end'], 'totals': totals, 'results': results})
+
+    @swagger_auto_schema(query_serializer=SalesReportQuerySerializer)
+    @action(detail=False, methods=['get'])
+    def categories(self, request):
+        params = self.get_params(request)
+        results = (
+            DailyProductSales.objects.filter(date__range=(params['start'], params['end']))
+            .values('category_id', 'category__name')
+            .annotate(units=Sum('units'), revenue=Sum('revenue'))
+            .order_by('-revenue')
+        )
+        return Response({'start': params['start'], 'end': params['end'], 'results': list(results)})
+
+    @swagger_auto_schema(query_serializer=SalesReportQuerySerializer)
+    @action(detail=False, methods=['get'], url_path='top-products')
+    def top_products(self, request):
+        params = self.get_params(request)
+        results = (
+            DailyProductSales.objects.filter(date__range=(params['start'], params['end']))
+            .values('product_id', 'product__name')
+            .annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+            .order_by(f"-{params['order_by']}", 'product_id')[:params['limit']]
+        )
+        return Response({'start': params['start'], 'end': params['end'], 'results': list(results)})
+
+def stream_user(request, order_id):
+    """
+    Authenticate a stream request by an order stream token (`token` query parameter, since
+    EventSource cannot send headers) or a JWT header, falling back to the session.
+    """
+    auth = JWTAuthentication()
+    try:
+        raw_token = request.GET.get('token')
+        if raw_token:
+            token = OrderStreamToken(raw_token)
+            return auth.get_user(token) if token.get('order_id') == order_id else None
+        result = auth.authenticate(request)
+    except (TokenError, InvalidToken, AuthenticationFailed):
+        return None
+    if result:
+        return result[0]
+    return request.user if request.user.is_authenticated else None
+
+async def order_status_stream(request, pk):
+    """
+    Server-sent events with the status and tracking number of one of the customer's
+    orders, replacing client polling of /orders/{id}/. Streams under ASGI; under WSGI it
+    sends the current state and the client reconnects after ORDER_STREAM_POLL_MS.
+    """
+    user = await sync_to_async(stream_user)(request, pk)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    snapshot = await sync_to_async(load_snapshot)(pk, user)
+    if snapshot is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    if not isinstance(request, ASGIRequest):
+        # A WSGI worker would be held for the whole stream and send nothing until it ended
+        response = HttpResponse(f"retry: {settings.ORDER_STREAM_POLL_MS}\n" + sse('status', snapshot),
+                                content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+    response = StreamingHttpResponse(order_status_events(pk, user, snapshot), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
+
+class OutboxEventFeedView(generics.GenericAPIView):
+    """
+    Cursor feed of order, transaction and stock events for other services: pass the last
+    `id` seen as `after` and keep polling with the returned `next_cursor`.
+    """
+    serializer_class = OutboxEventSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        try:
+            after = int(request.query_params.get('after', 0))
+            limit = min(int(request.query_params.get('limit', 100)), 1000)
+        except ValueError:
+            return Response({'error': 'after and limit must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+        settled = timezone.now() - timedelta(seconds=settings.OUTBOX_CURSOR_LAG_SECONDS)
+        events = OutboxEvent.objects.filter(id__gt=after, created_at__lte=settled).order_by('id')
+        topic = request.query_params.get('topic')
+        if topic:
+            events = events.filter(topic__startswith=topic)
+        events = list(events[:limit])
+        return Response({
+            'events': self.get_serializer(events, many=True).data,
+            'next_cursor': events[-1].id if events else after,
+        })
 
 @method_decorator(csrf_exempt, name='dispatch')
 class RegisterView(generics.GenericAPIView):
     serializer_class = RegisterSerializer
+    throttle_scope = 'auth'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -264,6 +616,7 @@ class RegisterView(generics.GenericAPIView):
 class LoginView(generics.GenericAPIView):
     serializer_class = LoginSerializer
     permission_classes = [AllowAny]
+    throttle_scope = 'auth'
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -277,6 +630,9 @@ class LoginView(generics.GenericAPIView):
             'email': user.email,
         }, status=status.HTTP_200_OK)
 
+class AuthTokenObtainPairView(TokenObtainPairView):
+    throttle_scope = 'auth'  # Same password-guessing limit as /login/
+
 class LogoutView(generics.GenericAPIView):
     serializer_class = EmptySerializer
     permission_classes = (permissions.IsAuthenticated,)
@@ -297,7 +653,7 @@ class LogoutView(generics.GenericAPIView):
             return EmptySerializer
         return super().get_serializer_class()
 
-class OrderItemViewSet(viewsets.ModelViewSet):
+class OrderItemViewSet(SparseQuerysetMixin, viewsets.ModelViewSet):
     queryset = OrderItem.objects.all()
     serializer_class = OrderItemSerializer
     filterset_fields = ['order__id', 'product__name']
@@ -325,19 +681,31 @@ class ChangePasswordView(APIView):
         return Response({'detail': 'Password changed successfully.'}, status=status.HTTP_200_OK)
 
 class CreatePaymentIntentView(APIView):
+    @idempotent
     def post(self, request):
+        stripe = get_stripe()
         try:
             amount = int(request.data.get('amount'))  # Amount in cents
             order_id = request.data.get('order_id')
             order = Order.objects.get(id=order_id)
             
+            options = {}
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if key:
+                # Stripe deduplicates too, so a retry after a lost response reuses the intent
+                options['idempotency_key'] = f"pi-{request.user.pk or 'anon'}-{key}"
             intent = stripe.PaymentIntent.create(
                 amount=amount,
                 currency='usd',
                 metadata={'order_id': order_id},
+                **options,
             )
             
             return Response({'client_secret': intent.client_secret}, status=status.HTTP_200_OK)
+        except (stripe.error.APIConnectionError, stripe.error.RateLimitError, stripe.error.APIError) as e:
+            # Transient provider failures: a 5xx is not stored under the Idempotency-Key, so a retry runs again
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': '1'})
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -347,6 +715,7 @@ class StripeWebhookView(APIView):
         payload = request.body
         sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
         event = None
+        stripe = get_stripe()
 
         try:
             event = stripe.Webhook.construct_event(
@@ -357,26 +726,19 @@ class StripeWebhookView(APIView):
         except stripe.error.SignatureVerificationError:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        # Handle the event
+        # Handle the event on the task workers so Stripe gets its 200 immediately
         if event['type'] == 'payment_intent.succeeded':
             payment_intent = event['data']['object']
-            order_id = payment_intent['metadata']['order_id']
-            order = Order.objects.get(id=order_id)
-            Transaction.objects.create(
-                order=order,
-                payment_method=None,  # Update if applicable
-                customer=order.customer,
-                transaction_id=payment_intent['id'],
-                amount=payment_intent['amount'] / 100,
-                stripe_payment_intent_id=payment_intent['id'],
-            )
-            order.status = 'COMPLETED'
-            order.save()
+            handle_payment_intent_succeeded.delay({
+                'id': payment_intent['id'],
+                'amount': payment_intent['amount'],
+                'metadata': dict(payment_intent['metadata']),
+            })
         # ... handle other event types ...
 
         return Response(status=status.HTTP_200_OK)
 
-class OrderListView(generics.ListAPIView):
+class OrderListView(SparseQuerysetMixin, ReplicaReadMixin, generics.ListAPIView):
     """
     API view to retrieve list of orders for the authenticated customer.
     """
@@ -388,7 +750,9 @@ class OrderListView(generics.ListAPIView):
             return Order.objects.none()
         return Order.objects.filter(customer=self.request.user)
 
-class OrderDetailView(generics.RetrieveAPIView):
+@method_decorator(versioned_condition('shop_order', 'shop_order_item', per_user=True,
+                                      expanded=ORDER_EXPANSIONS), name='get')
+class OrderDetailView(SparseQuerysetMixin, ReplicaReadMixin, generics.RetrieveAPIView):
     """
     API view to retrieve a specific order by ID for the authenticated customer.
     """
@@ -408,5 +772,10 @@ class CreateOrderView(generics.CreateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        serializer.save(customer=self.request.user)
\ No newline at end of file
+        with shard_atomic():  # With its outbox event; across shards, best effort (see shop.sharding.atomic)
+            serializer.save(customer=self.request.user)
\ No newline at end of file
@@ -2,26 +2,46 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+import functools
 from rest_framework import permissions
-from shop.views import homepage
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from shop.views import homepage, AuthTokenObtainPairView
+from rest_framework_simplejwt.views import TokenRefreshView
 from django.views.generic import TemplateView
 
-# Swagger and ReDoc schema view
-schema_view = get_schema_view(
-    openapi.Info(
-        title="GreenCart API",
-        default_version='v1',
-        description="API documentation for GreenCart",
-        terms_of_service="https://www.google.com/policies/terms/",
-        contact=openapi.Contact(email="contact@greencart.local"),
-        license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+# Swagger and ReDoc schema views, built on the first docs request so workers don't
+# import drf_yasg at startup
+@functools.lru_cache(maxsize=None)
+def schema_endpoint(renderer=None):
+    from drf_yasg import openapi
+    from drf_yasg.views import get_schema_view
+    from shop.schema import apply_schema_overrides
+
+    apply_schema_overrides()
+
+    schema_view = get_schema_view(
+        openapi.Info(
+            title="GreenCart API",
+            default_version='v1',
+            description="API documentation for GreenCart",
+            terms_of_service="https://www.google.com/policies/terms/",
+            contact=openapi.Contact(email="contact@greencart.local"),
+            license=openapi.License(name="BSD License"),
+        ),
+        public=True,
+        permission_classes=(permissions.AllowAny,),
+    )
+    if renderer is None:
+        return schema_view.without_ui(cache_timeout=0)
+    return schema_view.with_ui(renderer, cache_timeout=0)
+
+
+def schema_json(request, *args, **kwargs):
+    return schema_endpoint()(request, *args, **kwargs)
+
+
+def schema_redoc(request, *args, **kwargs):
+    return schema_endpoint('redoc')(request, *args, **kwargs)
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -34,12 +54,12 @@ urlpatterns = [
         ),
         name='swagger-ui'
     ),
-    path('swagger.json', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('swagger.json', schema_json, name='schema-json'),
+    path('redoc/', schema_redoc, name='schema-redoc'),
     path('accounts/', include('django.contrib.auth.urls')),  # Add Django auth URLs for login/logout and password reset
     path('', homepage, name='homepage'),  # Render the homepage
     # JWT Authentication endpoints
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', AuthTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     # Include the shop URLs without the /api/ prefix
     path('', include('shop.urls')),